@@ -1,4 +1,4 @@
-from .enrichment_result import load_enrichment_csv
+from .enrichment_result import load_enrichment_csv, load_enrichment_dataset
 from .enrichr import Enrichr
 
-__all__ = ['load_enrichment_csv', 'Enrichr']
+__all__ = ['load_enrichment_csv', 'load_enrichment_dataset', 'Enrichr']
@@ -1,20 +1,21 @@
 import os
 from collections import defaultdict
 
+import numpy as np
 import pandas as pd
 import requests
-from magine.enrichment.ontology_analysis import MagineGO
 
 from magine.data.storage import id_mapping_dir
-from magine.data.storage import network_data_dir
-
-try:
-    import cPickle as pickle
-except:
-    import pickle
+from magine.enrichment.deprecated.go_store import go_store_path, \
+    write_go_store
 
 
 def download_and_process_go(species='hsa'):
+    """ Download GO and gene2go annotations and write the GO store
+
+    The store is written to
+    magine.enrichment.deprecated.go_store.go_store_path(species).
+    """
     print("Creating GO files")
     from goatools import obo_parser
     obo_file = os.path.join(id_mapping_dir, 'go.obo')
@@ -25,79 +26,88 @@ def download_and_process_go(species='hsa'):
 
     go_aspect = dict()
     go_depth = dict()
-
-    dirname = network_data_dir
-
-    go_to_gene_name = os.path.join(dirname,
-                                   '{}_goids_to_genes.p'.format(species))
-    go_to_go_name = os.path.join(dirname,
-                                 '{}_goids_to_goname.p'.format(species))
-    gene_to_go_name = os.path.join(dirname, '{}_gene_to_go.p'.format(species))
-    go_depth_name = os.path.join(dirname, '{}_godepth.p'.format(species))
-    go_aspect_name = os.path.join(dirname, '{}_go_aspect.p'.format(species))
     for i in go_to_gene.keys():
         go_depth[i] = go[i].depth
         go_aspect[i] = go[i].namespace
 
-    pickle.dump(go_to_gene, open(go_to_gene_name, 'wb'))
-    pickle.dump(goid_to_name, open(go_to_go_name, 'wb'))
-    pickle.dump(go_depth, open(go_depth_name, 'wb'))
-    pickle.dump(go_aspect, open(go_aspect_name, 'wb'))
-
-    for i in go_to_gene:
-        term = i
-        genes = go_to_gene[i]
-        for g in genes:
-            if g in gene_to_go:
-                gene_to_go[g].add(term)
-            else:
-                gene_to_go[g] = set()
-                gene_to_go[g].add(term)
-    pickle.dump(gene_to_go, open(gene_to_go_name, 'wb'))
+    write_go_store(go_store_path(species), go_to_gene, goid_to_name, go_depth,
+                   go_aspect, species=species)
     print("Done creating GO files")
 
 
-def download_ncbi_gene_file(tax_ids=None):
+gene2go_url = "ftp://ftp.ncbi.nlm.nih.gov/gene/DATA/gene2go.gz"
+_gene2go_columns = ['#tax_id', 'GeneID', 'GO_ID', 'Evidence', 'Qualifier',
+                    'GO_term']
+
+
+def download_ncbi_gene_file(tax_ids=None, source=gene2go_url,
+                            chunk_size=500000):
     """ Downloads gene2go associations files from ncbi
 
+    The (multi-species) file is streamed in chunks of rows, only the needed
+    columns are parsed and rows of other species are dropped per chunk, so
+    memory is bounded by chunk_size and the annotations of tax_ids.
+
     Parameters
     ----------
     tax_ids : list
         list of tax ids to consider, default [9606], human
-    force_dnld
+    source : str
+        url or path of gene2go.gz
+    chunk_size : int
+        Number of rows parsed at a time
 
     Returns
     -------
-
+    id2gos : dict
+        gene symbol to set of GO ids
+    go2genes : dict
+        GO id to set of gene symbols
+    go2term : dict
+        GO id to GO term name
     """
 
-    from magine.mappings.gene_mapper import GeneMapper
-    gm = GeneMapper()
+    from magine.mappings.maps import gene_mapper
+    gm = gene_mapper()
+    symbols = dict()
+    n_multiple = 0
+    for gene_id, symbol in gm.ncbi_to_symbol.items():
+        if len(symbol) != 1:
+            n_multiple += 1
+        symbols[gene_id] = symbol[0]
+    symbols = pd.Series(symbols)
+    if n_multiple:
+        print("{} NCBI gene ids have more than one symbol, using the "
+              "first".format(n_multiple))
 
-    gene2go_url = "ftp://ftp.ncbi.nlm.nih.gov/gene/DATA/gene2go.gz"
-    print("Downloading gene2go assocations file")
-    r = pd.read_table(gene2go_url, compression='gzip')
+    if tax_ids is None:  # Default taxid is Human
+        tax_ids = {9606}
+    tax_ids = list(tax_ids)
 
     id2gos = defaultdict(set)
     go2term = dict()
     go2genes = defaultdict(set)
 
-    if tax_ids is None:  # Default taxid is Human
-        tax_ids = {9606}
-    for line in r.values:
-        t_id, gene_id, go_id, evidence, qual, go_term = line[:6]
-
-        t_id = int(t_id)
-        if t_id in tax_ids and qual != 'NOT' and evidence != 'ND':
-            gene_id = int(gene_id)
-            symbol = gm.ncbi_to_symbol[gene_id]
-            if len(symbol) == 1:
-                symbol = symbol[0]
-            else:
-                print(symbol)
+    print("Downloading gene2go assocations file")
+    reader = pd.read_csv(source, sep='\t', compression='gzip',
+                         usecols=_gene2go_columns, chunksize=chunk_size,
+                         dtype={'#tax_id': np.int64, 'GeneID': np.int64,
+                                'GO_ID': str, 'Evidence': str,
+                                'Qualifier': str, 'GO_term': str})
+    for chunk in reader:
+        chunk = chunk[chunk['#tax_id'].isin(tax_ids)
+                      & (chunk['Qualifier'] != 'NOT')
+                      & (chunk['Evidence'] != 'ND')]
+        if chunk.empty:
+            continue
+        chunk = chunk.assign(symbol=chunk['GeneID'].map(symbols))
+        chunk = chunk.dropna(subset=['symbol'])
+        pairs = chunk[['symbol', 'GO_ID']].drop_duplicates()
+        for symbol, go_id in pairs.values:
             go2genes[go_id].add(symbol)
             id2gos[symbol].add(go_id)
-            go2term[go_id] = go_term
+        go2term.update(chunk.drop_duplicates('GO_ID', keep='last')[
+            ['GO_ID', 'GO_term']].values)
 
     return id2gos, go2genes, go2term
 
@@ -128,6 +138,7 @@ def download_current_go(redownload=True):
 
 
 if __name__ == '__main__':
+    from magine.enrichment.deprecated.ontology_analysis import MagineGO
     # create_annotations()
     download_and_process_go()
     go = MagineGO('hsa')
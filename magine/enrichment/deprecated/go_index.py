@@ -0,0 +1,220 @@
+"""
+Precomputed ancestor closure of the GO DAG.
+
+Terms of a goatools GODag are numbered in topological order (by depth, so
+parents come before children) and the ancestors of every term, including
+itself, are stored once as a sparse matrix. Queries over a list of terms
+use a boolean matrix of terms by the union of their ancestors, with columns
+sorted deepest first, so common ancestors, deepest common ancestors and
+ancestor/descendant checks for all pairs are array operations instead of
+walks of the DAG.
+"""
+import numpy as np
+import scipy.sparse as sp
+
+# position of the highest set bit of each byte, as ordered by np.packbits
+_leading_zeros = np.array([8] + [8 - i.bit_length() for i in range(1, 256)],
+                          dtype=np.int64)
+
+
+class GOIndex(object):
+    """ Ancestor closure, depth and level arrays of a GO DAG
+
+    Parameters
+    ----------
+    go : goatools.obo_parser.GODag
+        dict of GO id (including alternative ids) to term records with
+        id, parents, depth and level
+
+    Attributes
+    ----------
+    ids : numpy.array
+        GO ids in topological order
+    depth : numpy.array
+        Longest distance to the root of each term
+    level : numpy.array
+        Shortest distance to the root of each term
+    parents : scipy.sparse.csr_matrix
+        Boolean matrix, row i holds the direct parents of term i
+    ancestors : scipy.sparse.csr_matrix
+        Boolean matrix, row i holds all ancestors of term i and term i
+    """
+
+    def __init__(self, go):
+        records = {rec.id: rec for rec in go.values()}
+        ordered = sorted(records.values(), key=lambda r: (r.depth, r.id))
+        self.ids = np.array([r.id for r in ordered], dtype=object)
+        position = {r.id: n for n, r in enumerate(ordered)}
+        self._lookup = {key: position[rec.id] for key, rec in go.items()}
+        self.depth = np.array([r.depth for r in ordered], dtype=np.int32)
+        self.level = np.array([r.level for r in ordered], dtype=np.int32)
+
+        parents = [sorted(position[p.id] for p in r.parents) for r in ordered]
+        self.parents = self._to_csr(parents)
+
+        closure = []
+        for n, term_parents in enumerate(parents):
+            ancestors = {n}
+            for p in term_parents:
+                ancestors.update(closure[p])
+            closure.append(ancestors)
+        self.ancestors = self._to_csr([sorted(i) for i in closure])
+
+    def _to_csr(self, rows):
+        lengths = np.array([len(i) for i in rows], dtype=np.int64)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.fromiter((j for i in rows for j in i), dtype=np.int32,
+                              count=indptr[-1])
+        return sp.csr_matrix(
+            (np.ones(len(indices), dtype=bool), indices, indptr),
+            shape=(len(rows), len(self.ids))
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, go_id):
+        return go_id in self._lookup
+
+    def positions(self, terms):
+        """ Positions of GO ids (alternative ids map to their term)
+
+        Parameters
+        ----------
+        terms : list_like
+
+        Returns
+        -------
+        numpy.array
+        """
+        return np.array([self._lookup[t] for t in terms], dtype=np.int64)
+
+    def ancestor_positions(self, term):
+        """ Positions of all ancestors of term, including itself """
+        i = self._lookup[term]
+        return self.ancestors.indices[
+            self.ancestors.indptr[i]:self.ancestors.indptr[i + 1]]
+
+    def ancestor_matrix(self, terms, order=None):
+        """ Boolean matrix of terms by the union of their ancestors
+
+        Parameters
+        ----------
+        terms : list_like
+            GO ids
+        order : numpy.array, optional
+            Score of each term of the DAG (such as information content).
+            Columns are sorted by decreasing score, default depth.
+
+        Returns
+        -------
+        matrix : numpy.array
+            matrix[i, j] is True if universe[j] is an ancestor of terms[i]
+            or terms[i] itself
+        universe : numpy.array
+            Positions of the columns of matrix
+        """
+        rows = self.ancestors[self.positions(terms)]
+        universe = np.unique(rows.indices)
+        score = self.depth if order is None else order
+        # deepest (highest score) first, ties by topological order
+        universe = universe[np.lexsort((universe, -score[universe]))]
+        columns = np.empty(len(self), dtype=np.int64)
+        columns[universe] = np.arange(len(universe))
+        matrix = np.zeros((rows.shape[0], len(universe)), dtype=bool)
+        matrix[np.repeat(np.arange(rows.shape[0]), np.diff(rows.indptr)),
+               columns[rows.indices]] = True
+        return matrix, universe
+
+    def common_ancestors(self, terms):
+        """ Set of GO ids that are ancestors of (or equal to) all terms """
+        matrix, universe = self.ancestor_matrix(terms)
+        return set(self.ids[universe[matrix.all(axis=0)]])
+
+    def deepest_common_ancestor(self, terms):
+        """ Deepest GO id that is an ancestor of (or equal to) all terms """
+        matrix, universe = self.ancestor_matrix(terms)
+        common = np.flatnonzero(matrix.all(axis=0))
+        if len(common) == 0:
+            raise ValueError('Terms have no common ancestor')
+        return self.ids[universe[common[0]]]
+
+    def pairwise_common(self, terms, order=None, chunk_size=None,
+                        others=None):
+        """ Best common ancestor of all pairs of terms
+
+        Ancestor rows are packed into bits, so a chunk of rows is compared
+        with all others using chunk_size * len(others) * n_ancestors / 8
+        bytes.
+
+        Parameters
+        ----------
+        terms : list_like
+        order : numpy.array, optional
+            Score of each term of the DAG, the common ancestor with the
+            highest score is returned. Default depth (deepest common
+            ancestor).
+        chunk_size : int, optional
+            Rows compared at a time, default limits the comparison to ~16MB
+        others : list_like, optional
+            Terms of the columns, default terms
+
+        Returns
+        -------
+        numpy.array
+            Positions of the common ancestors, shape (n_terms, n_others).
+            -1 for pairs without a common ancestor (different aspects).
+        """
+        terms = list(terms)
+        others = terms if others is None else list(others)
+        matrix, universe = self.ancestor_matrix(terms + others, order)
+        # columns are sorted best first, the first set bit is the best
+        packed = np.packbits(matrix, axis=1)
+        rows, columns = packed[:len(terms)], packed[len(terms):]
+        if chunk_size is None:
+            chunk_size = max(1, 2 ** 24 // max(columns.size, 1))
+        best = np.full((len(terms), len(others)), -1, dtype=np.int64)
+        for start in range(0, len(terms), chunk_size):
+            shared = rows[start:start + chunk_size, None, :] & \
+                columns[None, :, :]
+            first = (shared != 0).argmax(axis=2)
+            byte = np.take_along_axis(shared, first[:, :, None],
+                                      axis=2)[:, :, 0]
+            found = byte != 0
+            position = first * 8 + _leading_zeros[byte]
+            best[start:start + chunk_size][found] = universe[position[found]]
+        return best
+
+    def is_ancestor(self, terms):
+        """ Pairwise ancestor check
+
+        Returns
+        -------
+        numpy.array
+            m[i, j] is True if terms[j] is an ancestor of terms[i] (or the
+            same term)
+        """
+        rows = self.ancestors[self.positions(terms)]
+        return rows[:, self.positions(terms)].toarray()
+
+    def min_branch_lengths(self, terms):
+        """ Shortest branch length through the deepest common ancestor
+
+        Returns
+        -------
+        numpy.array
+            depth[i] + depth[j] - 2 * depth[dca(i, j)] for all pairs, -1
+            for pairs without a common ancestor
+        """
+        depth = self.depth[self.positions(terms)]
+        dca = self.pairwise_common(terms)
+        lengths = depth[:, None] + depth[None, :] - 2 * self.depth[dca]
+        lengths[dca == -1] = -1
+        return lengths
+
+    def path_edges(self, term):
+        """ (parent, child) GO id pairs of the DAG above term """
+        nodes = self.ancestor_positions(term)
+        sub = self.parents[nodes][:, nodes].tocoo()
+        return list(zip(self.ids[nodes[sub.col]], self.ids[nodes[sub.row]]))
@@ -0,0 +1,317 @@
+"""
+Versioned, memory-mappable store of GO annotations.
+
+All annotations of a species are kept in a single binary file: a magic
+string, the length of the JSON header, the header and then aligned numpy
+arrays. Array offsets in the header are relative to the start of the
+arrays, which directly follows the header. Terms and genes are integer ids,
+term to gene and gene to term annotations are CSR style offset/index
+arrays, depth and aspect are per term arrays. Arrays are opened with
+numpy.memmap, so opening a store only reads the header and processes that
+open the same file share its pages. Gene names and term names are NUL
+separated utf-8 tables, decoded on first use.
+
+The dict-like views (go_to_gene, gene_to_go, go_to_name, go_depth,
+go_aspect) match the dicts MagineGO used to unpickle. gene_to_go is the
+inverse of go_to_gene: both were built from the same gene2go rows, so the
+separate gene to GO dict is not stored.
+"""
+import json
+import os
+import struct
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # python 2
+    from collections import Mapping
+
+import numpy as np
+import pandas as pd
+
+from magine.data.storage import network_data_dir
+
+STORE_VERSION = 2
+_magic = b'MAGINEGO'
+_align = 64
+_sep = u'\x00'
+
+
+def go_store_path(species='hsa'):
+    """ File name of the GO store of species """
+    return os.path.join(network_data_dir, '{}_go.store'.format(species))
+
+
+def _go_number(go_id):
+    return int(go_id[3:])
+
+
+def _go_id(number):
+    return 'GO:{:07d}'.format(number)
+
+
+def _encode_strings(strings):
+    return np.frombuffer(_sep.join(strings).encode('utf-8'), dtype=np.uint8)
+
+
+def _data_offset(header_size):
+    """ Start of the arrays of a store with a header of header_size bytes """
+    return -(-(len(_magic) + 8 + header_size) // _align) * _align
+
+
+def write_go_store(file_name, go_to_gene, go_to_name, go_depth, go_aspect,
+                   species='hsa'):
+    """ Write GO annotations to a store
+
+    Parameters
+    ----------
+    file_name : str
+    go_to_gene : dict
+        GO id to set of genes
+    go_to_name : dict
+        GO id to term name
+    go_depth : dict
+        GO id to depth
+    go_aspect : dict
+        GO id to namespace (biological_process, ...)
+    species : str
+    """
+    terms = sorted(go_to_gene, key=_go_number)
+    genes = sorted(set(g for t in terms for g in go_to_gene[t]))
+    gene_index = pd.Index(np.array(genes, dtype=object), dtype=object)
+
+    lengths = np.array([len(go_to_gene[t]) for t in terms], dtype=np.int64)
+    term_indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=term_indptr[1:])
+    term_genes = gene_index.get_indexer(
+        [g for t in terms for g in sorted(go_to_gene[t])]
+    ).astype(np.int32)
+
+    # transpose for gene to terms
+    term_of_entry = np.repeat(np.arange(len(terms), dtype=np.int32), lengths)
+    order = np.argsort(term_genes, kind='stable')
+    gene_terms = term_of_entry[order]
+    gene_indptr = np.zeros(len(genes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_genes, minlength=len(genes)),
+              out=gene_indptr[1:])
+
+    aspects = sorted(set(go_aspect[t] for t in terms))
+    aspect_codes = pd.Index(aspects).get_indexer(
+        [go_aspect[t] for t in terms]).astype(np.int8)
+
+    arrays = dict(
+        term_numbers=np.array([_go_number(t) for t in terms],
+                              dtype=np.int32),
+        term_indptr=term_indptr,
+        term_genes=term_genes,
+        gene_indptr=gene_indptr,
+        gene_terms=gene_terms,
+        depth=np.array([go_depth[t] for t in terms], dtype=np.int16),
+        aspect=aspect_codes,
+        gene_names=_encode_strings(genes),
+        term_names=_encode_strings([go_to_name.get(t, '') for t in terms]),
+    )
+    header = dict(version=STORE_VERSION, species=species, aspects=aspects,
+                  n_terms=len(terms), n_genes=len(genes), arrays=dict())
+
+    # offsets are relative to the start of the arrays, so the header does
+    # not depend on its own size
+    offset = 0
+    for name, array in sorted(arrays.items()):
+        offset = -(-offset // _align) * _align
+        header['arrays'][name] = dict(dtype=array.dtype.str,
+                                      shape=list(array.shape), offset=offset)
+        offset += array.nbytes
+    encoded = json.dumps(header).encode('utf-8')
+    start = _data_offset(len(encoded))
+
+    tmp = '{}.tmp'.format(file_name)
+    with open(tmp, 'wb') as f:
+        f.write(_magic)
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        for name, array in sorted(arrays.items()):
+            f.seek(start + header['arrays'][name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+    # os.replace is atomic and overwrites on all platforms (python 3.3+)
+    getattr(os, 'replace', os.rename)(tmp, file_name)
+
+
+def read_header(file_name):
+    """ Header of a store, None if file_name is not a store
+
+    The returned header also has the absolute position of the arrays as
+    'data_offset'.
+    """
+    with open(file_name, 'rb') as f:
+        if f.read(len(_magic)) != _magic:
+            return None
+        size, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(size).decode('utf-8'))
+    header['data_offset'] = _data_offset(size)
+    return header
+
+
+class GOStore(object):
+    """ Read only, memory-mapped GO annotations
+
+    Parameters
+    ----------
+    file_name : str
+        Store written by write_go_store
+
+    Attributes
+    ----------
+    go_to_gene, gene_to_go, go_to_name, go_depth, go_aspect : Mapping
+        dict-like views
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.header = read_header(file_name)
+        if self.header is None:
+            raise ValueError('{} is not a GO store'.format(file_name))
+        if self.header['version'] != STORE_VERSION:
+            raise ValueError('{} has version {}, expected {}'.format(
+                file_name, self.header['version'], STORE_VERSION))
+        self.n_terms = self.header['n_terms']
+        self.n_genes = self.header['n_genes']
+        self._arrays = dict()
+        self._strings = dict()
+        self._gene_lookup = None
+
+        self.go_to_gene = _AnnotationView(self, 'term')
+        self.gene_to_go = _AnnotationView(self, 'gene')
+        self.go_to_name = _TermView(self, lambda i: self.term_names[i])
+        self.go_depth = _TermView(self, lambda i: int(self.array('depth')[i]))
+        aspects = self.header['aspects']
+        self.go_aspect = _TermView(
+            self, lambda i: aspects[self.array('aspect')[i]])
+
+    def array(self, name):
+        """ Memory-mapped array of the store """
+        if name not in self._arrays:
+            info = self.header['arrays'][name]
+            shape = tuple(info['shape'])
+            if shape[0] == 0:
+                self._arrays[name] = np.zeros(shape, dtype=info['dtype'])
+            else:
+                self._arrays[name] = np.memmap(
+                    self.file_name, dtype=info['dtype'], mode='r',
+                    offset=self.header['data_offset'] + info['offset'],
+                    shape=shape
+                )
+        return self._arrays[name]
+
+    def _string_table(self, name, size):
+        if name not in self._strings:
+            if size == 0:
+                self._strings[name] = np.zeros(0, dtype=object)
+            else:
+                text = self.array(name).tobytes().decode('utf-8')
+                self._strings[name] = np.array(text.split(_sep),
+                                               dtype=object)
+        return self._strings[name]
+
+    @property
+    def gene_names(self):
+        """ numpy.array of gene names, indexed by gene id """
+        return self._string_table('gene_names', self.n_genes)
+
+    @property
+    def term_names(self):
+        """ numpy.array of GO term names, indexed by term id """
+        return self._string_table('term_names', self.n_terms)
+
+    @property
+    def term_ids(self):
+        """ numpy.array of GO ids, indexed by term id """
+        if 'term_ids' not in self._strings:
+            self._strings['term_ids'] = np.array(
+                [_go_id(i) for i in self.array('term_numbers')],
+                dtype=object)
+        return self._strings['term_ids']
+
+    def term_id(self, go_id):
+        """ Integer id of a GO id, None if not in store """
+        try:
+            number = _go_number(go_id)
+        except (TypeError, ValueError):
+            return None
+        numbers = self.array('term_numbers')
+        i = int(np.searchsorted(numbers, number))
+        if i < len(numbers) and numbers[i] == number:
+            return i
+        return None
+
+    def gene_id(self, gene):
+        """ Integer id of a gene name, None if not in store """
+        if self._gene_lookup is None:
+            self._gene_lookup = {g: n for n, g in enumerate(self.gene_names)}
+        return self._gene_lookup.get(gene)
+
+    def term_genes(self, term_id):
+        """ Gene ids annotated to a term id """
+        indptr = self.array('term_indptr')
+        return self.array('term_genes')[indptr[term_id]:indptr[term_id + 1]]
+
+    def gene_terms(self, gene_id):
+        """ Term ids annotated to a gene id """
+        indptr = self.array('gene_indptr')
+        return self.array('gene_terms')[indptr[gene_id]:indptr[gene_id + 1]]
+
+
+class _AnnotationView(Mapping):
+    """ GO id to set of genes, or gene to set of GO ids """
+
+    def __init__(self, store, by):
+        self._store = store
+        self._by = by
+
+    def _lookup(self, key):
+        if self._by == 'term':
+            return self._store.term_id(key)
+        return self._store.gene_id(key)
+
+    def __getitem__(self, key):
+        i = self._lookup(key)
+        if i is None:
+            raise KeyError(key)
+        if self._by == 'term':
+            return set(self._store.gene_names[self._store.term_genes(i)])
+        return set(self._store.term_ids[self._store.gene_terms(i)])
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def __iter__(self):
+        keys = self._store.term_ids if self._by == 'term' else \
+            self._store.gene_names
+        return iter(keys)
+
+    def __len__(self):
+        if self._by == 'term':
+            return self._store.n_terms
+        return self._store.n_genes
+
+
+class _TermView(Mapping):
+    """ GO id to a per term value """
+
+    def __init__(self, store, value):
+        self._store = store
+        self._value = value
+
+    def __getitem__(self, key):
+        i = self._store.term_id(key)
+        if i is None:
+            raise KeyError(key)
+        return self._value(i)
+
+    def __contains__(self, key):
+        return self._store.term_id(key) is not None
+
+    def __iter__(self):
+        return iter(self._store.term_ids)
+
+    def __len__(self):
+        return self._store.n_terms
@@ -6,12 +6,15 @@ import os
 
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
+from scipy.stats import binom
 from statsmodels.stats.multitest import fdrcorrection
-from statsmodels.stats.proportion import binom_test
 
 from magine.data.storage import network_data_dir
 from magine.enrichment.deprecated.databases.gene_ontology import \
     download_and_process_go
+from magine.enrichment.deprecated.go_store import GOStore, STORE_VERSION, \
+    go_store_path, read_header, write_go_store
 from magine.html_templates.html_tools import write_filter_table
 from magine.plotting.species_plotting import plot_genes_by_ont
 
@@ -20,7 +23,7 @@ try:
 except:  # python3 doesnt have cPickle
     import pickle
 
-pd.set_option('display.max_colwidth', -1)
+pd.set_option('display.max_colwidth', None)
 
 evidence_codes = ['EXP', 'IDA', 'IPI', 'IMP', 'IGI', 'IEP', 'TAS', 'IC', 'IEA']
 
@@ -80,6 +83,29 @@ def write_table_to_html_with_figures(data, exp_data, save_name='index',
     write_filter_table(tmp, html_out)
 
 
+def _is_current_store(file_name):
+    if not os.path.exists(file_name):
+        return False
+    header = read_header(file_name)
+    return header is not None and header['version'] == STORE_VERSION
+
+
+def _create_store(species, store_name):
+    """ Create the GO store, from old pickled annotations if present """
+    dirname = network_data_dir
+    pickles = [os.path.join(dirname, '{}_{}.p'.format(species, i))
+               for i in ['goids_to_genes', 'goids_to_goname', 'godepth',
+                         'go_aspect']]
+    if all(os.path.exists(i) for i in pickles):
+        loaded = []
+        for i in pickles:
+            with open(i, 'rb') as f:
+                loaded.append(pickle.load(f))
+        write_go_store(store_name, *loaded, species=species)
+    else:
+        download_and_process_go(species=species)
+
+
 class GoAnalysis(object):
     """
     Go analysis class.
@@ -116,14 +142,16 @@ class GoAnalysis(object):
         self.num_data_sets = 0
         self.created_go_pds = set()
 
-    def _calculate_enrichment_single_sample(self, gene_list):
-        """
-        Performs enrichment analysis of list of genes
+    def _genes_present(self, gene_list):
+        """ Genes of gene_list that are annotated in GO
 
         Parameters
         ----------
         gene_list : array like
-            List of genes to perform analysis
+
+        Returns
+        -------
+        set
         """
         # checks first to see if all genes are annotated in GO
         genes_present = set()
@@ -145,51 +173,73 @@ class GoAnalysis(object):
             print("Genes not in GO = {}".format(genes_missing))
         print("Number of genes given = {0}."
               " Number of genes in GO = {1}".format(len(gene_list), n_genes))
+        return genes_present
 
-        # res = self.__calculate_enrichment(genes_present,
-        # aspect=['F', 'P', 'C'])
-        res = self.magine_go.calculate_enrichment(genes_present,
-                                                  reference=self.reference)
-        n = 0
-        column_names = dict(GO_id=None, enrichment_score=None, pvalue=None,
-                            genes=None, n_genes=None, aspect=None,
-                            ref=None, depth=None, GO_name=None, slim=None)
-
-        all_go_rows = []
-        for go_id, (genes, p_value, ref) in res.items():
-            n += 1
-            go_row = column_names.copy()
-
-            expected_value = n_genes * float(
-                ref) / self.number_of_total_reference_genes
-            enrichment = float(len(genes)) / expected_value
-
-            go_row['GO_id'] = go_id
-            go_row['enrichment_score'] = enrichment
-            go_row['pvalue'] = p_value
-            go_row['genes'] = list(np.sort(genes))
-            go_row['n_genes'] = len(genes)
-            go_row['aspect'] = self.magine_go.go_aspect[go_id]
-            go_row['ref'] = len(self.magine_go.go_to_gene[go_id])
-            go_row['depth'] = self.magine_go.go_depth[go_id]
-            go_row['GO_name'] = self.magine_go.go_to_name[go_id]
-
-            all_go_rows.append(go_row)
-            if self.verbose:  # pragma: no cover
-                print(go_id, float(len(genes) / float(ref)) * 100,
-                      self.magine_go.go_to_name[go_id],
-                      p_value, len(genes), ref,
-                      enrichment)
-
-        if n == 0:
+    def _results_to_df(self, res, n_genes):
+        """ Convert output of MagineGO.calculate_enrichment to a DataFrame
+
+        Parameters
+        ----------
+        res : dict
+        n_genes : int
+            Number of genes of the gene list
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+        columns = ['GO_id', 'enrichment_score', 'pvalue', 'genes', 'n_genes',
+                   'aspect', 'ref', 'depth', 'GO_name', 'slim']
+        if len(res) == 0:
             print("No significant p-values")
+            return pd.DataFrame(columns=columns)
+
+        go_ids = list(res)
+        hits = [sorted(res[i][0]) for i in go_ids]
+        n_hits = np.array([len(i) for i in hits], dtype=float)
+        ref = np.array([res[i][2] for i in go_ids], dtype=float)
+        expected_value = n_genes * ref / self.number_of_total_reference_genes
+        mg = self.magine_go
+        df = pd.DataFrame({
+            'GO_id': go_ids,
+            'enrichment_score': n_hits / expected_value,
+            'pvalue': [res[i][1] for i in go_ids],
+            'genes': hits,
+            'n_genes': n_hits.astype(int),
+            'aspect': [mg.go_aspect[i] for i in go_ids],
+            'ref': [len(mg.go_to_gene[i]) for i in go_ids],
+            'depth': [mg.go_depth[i] for i in go_ids],
+            'GO_name': [mg.go_to_name[i] for i in go_ids],
+            'slim': None,
+        }, columns=columns)
+        if self.verbose:  # pragma: no cover
+            for i, row in df.iterrows():
+                print(row['GO_id'], row['n_genes'] / ref[i] * 100,
+                      row['GO_name'], row['pvalue'], row['n_genes'], ref[i],
+                      row['enrichment_score'])
+        return df
 
-        return pd.DataFrame(all_go_rows, columns=column_names.keys())
+    def _calculate_enrichment_single_sample(self, gene_list):
+        """
+        Performs enrichment analysis of list of genes
+
+        Parameters
+        ----------
+        gene_list : array like
+            List of genes to perform analysis
+        """
+        genes_present = self._genes_present(gene_list)
+        res = self.magine_go.calculate_enrichment(genes_present,
+                                                  reference=self.reference)
+        return self._results_to_df(res, len(genes_present))
 
     def calculate_enrichment(self, list_of_exp, labels=None):
         """
         Performs enrichment analysis of list of list of genes
 
+        All samples are scored in a single batched call of
+        MagineGO.calculate_enrichment_batch.
+
         Parameters
         ----------
         list_of_exp: list_of_list or list
@@ -222,9 +272,13 @@ class GoAnalysis(object):
         if labels is None:
             labels = range(0, self.num_data_sets)
 
+        present = [self._genes_present(i) for i in list_of_exp]
+        all_res = self.magine_go.calculate_enrichment_batch(
+            present, reference=self.reference
+        )
         all_data = []
-        for n, i in enumerate(list_of_exp):
-            tmp = self._calculate_enrichment_single_sample(i)
+        for n, (genes, res) in enumerate(zip(present, all_res)):
+            tmp = self._results_to_df(res, len(genes))
             tmp['sample_index'] = labels[n]
             all_data.append(tmp)
 
@@ -267,29 +321,75 @@ class GoAnalysis(object):
 
 
 class MagineGO(object):
+    """ GO annotations of a species
+
+    Annotations are read from a memory-mapped GO store (see
+    magine.enrichment.deprecated.go_store), so creating instances is fast
+    and processes share the same pages. gene_to_go, go_to_gene, go_to_name,
+    go_depth and go_aspect are read only dict-like views of the store.
+    """
+
     def __init__(self, species='hsa'):
-        dirname = network_data_dir
-        gene_to_go_name = os.path.join(dirname,
-                                       '{}_gene_to_go.p'.format(species))
-        go_to_gene_name = os.path.join(dirname,
-                                       '{}_goids_to_genes.p'.format(
-                                           species))
-        go_to_go_name = os.path.join(dirname,
-                                     '{}_goids_to_goname.p'.format(
-                                         species))
-        go_depth = os.path.join(dirname, '{}_godepth.p'.format(species))
-        go_aspect = os.path.join(dirname, '{}_go_aspect.p'.format(species))
-        for i in [gene_to_go_name, go_to_gene_name, go_to_go_name,
-                  go_depth,
-                  go_aspect]:
-            if not os.path.exists(i):
-                download_and_process_go(species=species)
-
-        self.gene_to_go = pickle.load(open(gene_to_go_name, 'rb'))
-        self.go_to_gene = pickle.load(open(go_to_gene_name, 'rb'))
-        self.go_to_name = pickle.load(open(go_to_go_name, 'rb'))
-        self.go_depth = pickle.load(open(go_depth, 'rb'))
-        self.go_aspect = pickle.load(open(go_aspect, 'rb'))
+        store_name = go_store_path(species)
+        if not _is_current_store(store_name):
+            _create_store(species, store_name)
+
+        self.store = GOStore(store_name)
+        self.gene_to_go = self.store.gene_to_go
+        self.go_to_gene = self.store.go_to_gene
+        self.go_to_name = self.store.go_to_name
+        self.go_depth = self.store.go_depth
+        self.go_aspect = self.store.go_aspect
+        self.term_ids = None
+        self.gene_index = None
+        self._term_matrix = None
+
+    def _build_term_matrix(self):
+        """ Build term_matrix and its labels from the store's arrays
+
+        Sets self.term_ids (GO ids of the rows), self.gene_index (gene names
+        of the columns) and the matrix itself, once.
+        """
+        if self._term_matrix is not None:
+            return
+        self.term_ids = self.store.term_ids
+        self.gene_index = pd.Index(self.store.gene_names, dtype=object)
+        indices = self.store.array('term_genes')
+        self._term_matrix = sp.csr_matrix(
+            (np.ones(len(indices), dtype=np.int32), indices,
+             self.store.array('term_indptr')),
+            shape=(self.store.n_terms, self.store.n_genes)
+        )
+
+    @property
+    def term_matrix(self):
+        """ Binary sparse matrix of GO terms by genes
+
+        Built from the store's arrays on first use, see _build_term_matrix.
+        Rows are ordered as self.term_ids, columns as self.gene_index.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+        """
+        self._build_term_matrix()
+        return self._term_matrix
+
+    def _gene_vectors(self, gene_lists):
+        """ Binary sparse matrix of genes by gene lists """
+        self._build_term_matrix()
+        rows, cols = [], []
+        for n, genes in enumerate(gene_lists):
+            ids = self.gene_index.get_indexer(list(set(genes)))
+            ids = ids[ids != -1]
+            rows.append(ids)
+            cols.append(np.full(len(ids), n, dtype=np.int64))
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        return sp.csc_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(len(self.gene_index), len(gene_lists))
+        )
 
     def calculate_enrichment(self, genes, reference=None,
                              evidence_codes=None,
@@ -309,82 +409,80 @@ class MagineGO(object):
 
         Returns
         -------
-
+        dict
+            GO id to (list of mapped genes, p-value, number of reference
+            genes annotated to the term)
         """
+        return self.calculate_enrichment_batch(
+            [genes], reference=reference, evidence_codes=evidence_codes,
+            aspect=aspect, use_fdr=use_fdr
+        )[0]
 
-        # TODO check for alias for genes
-        genes = set(genes)
-        # TODO add aspects
-        term_reference = self.go_to_gene.keys()
-        aspect_dict = {
-            'P': 'biological_process',
-            'C': 'cellular_component',
-            'F': 'molecular_function'
-        }
-        if aspect is None:
-            term_reference = self.go_to_gene
-            gene_reference = self.gene_to_go
-        else:
-            term_reference = dict()
-            gene_reference = dict()
+    def calculate_enrichment_batch(self, gene_lists, reference=None,
+                                   evidence_codes=None, aspect=None,
+                                   use_fdr=True):
+        """ Enrichment of several gene lists at once
+
+        Overlaps of all gene lists with all GO terms are computed with one
+        sparse matrix product, p-values of the one sided binomial test with
+        a vectorized binom.sf.
 
+        Parameters
+        ----------
+        gene_lists : list
+            list of lists of genes
+        reference : list
+            reference list of species to calculate enrichment
+        evidence_codes : list
+            GO evidence codes
+        use_fdr : bool
+            Correct for multiple hypothesis testing (per gene list)
+
+        Returns
+        -------
+        list
+            dict for each gene list, see calculate_enrichment
+        """
+        # TODO check for alias for genes
+        # TODO add aspects and evidence_codes
         if aspect is not None:
             for i in aspect:
                 if i not in ['P', 'C', 'F']:
                     print("Error: Aspects are only 'P', 'C', and 'F' \n")
                     quit()
-            for i in ['P', 'C', 'F']:
-                if i in aspect:
-                    term_reference = None
 
-        # TODO add reference
+        matrix = self.term_matrix
         if reference:
             # TODO check for reference alias
-            reference = set(reference)
-            reference.intersection_update(set(self.gene_to_go.keys()))
+            reference = set(reference).intersection(self.gene_to_go)
         else:
-            reference = set(self.gene_to_go.keys())
-
-        # TODO add evidence_codes
-
-        terms = set()
-        for i in genes:
-            if i in self.gene_to_go:
-                for t in self.gene_to_go[i]:
-                    terms.add(t)
-
-        n_genes = len(genes)
+            reference = self.gene_to_go
+        ref_vector = self._gene_vectors([reference])
         n_ref = float(len(reference))
-        res = {}
-        for term in terms:
-
-            all_annotated_genes = set(self.go_to_gene[term])
-            mapped_genes = genes.intersection(all_annotated_genes)
-            n_mapped_genes = len(mapped_genes)
-
-            if n_ref > len(all_annotated_genes):
-                mapped_reference_genes = \
-                    reference.intersection(all_annotated_genes)
-            else:
-                mapped_reference_genes = \
-                    all_annotated_genes.intersection(reference)
-
-            n_mapped_ref = len(mapped_reference_genes)
-
-            prob = float(n_mapped_ref) / n_ref
-
-            p_value = binom_test(n_mapped_genes, n_genes, prob, 'larger')
-
-            res[term] = ([i for i in mapped_genes], p_value, n_mapped_ref)
-        if use_fdr:
-            res = sorted(res.items(), key=lambda x: x[1][1])
-            fdr = fdrcorrection([p for _, (_, p, _) in res],
-                                is_sorted=True)
-            values = fdr[1]
-            res = dict([(index, (genes, p, ref))
-                        for (index, (genes, _, ref)), p in
-                        zip(res, values)])
-        return res
+        n_mapped_ref = np.asarray((matrix * ref_vector).todense()).ravel()
+
+        gene_lists = [set(i) for i in gene_lists]
+        queries = self._gene_vectors(gene_lists)
+        overlap = (matrix * queries).tocsc()
+
+        names = np.asarray(self.gene_index, dtype=object)
+        results = []
+        for n, genes in enumerate(gene_lists):
+            start, end = overlap.indptr[n], overlap.indptr[n + 1]
+            terms = overlap.indices[start:end]
+            n_mapped = np.asarray(overlap[terms, n].todense()).ravel()
+            p_values = binom.sf(n_mapped - 1, len(genes),
+                                n_mapped_ref[terms] / n_ref)
+            if use_fdr and len(p_values):
+                p_values = fdrcorrection(p_values)[1]
+            mapped = matrix[terms].multiply(queries[:, n].T).tocsr()
+            res = dict()
+            for i, term in enumerate(terms):
+                hits = mapped.indices[mapped.indptr[i]:mapped.indptr[i + 1]]
+                res[self.term_ids[term]] = (list(names[hits]), p_values[i],
+                                            int(n_mapped_ref[term]))
+            results.append(res)
+        return results
 
 # All code below is old and will be removed. Keeping for just a bit longer.
 '''  
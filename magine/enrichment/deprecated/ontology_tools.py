@@ -1,31 +1,230 @@
-import itertools
+"""
+Tools to trim and visualize lists of GO terms.
+
+The GO DAG, annotations (MagineGO), term counts and information content
+are created on first use and cached, so importing this module is cheap.
+The information content of all terms is stored in go_ic.npz next to
+go.obo and reused while go.obo and the GO store are unchanged, so
+TermCounts only has to be built once.
+
+The module attributes go, mg, associations and termcounts of previous
+versions are now created on access by a module __getattr__ (PEP 562),
+which needs Python 3.7+. On older versions use go_dag(), magine_go() and
+term_counts() instead.
+"""
+import json
 import os
 
 import networkx as nx
+import numpy as np
 import pandas as pd
-from goatools import obo_parser
-from goatools.semantic import TermCounts, ic, resnik_sim, semantic_similarity
-from magine.enrichment.ontology_analysis import MagineGO
 
 from magine.data.storage import id_mapping_dir
+from magine.enrichment.deprecated.go_index import GOIndex
+from magine.enrichment.deprecated.go_store import go_store_path
 
 obo_file = os.path.join(id_mapping_dir, 'go.obo')
+ic_file = os.path.join(id_mapping_dir, 'go_ic.npz')
 
-if not os.path.exists(obo_file):
-    print("Using ontology for first time")
-    print("Downloading files")
-    from magine.enrichment.databases.gene_ontology import \
-        download_and_process_go
-    download_and_process_go()
-    assert os.path.exists(obo_file)
+_go = None
+_magine_go = None
+_termcounts = None
+_go_index = None
+_information_content = None
 
-go = obo_parser.GODag(obo_file)
 
-mg = MagineGO()
-print("Loading termcounts")
-associations = mg.gene_to_go
-termcounts = TermCounts(go, associations)
-print("Loaded termcounts")
+def go_dag():
+    """ GO DAG parsed from go.obo, downloaded on first use
+
+    Returns
+    -------
+    goatools.obo_parser.GODag
+    """
+    global _go
+    if _go is None:
+        from goatools import obo_parser
+        if not os.path.exists(obo_file):
+            print("Using ontology for first time")
+            print("Downloading files")
+            from magine.enrichment.deprecated.databases.gene_ontology import \
+                download_and_process_go
+            download_and_process_go()
+            assert os.path.exists(obo_file)
+        _go = obo_parser.GODag(obo_file)
+    return _go
+
+
+def magine_go():
+    """ Cached MagineGO annotations of human genes """
+    global _magine_go
+    if _magine_go is None:
+        from magine.enrichment.deprecated.ontology_analysis import MagineGO
+        _magine_go = MagineGO()
+    return _magine_go
+
+
+def term_counts():
+    """ Cached goatools TermCounts of the MagineGO annotations """
+    global _termcounts
+    if _termcounts is None:
+        from goatools.semantic import TermCounts
+        print("Loading termcounts")
+        _termcounts = TermCounts(go_dag(), magine_go().gene_to_go)
+        print("Loaded termcounts")
+    return _termcounts
+
+
+def __getattr__(name):
+    # module attributes of previous versions, created on access (python 3.7+)
+    if name == 'go':
+        return go_dag()
+    if name == 'mg':
+        return magine_go()
+    if name == 'associations':
+        return magine_go().gene_to_go
+    if name == 'termcounts':
+        return term_counts()
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def go_index():
+    """ Precomputed ancestor closure of go, built on first use
+
+    Returns
+    -------
+    magine.enrichment.deprecated.go_index.GOIndex
+    """
+    global _go_index
+    if _go_index is None:
+        _go_index = GOIndex(go_dag())
+    return _go_index
+
+
+def _ic_source():
+    """ Files the information content is computed from, with size and mtime
+    """
+    source = dict()
+    for i in [obo_file, go_store_path('hsa')]:
+        if os.path.exists(i):
+            stat = os.stat(i)
+            source[i] = [stat.st_size, stat.st_mtime]
+    return json.dumps(source, sort_keys=True)
+
+
+def goatools_ic():
+    """ Information content function of goatools.semantic
+
+    Named ic in old goatools and get_info_content since goatools 0.8.
+    """
+    try:
+        from goatools.semantic import ic
+    except ImportError:
+        from goatools.semantic import get_info_content as ic
+    return ic
+
+
+def information_content():
+    """ Information content of every term of go_index()
+
+    Loaded from ic_file if it was computed from the current go.obo and GO
+    store, otherwise computed from term_counts() and saved to ic_file.
+
+    Returns
+    -------
+    numpy.array
+        IC of the terms in the order of go_index().ids
+    """
+    global _information_content
+    if _information_content is None:
+        index = go_index()
+        source = _ic_source()
+        if os.path.exists(ic_file):
+            with np.load(ic_file) as table:
+                if str(table['source']) == source:
+                    values = pd.Series(table['ic'],
+                                       index=table['ids'].astype(object))
+                    _information_content = values.reindex(
+                        index.ids, fill_value=0.).values
+        if _information_content is None:
+            ic = goatools_ic()
+            termcounts = term_counts()
+            _information_content = np.array(
+                [ic(i, termcounts) for i in index.ids], dtype=np.float64)
+            np.savez(ic_file, ids=index.ids.astype(str),
+                     ic=_information_content, source=np.array(source))
+    return _information_content
+
+
+def _term_ic(go_id):
+    return float(information_content()[go_index().positions([go_id])[0]])
+
+
+class TermSimilarity(object):
+    """ Pairwise deepest common ancestors of a growing list of GO terms
+
+    The deepest common ancestors of new terms are computed against all
+    terms seen so far in one pass, so repeated calls of check_term_list
+    with overlapping term lists (top N refill loops) only compute the
+    pairs they have not seen before.
+
+    Parameters
+    ----------
+    terms : list_like, optional
+    """
+
+    def __init__(self, terms=()):
+        self._position = dict()
+        self._dca = np.zeros((0, 0), dtype=np.int64)
+        self.add(terms)
+
+    def add(self, terms):
+        """ Add GO terms, computing their common ancestors with all terms """
+        new = [t for t in dict.fromkeys(terms) if t not in self._position]
+        if not new:
+            return
+        old = sorted(self._position, key=self._position.get)
+        n = len(old)
+        block = go_index().pairwise_common(new, others=old + new)
+        dca = np.empty((n + len(new), n + len(new)), dtype=np.int64)
+        dca[:n, :n] = self._dca
+        dca[n:] = block
+        dca[:n, n:] = block[:, :n].T
+        self._dca = dca
+        for t in new:
+            self._position[t] = len(self._position)
+
+    def matrices(self, terms):
+        """ Deepest common ancestor, Resnik and path similarity of terms
+
+        Parameters
+        ----------
+        terms : list
+            GO ids, added if not seen before
+
+        Returns
+        -------
+        dca : numpy.array
+            Positions (in go_index()) of the deepest common ancestor of all
+            pairs of terms, -1 if they have none (different aspects)
+        resnik : numpy.array
+            Information content of the deepest common ancestor
+        semantic : numpy.array
+            1 / min branch length, 1 for identical terms
+        Pairs without common ancestor are nan in resnik and semantic.
+        """
+        self.add(terms)
+        index = go_index()
+        rows = np.array([self._position[t] for t in terms], dtype=np.int64)
+        dca = self._dca[np.ix_(rows, rows)]
+        depth = index.depth[index.positions(terms)]
+        branch = depth[:, None] + depth[None, :] - 2. * index.depth[dca]
+        missing = dca == -1
+        resnik = information_content()[dca]
+        resnik[missing] = np.nan
+        branch[missing] = np.nan
+        branch[branch == 0] = 1.
+        return dca, resnik, 1. / branch
 
 
 def path_to_root(go_term):
@@ -44,20 +243,20 @@ def path_to_root(go_term):
 
     """
 
+    go = go_dag()
+    index = go_index()
+    ic_values = information_content()
     graph = nx.DiGraph()
-    paths = go.paths_to_top(go_term)
-    all_terms = set()
-    for i in paths:
-        for j in i:
-            all_terms.add(j.id)
-    for i in paths:
-        for j in i:
-            add_children(j.id, graph, all_terms)
+    for i in index.ancestor_positions(go_term):
+        graph.add_node(index.ids[i], depth=int(index.depth[i]),
+                       level=int(index.level[i]), GOname=go[index.ids[i]].name,
+                       ic=float(ic_values[i]))
+    graph.add_edges_from(index.path_edges(go_term))
     return graph
 
 
 def print_path_to_root(go_term):
-    paths = go.paths_to_top(go_term)
+    paths = go_dag().paths_to_top(go_term)
     all_terms = set()
     for i in paths:
         print('\n')
@@ -67,6 +266,7 @@ def print_path_to_root(go_term):
 
 
 def print_children(go_term):
+    go = go_dag()
     print("({}) {} has children of :".format(go[go_term].id, go[go_term].name))
     for i in go[go_term].children:
         print("\t({}) {}".format(i.id, i.name))
@@ -79,22 +279,7 @@ def common_parent_go_ids(terms):
     ----------
     terms: list
     """
-    # Find candidates from first
-    terms = list(terms)
-    path_parents = go[terms[0]]
-    candidates = path_parents.get_all_parents()
-    candidates.update({terms[0]})
-
-    # Find intersection with second to nth term
-    for term in terms[1:]:
-        path_parents = go[term]
-        parents = path_parents.get_all_parents()
-        parents.update({term})
-
-        # Find the intersection with the candidates, and update.
-        candidates.intersection_update(parents)
-
-    return candidates
+    return go_index().common_ancestors(terms)
 
 
 def deepest_common_ancestor(terms):
@@ -103,25 +288,14 @@ def deepest_common_ancestor(terms):
         using the above function.
         Only returns single most specific - assumes unique exists.
     """
-    # Take the element at maximum depth.
-    return max(common_parent_go_ids(terms), key=lambda t: go[t].depth)
+    return go_index().deepest_common_ancestor(terms)
 
 
 def min_branch_length(go_id1, go_id2):
     """
         Finds the minimum branch length between two terms in the GO DAG.
     """
-    # First get the deepest common ancestor
-    dca = deepest_common_ancestor([go_id1, go_id2])
-
-    # Then get the distance from the DCA to each term
-    dca_depth = go[dca].depth
-    d1 = go[go_id1].depth - dca_depth
-    d2 = go[go_id2].depth - dca_depth
-    # print(d1, d2)
-    # Return the distance from one term to the deepest common ancestor and
-    # back to the other term.
-    return d1 + d2
+    return int(go_index().min_branch_lengths([go_id1, go_id2])[0, 1])
 
 
 def add_children(go_term, graph, gene_set_of_interest):
@@ -141,12 +315,13 @@ def add_children(go_term, graph, gene_set_of_interest):
     -------
 
     """
+    go = go_dag()
     nodes_in_graph = set(graph.nodes())
     graph.add_node(go[go_term].id,
                    depth=go[go_term].depth,
                    level=go[go_term].level,
                    GOname=go[go_term].name,
-                   ic=ic(go[go_term].id, termcounts))
+                   ic=_term_ic(go[go_term].id))
     for i in go[go_term].children:
         if i.id in gene_set_of_interest:
             if i.id not in nodes_in_graph:
@@ -154,7 +329,7 @@ def add_children(go_term, graph, gene_set_of_interest):
                                depth=i.depth,
                                level=i.level,
                                GOname=i.name,
-                               ic=ic(i.id, termcounts))
+                               ic=_term_ic(i.id))
             graph.add_edge(go[go_term].id, i.id)
             add_children(i.id, graph, gene_set_of_interest)
 
@@ -175,17 +350,16 @@ def check_if_children(list_of_terms, verbose=False):
 
     """
     list_of_terms = set(list_of_terms)
+    terms = list(list_of_terms)
+    # is_parent[i, j], terms[j] is an ancestor of terms[i]
+    is_parent = go_index().is_ancestor(terms)
+    np.fill_diagonal(is_parent, False)
     to_remove = set()
-    for i in list_of_terms:
-        g = path_to_root(i)
-        nodes = set(g.nodes())
-        for j in list_of_terms:
-            if not i == j:
-                if j in nodes:
-                    if verbose:
-                        print("{} is a parent of {}, "
-                              "removing from list".format(i, j))
-                    to_remove.add(i)
+    for i, j in zip(*np.nonzero(is_parent)):
+        if verbose:
+            print("{} is a parent of {}, "
+                  "removing from list".format(terms[i], terms[j]))
+        to_remove.add(terms[i])
     return list_of_terms.difference(to_remove)
 
 
@@ -204,6 +378,7 @@ def check_depth_level(list_of_terms, verbose=False):
     -------
 
     """
+    go = go_dag()
     list_of_terms = set(list_of_terms)
     to_remove = set()
 
@@ -264,59 +439,68 @@ def create_graph_to_root_from_list_terms(list_of_terms, check_child=False,
     return combined_graph
 
 
-def check_term_list(list_of_terms, verbose=False):
+def check_term_list(list_of_terms, verbose=False, similarity=None):
     """
 
     Parameters
     ----------
     list_of_terms : list
     verbose : bool
+    similarity : TermSimilarity, optional
+        Pairwise similarities to reuse between calls with overlapping lists
 
     Returns
     -------
 
     """
     list_of_terms = check_depth_and_children(list_of_terms)
-    combos = itertools.combinations(list_of_terms, 2)
+    if similarity is None:
+        similarity = TermSimilarity()
+    terms = list(list_of_terms)
+    dca, resnik, semantic = similarity.matrices(terms)
+    go = go_dag()
+    index = go_index()
+    ic_values = information_content()
+    depth = index.depth[index.positions(terms)]
+
+    # pairs in itertools.combinations order
+    pairs = np.ones(dca.shape, dtype=bool)
+    if not verbose:
+        with np.errstate(invalid='ignore'):
+            pairs = (semantic > .5) | (resnik > 9)
     to_remove = set()
-    for i, j in combos:
-
-        sim2 = semantic_similarity(i, j, go)
-        dca = deepest_common_ancestor([i, j])
-
-        sim = resnik_sim(i, j, go, termcounts)
-        ic_i = ic(i, termcounts)
-        ic_j = ic(j, termcounts)
-        ic_dca = ic(dca, termcounts)
-
+    for i, j in zip(*np.nonzero(np.triu(pairs, 1))):
+        sim2 = semantic[i, j]
+        sim = resnik[i, j]
         if verbose:
+            dca_id, dca_name, dca_depth, dca_ic = None, None, None, None
+            if dca[i, j] != -1:
+                dca_id = index.ids[dca[i, j]]
+                dca_name = go[dca_id].name
+                dca_depth = index.depth[dca[i, j]]
+                dca_ic = ic_values[dca[i, j]]
+            ic_i, ic_j = ic_values[index.positions([terms[i], terms[j]])]
             print("\nGO 1\t\t GO 2\t\t GO3")
-            print("Min branch length = {}".format(min_branch_length(i, j)))
-            print("{}\t{}\t{}".format(go[i].name, go[j].name, go[dca].name))
-            print("{}\t{}\t{}".format(i, j, dca))
-            print("{}\t{}\t{}".format(go[i].depth, go[j].depth, go[dca].depth))
+            print("{}\t{}\t{}".format(go[terms[i]].name, go[terms[j]].name,
+                                      dca_name))
+            print("{}\t{}\t{}".format(terms[i], terms[j], dca_id))
+            print("{}\t{}\t{}".format(depth[i], depth[j], dca_depth))
             print("Resnik {}\tSemantic {}".format(sim, sim2))
-            # print("{}\t{}\n".format(sim, sim2))
-
-            print("IC\t\t{}\t\t\t{}\t\t\t{}".format(ic_i, ic_j, ic_dca))
+            print("IC\t\t{}\t\t\t{}\t\t\t{}".format(ic_i, ic_j, dca_ic))
 
         # remove if two terms of similar by distance in graph
         if sim2 > .5:
-            if go[i].depth > go[j].depth:
-                to_remove.add(i)
+            if depth[i] > depth[j]:
+                to_remove.add(terms[i])
             else:
-                to_remove.add(j)
+                to_remove.add(terms[j])
         # remove if deepest common ancestor has at least 4 IC
         elif sim > 9:
-            if go[dca].depth < 3:
+            if index.depth[dca[i, j]] < 3:
                 continue
-            list_of_terms.add(dca)
-            to_remove.add(i)
-            to_remove.add(j)
-            if dca in to_remove or dca in list_of_terms:
-                list_of_terms.add(dca)
-                to_remove.add(i)
-                to_remove.add(j)
+            list_of_terms.add(index.ids[dca[i, j]])
+            to_remove.add(terms[i])
+            to_remove.add(terms[j])
     if verbose:
         print(to_remove)
         print('Number of term before = {}'.format(len(list_of_terms)))
@@ -501,6 +685,8 @@ def filter_ontology_df(data, n_hits_per_time=None, go_aspects=None,
     if variable_of_interest == 'pvalue':
         ascend = True
 
+    # similarities are shared by all calls of check_term_list below
+    similarity = TermSimilarity()
     list_all_go = tmp['GO_id'].unique()
     if n_hits_per_time is not None:
         tmp = pd.pivot_table(tmp, index=['GO_id', ], columns='sample_index')
@@ -508,14 +694,15 @@ def filter_ontology_df(data, n_hits_per_time=None, go_aspects=None,
         def find_n_go_terms(terms, updated_index):
             n_needed = n_hits_per_time - len(terms)
             terms.update(set(list(tmp.index)[:updated_index + n_needed]))
-            return check_term_list(terms)
+            return check_term_list(terms, similarity=similarity)
 
         list_all_go = set()
         for i in enrichment_list:
             tmp = tmp.sort_values(by=i, ascending=ascend)
             list_of_go = set(tmp.head(n_hits_per_time).index)
             if trim_nodes:
-                list_of_go = check_term_list(list_of_go)
+                list_of_go = check_term_list(list_of_go,
+                                             similarity=similarity)
                 count = n_hits_per_time
                 while len(list_of_go) < n_hits_per_time:
                     list_of_go = find_n_go_terms(list_of_go, count)
@@ -524,7 +711,7 @@ def filter_ontology_df(data, n_hits_per_time=None, go_aspects=None,
             list_all_go.update(list_of_go)
 
     if trim_nodes:
-        list_all_go = check_term_list(list_all_go)
+        list_all_go = check_term_list(list_all_go, similarity=similarity)
 
     if additional_ids_to_include is not None:
         assert isinstance(additional_ids_to_include, list)
@@ -615,19 +802,21 @@ def slim_ontology(data, pvalue=0.05, n_top_hits=None, go_aspects=None,
 
     enrichment_list = [variable_of_interest]
 
+    # similarities are shared by all calls of check_term_list below
+    similarity = TermSimilarity()
     list_all_go = tmp['GO_id'].unique()
     if n_top_hits is not None:
         def find_n_go_terms(terms, updated_index):
             n_needed = n_top_hits - len(terms)
             terms.update(set(list(tmp.index)[:updated_index + n_needed]))
-            return check_term_list(terms)
+            return check_term_list(terms, similarity=similarity)
 
         list_all_go = set()
         tmp.set_index('GO_id', inplace=True)
         tmp.sort_values(by=enrichment_list, ascending=False, inplace=True)
         list_of_go = set(tmp.head(n_top_hits).index)
         if trim_nodes:
-            list_of_go = check_term_list(list_of_go)
+            list_of_go = check_term_list(list_of_go, similarity=similarity)
             print("start {}", format(list_of_go))
             count = n_top_hits
             while len(list_of_go) < n_top_hits:
@@ -636,7 +825,7 @@ def slim_ontology(data, pvalue=0.05, n_top_hits=None, go_aspects=None,
         list_all_go.update(list_of_go)
 
     if trim_nodes:
-        list_all_go = check_term_list(list_all_go)
+        list_all_go = check_term_list(list_all_go, similarity=similarity)
 
     if additional_ids_to_include is not None:
         assert isinstance(additional_ids_to_include, list)
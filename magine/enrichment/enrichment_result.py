@@ -1,11 +1,24 @@
-import itertools
+import json
+import os
+import re
+import warnings
+from functools import reduce
 
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 
+import magine.enrichment.permutation as perm
+import magine.enrichment.similarity as sim
+from magine.enrichment.gene_lists import GeneListArray
 from magine.data import Data
 from magine.plotting.heatmaps import cluster_distance_mat
 
+try:
+    from urllib.parse import quote
+except ImportError:  # python 2
+    from urllib import quote
+
 
 def load_enrichment_csv(file_name, **args):
     """ Load data into EnrichmentResult data class
@@ -25,7 +38,280 @@ def load_enrichment_csv(file_name, **args):
     return EnrichmentResult(d)
 
 
+manifest_name = '_manifest.json'
+
+
+def partition_path(root, category, sample_id):
+    """ Directory of a (category, sample_id) partition of a dataset
+
+    Uses hive style 'key=value' directory names, with values quoted so any
+    category or sample_id is a valid directory name.
+
+    Parameters
+    ----------
+    root : str
+    category : str
+    sample_id : str
+
+    Returns
+    -------
+    str
+    """
+    return os.path.join(root, 'category={}'.format(quote(str(category), '')),
+                        'sample_id={}'.format(quote(str(sample_id), '')))
+
+
+def load_enrichment_dataset(path, category=None, sample_id=None,
+                            columns=None):
+    """ Load a partitioned Parquet dataset into EnrichmentResult class
+
+    Only the partitions that match category and sample_id are read, so a
+    single category or sample of a large project can be loaded without
+    reading the rest. Datasets are created by
+    magine.enrichment.project.run_enrichment_for_project, only the files
+    listed as done in its manifest are read.
+
+    Parameters
+    ----------
+    path : str
+        Root directory of the dataset
+    category : str, list, optional
+        Categories to load, default all
+    sample_id : str, list, optional
+        Sample ids to load, default all
+    columns : list, optional
+        Columns to load, default all
+
+    Returns
+    -------
+    EnrichmentResult
+
+    """
+
+    def _selected(values):
+        if values is None:
+            return None
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        return set(str(v) for v in values)
+
+    manifest_path = os.path.join(path, manifest_name)
+    if not os.path.exists(manifest_path):
+        raise ValueError('{} is not an enrichment dataset, {} not '
+                         'found'.format(path, manifest_name))
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    categories, sample_ids = _selected(category), _selected(sample_id)
+    files = []
+    for entry in manifest.values():
+        if entry['status'] != 'done' or entry['file'] is None:
+            continue
+        if categories is not None and \
+                str(entry['category']) not in categories:
+            continue
+        if sample_ids is not None and \
+                str(entry['sample_id']) not in sample_ids:
+            continue
+        files.append(os.path.join(path, entry['file']))
+    frames = [pd.read_parquet(f, columns=columns) for f in sorted(files)]
+    frames = [f for f in frames if len(f)]
+    if not frames:
+        return EnrichmentResult(columns=columns)
+    d = pd.concat(frames, ignore_index=True)
+    if 'adj_p_value' in d.columns:
+        d['significant_flag'] = False
+        d.loc[d['adj_p_value'] <= 0.05, 'significant_flag'] = True
+    return EnrichmentResult(d)
+
+
+class TermGeneIndex(object):
+    """ Precomputed mapping of term_name to gene ids
+
+    Genes are stored as integer ids into a shared gene vocabulary. Rows
+    sharing a term_name (e.g. from different sample_ids) are merged.
+
+    Attributes
+    ----------
+    terms : numpy.array
+        Unique term names, in order of appearance
+    vocabulary : numpy.array
+        Gene names, gene ids index into this array. May contain genes that
+        are not in any term.
+    matrix : scipy.sparse.csr_matrix
+        Binary matrix of terms by genes
+    """
+
+    def __init__(self, term_names, gene_strings):
+        term_names = np.asarray(term_names, dtype=object)
+        self.terms = pd.unique(term_names)
+        self._lookup = {t: n for n, t in enumerate(self.terms)}
+        rows, self.vocabulary = sim.genes_to_matrix(gene_strings)
+        codes = pd.Index(self.terms).get_indexer(term_names)
+        merge = sp.csr_matrix(
+            (np.ones(len(codes), dtype=np.int32),
+             (codes, np.arange(len(codes)))),
+            shape=(len(self.terms), len(codes))
+        )
+        self.matrix = sim.binarize(merge.dot(rows))
+
+    def gene_ids(self, term):
+        """ Gene ids of term, empty if term is not present
+
+        Parameters
+        ----------
+        term : str
+
+        Returns
+        -------
+        numpy.array
+        """
+        loc = self._lookup.get(term)
+        if loc is None:
+            return np.zeros(0, dtype=np.int32)
+        start, end = self.matrix.indptr[loc], self.matrix.indptr[loc + 1]
+        return self.matrix.indices[start:end]
+
+    def genes(self, term):
+        """ Set of gene names of term
+
+        Parameters
+        ----------
+        term : str
+
+        Returns
+        -------
+        set
+        """
+        return set(self.vocabulary[self.gene_ids(term)])
+
+
+class TermKeywordIndex(object):
+    """ Inverted index of lowercase term_name tokens to rows
+
+    Tokens are runs of letters and digits. A keyword matches a term if it
+    is a substring of the lowercase term name, as with str.contains.
+    Keywords are first matched against the (small) set of unique tokens,
+    by binary search over their sorted suffixes, and cached, so repeated
+    queries only touch the rows they return. Missing term names never
+    match.
+
+    Parameters
+    ----------
+    term_names : list_like
+    """
+    _token = re.compile(r'[^\W_]+')
+
+    def __init__(self, term_names):
+        codes, terms = pd.factorize(np.asarray(term_names, dtype=object))
+        self.terms = pd.Index(terms).str.lower()
+        # rows grouped by term, rows with a missing term_name (code -1) left
+        # out so that _offsets index into _order
+        valid = np.flatnonzero(codes != -1)
+        self._order = valid[np.argsort(codes[valid], kind='stable')]
+        self._offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes[codes != -1], minlength=len(terms)),
+                  out=self._offsets[1:])
+        self._n_rows = len(codes)
+
+        postings = dict()
+        for n, term in enumerate(self.terms):
+            for token in set(self._token.findall(term)):
+                postings.setdefault(token, []).append(n)
+        self.tokens = pd.Index(sorted(postings), dtype=object)
+        self._postings = [np.array(postings[t], dtype=np.int64)
+                          for t in self.tokens]
+
+        # every suffix of every token, sorted, so tokens containing a
+        # keyword are the suffixes in [keyword, keyword + max char)
+        suffixes = sorted((token[start:], n)
+                          for n, token in enumerate(self.tokens)
+                          for start in range(len(token)))
+        self._suffixes = np.array([i[0] for i in suffixes], dtype=object)
+        self._suffix_tokens = np.array([i[1] for i in suffixes],
+                                       dtype=np.int64)
+        self._cache = dict()
+
+    def _matching_tokens(self, token):
+        """ Ids of unique tokens that contain token """
+        start = np.searchsorted(self._suffixes, token, side='left')
+        end = np.searchsorted(self._suffixes, token + u'\U0010ffff',
+                              side='left')
+        return np.unique(self._suffix_tokens[start:end])
+
+    def term_ids(self, word):
+        """ Ids of unique terms that contain word
+
+        Parameters
+        ----------
+        word : str
+
+        Returns
+        -------
+        numpy.array
+        """
+        word = word.lower()
+        if word in self._cache:
+            return self._cache[word]
+        candidates = None
+        for token in set(self._token.findall(word)):
+            found = [self._postings[n] for n in
+                     self._matching_tokens(token)]
+            found = np.unique(np.concatenate(found)) if found else \
+                np.zeros(0, dtype=np.int64)
+            candidates = found if candidates is None else \
+                np.intersect1d(candidates, found, assume_unique=True)
+        if candidates is None:
+            candidates = np.arange(len(self.terms))
+        if not self._token.fullmatch(word):
+            # keyword spans several tokens or punctuation, check candidates
+            candidates = candidates[[word in self.terms[i]
+                                     for i in candidates]]
+        self._cache[word] = candidates
+        return candidates
+
+    def rows(self, words, how='any'):
+        """ Sorted row positions of terms matching words
+
+        Parameters
+        ----------
+        words : str, list
+        how : {'any', 'all'}
+            Rows that match any (OR) or all (AND) of the words
+
+        Returns
+        -------
+        numpy.array
+        """
+        if isinstance(words, str):
+            words = [words]
+        if how not in ('any', 'all'):
+            raise ValueError("how must be 'any' or 'all'")
+        ids = [self.term_ids(w) for w in words]
+        if not ids:
+            ids = np.zeros(0, dtype=np.int64)
+        elif how == 'any':
+            ids = np.unique(np.concatenate(ids))
+        else:
+            ids = reduce(np.intersect1d, ids)
+        starts = self._offsets[ids]
+        lengths = self._offsets[ids + 1] - starts
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(starts - offsets[:-1], lengths) + \
+            np.arange(offsets[-1])
+        return np.sort(self._order[positions])
+
+    def mask(self, words, how='any'):
+        """ Boolean row mask of terms matching words, see rows """
+        mask = np.zeros(self._n_rows, dtype=bool)
+        mask[self.rows(words, how)] = True
+        return mask
+
+
 class EnrichmentResult(Data):
+    _term_gene_index = None
+    _keyword_index = None
+    _column_levels = None
 
     def __init__(self, *args, **kwargs):
         super(EnrichmentResult, self).__init__(*args, **kwargs)
@@ -35,6 +321,108 @@ class EnrichmentResult(Data):
     def _constructor(self):
         return EnrichmentResult
 
+    def __setitem__(self, key, value):
+        self._term_gene_index = None
+        self._keyword_index = None
+        self._column_levels = None
+        super(EnrichmentResult, self).__setitem__(key, value)
+
+    def _update_inplace(self, *args, **kwargs):
+        self._term_gene_index = None
+        self._keyword_index = None
+        self._column_levels = None
+        super(EnrichmentResult, self)._update_inplace(*args, **kwargs)
+
+    @property
+    def term_gene_index(self):
+        """ Cached TermGeneIndex of term_name to genes
+
+        Built on first use and reset when columns are assigned and by pandas
+        inplace=True operations (sort_values, fillna, etc). Values edited in
+        place with .loc, .iloc, .at or .iat are not detected, call
+        reset_term_gene_index after such edits.
+
+        Returns
+        -------
+        TermGeneIndex
+        """
+        cached = self._term_gene_index
+        if cached is None or cached[0] is not self.index:
+            cached = (self.index,
+                      TermGeneIndex(self['term_name'].values,
+                                    self['genes'].values))
+            self._term_gene_index = cached
+        return cached[1]
+
+    def reset_term_gene_index(self):
+        """ Clear the cached term_gene_index and keyword_index """
+        self._term_gene_index = None
+        self._keyword_index = None
+        self._column_levels = None
+
+    @property
+    def keyword_index(self):
+        """ Cached TermKeywordIndex of term_name
+
+        Cached and reset the same way as term_gene_index.
+
+        Returns
+        -------
+        TermKeywordIndex
+        """
+        cached = self._keyword_index
+        if cached is None or cached[0] is not self.index:
+            cached = (self.index, TermKeywordIndex(self['term_name'].values))
+            self._keyword_index = cached
+        return cached[1]
+
+    def levels(self, column):
+        """ Cached set of unique values of column
+
+        Categorical columns use their categories. Cached and reset the same
+        way as term_gene_index.
+
+        Parameters
+        ----------
+        column : str
+
+        Returns
+        -------
+        set
+        """
+        cached = self._column_levels
+        if cached is None or cached[0] is not self.index:
+            cached = (self.index, dict())
+            self._column_levels = cached
+        if column not in cached[1]:
+            values = self[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                levels = set(values.cat.categories)
+            else:
+                levels = set(pd.unique(values.values))
+            cached[1][column] = levels
+        return cached[1][column]
+
+    def _options_mask(self, column, options):
+        """ Boolean mask of rows where column is in options
+
+        Options that are not values of column are reported. Returns None if
+        no rows should be filtered.
+        """
+        if isinstance(options, str):
+            if options not in self.levels(column):
+                print('{} not in {}'.format(
+                    options, sorted(self.levels(column))))
+                return None
+            return (self[column] == options).values
+        elif isinstance(options, list):
+            levels = self.levels(column)
+            for i in options:
+                if i not in levels:
+                    print('{} not in {}'.format(i, sorted(levels)))
+            return self[column].isin(options).values
+        return None
+
     def filter_rows(self, column, options, inplace=False):
         """
         Filters a pandas dataframe provides a column and filter selection.
@@ -50,19 +438,8 @@ class EnrichmentResult(Data):
         -------
         pd.DataFrame
         """
-
-        new_data = self.copy()
-        valid_opts = sorted(new_data[column].unique())
-        if isinstance(options, str):
-            if options not in valid_opts:
-                print('{} not in {}'.format(options, valid_opts))
-            else:
-                new_data = new_data[new_data[column] == options]
-        elif isinstance(options, list):
-            for i in options:
-                if i not in valid_opts:
-                    print('{} not in {}'.format(i, valid_opts))
-            new_data = new_data[new_data[column].isin(options)]
+        mask = self._options_mask(column, options)
+        new_data = self.copy() if mask is None else self[mask]
 
         if inplace:
             self._update_inplace(new_data)
@@ -75,7 +452,8 @@ class EnrichmentResult(Data):
         Filters an enrichment array.
 
         This is an aggregate function that allows ones to filter an entire
-        dataframe with a single function call.
+        dataframe with a single function call. All criteria are combined
+        into a single row mask before the data is copied.
 
         Parameters
         ----------
@@ -94,21 +472,48 @@ class EnrichmentResult(Data):
         -------
         new_data : EnrichmentResult
         """
-        new_data = self.copy()
+        mask = np.ones(len(self), dtype=bool)
         if p_value is not None:
             assert isinstance(p_value, (int, float))
-            new_data = new_data[new_data['adj_p_value'] <= p_value]
+            mask &= (self['adj_p_value'] <= p_value).values
         if combined_score is not None:
             assert isinstance(combined_score, (int, float))
-            new_data = new_data[new_data['combined_score'] >= combined_score]
+            mask &= (self['combined_score'] >= combined_score).values
         if isinstance(rank, (int, float)):
-            new_data = new_data[new_data['rank'] <= rank]
-        if db is not None:
-            new_data.filter_rows('db', db, inplace=True)
-        if sample_id is not None:
-            new_data.filter_rows('sample_id', sample_id, inplace=True)
-        if category is not None:
-            new_data.filter_rows('category', category, inplace=True)
+            mask &= (self['rank'] <= rank).values
+        for column, options in (('db', db), ('sample_id', sample_id),
+                                ('category', category)):
+            if options is not None:
+                column_mask = self._options_mask(column, options)
+                if column_mask is not None:
+                    mask &= column_mask
+        new_data = self[mask]
+        if inplace:
+            self._update_inplace(new_data)
+        else:
+            return new_data
+
+    def compact_genes(self, inplace=False):
+        """ Store 'genes' as integer ids into a shared gene vocabulary
+
+        Converts the comma separated strings of the 'genes' column to a
+        GeneListArray ('gene_list' dtype). Rows still read and export (CSV,
+        HTML) as comma separated strings, but use several times less memory
+        and similarity calculations skip splitting strings.
+        To load a csv directly into this format use
+        load_enrichment_csv(file_name, dtype={'genes': 'gene_list'}).
+
+        Parameters
+        ----------
+        inplace : bool
+            Convert in place or return a converted copy
+
+        Returns
+        -------
+        EnrichmentResult
+        """
+        new_data = self.copy()
+        new_data['genes'] = GeneListArray.from_lists(new_data['genes'].values)
         if inplace:
             self._update_inplace(new_data)
         else:
@@ -126,40 +531,54 @@ class EnrichmentResult(Data):
         set
 
         """
-        genes = self[self['term_name'] == term]['genes']
-        return set(itertools.chain.from_iterable(genes.str.split(',').values))
+        return self.term_gene_index.genes(term)
 
-    def filter_based_on_words(self, words, inplace=False):
+    def filter_based_on_words(self, words, inplace=False, how='any'):
         """ Filter term_name based on key terms
 
+        Words are matched case insensitive as substrings of term_name, using
+        the cached keyword_index.
+
         Parameters
         ----------
         words : list, str
             List of words to use to keep rows in dataframe
         inplace : bool
             Filter the dataframe in place or return filtered copy
+        how : {'any', 'all'}
+            Keep terms that contain any (OR) or all (AND) of the words
 
         Returns
         -------
         pandas.DataFrame
 
         """
-        if isinstance(words, str):
-            words = [words]
-        df = self.copy()
-        df = df[df['term_name'].str.lower().str.contains('|'.join(words))]
+        df = self.iloc[self.keyword_index.rows(words, how)]
         if inplace:
             self._update_inplace(df)
         else:
             return df
 
-    def find_similar_terms(self, term):
+    def find_similar_terms(self, term, approximate=False, threshold=0.5,
+                           num_perm=128, recall_weight=0.5, seed=0):
         """ Calculates similarity of all other terms to given term
 
         Parameters
         ----------
         term : str
-
+        approximate : bool
+            Only score terms found with MinHash/LSH. Candidates are scored
+            with the exact Jaccard index, terms that are not candidates are
+            left out of the output.
+        threshold : float
+            Jaccard index the LSH bands are tuned to, if approximate
+        num_perm : int
+            Number of MinHash permutations, if approximate
+        recall_weight : float
+            Weight of false negatives (0-1) used to choose LSH bands,
+            if approximate
+        seed : int
+            Seed of MinHash functions, if approximate
 
         Returns
         -------
@@ -168,6 +587,22 @@ class EnrichmentResult(Data):
 
         rest_of_df = self[~(self['term_name'] == term)]
         first_genes = self.term_to_genes(term)
+        if approximate:
+            matrix, _ = sim.genes_to_matrix(
+                [','.join(first_genes)] + list(rest_of_df['genes'].values)
+            )
+            rows, scores = sim.query_candidates(
+                matrix, 0, threshold, num_perm=num_perm,
+                recall_weight=recall_weight, seed=seed
+            )
+            df = pd.DataFrame(
+                {'term_name': rest_of_df['term_name'].values[rows - 1],
+                 'similarity_score': scores},
+                columns=['term_name', 'similarity_score']
+            )
+            df.sort_values('similarity_score', inplace=True, ascending=False)
+            return df
+
         array = rest_of_df[['term_name', 'genes']].values
         dist_m = [None] * len(array)
         for n, index in enumerate(array):
@@ -186,12 +621,81 @@ class EnrichmentResult(Data):
         -------
         set
         """
-        return set(
-            itertools.chain.from_iterable(self['genes'].str.split(',').values)
-        )
+        index = self.term_gene_index
+        return set(index.vocabulary[np.unique(index.matrix.indices)])
+
+    def empirical_p_values(self, gene_lists, background, term_genes=None,
+                           n_permutations=1000, seed=0, processes=1,
+                           inplace=False):
+        """ Add 'empirical_p_value' column from random gene lists
+
+        Random gene lists of the same size as each sample's gene list are
+        drawn from the background and overlapped with each term's full gene
+        set (see magine.enrichment.permutation). Unlike 'p_value', this
+        accounts for which genes could have been measured.
+
+        Parameters
+        ----------
+        gene_lists : list_like or dict
+            Gene list used for enrichment, or dict of sample_id to gene list
+        background : list_like or ExperimentalData
+            Genes to draw random lists from. For ExperimentalData, all
+            measured genes are used.
+        term_genes : dict, optional
+            Gene sets of terms, keyed by term_name or (db, term_name).
+            Default downloads the Enrichr libraries of the 'db' column.
+        n_permutations : int
+        seed : int
+            Results are reproducible for a given seed, regardless of
+            processes
+        processes : int
+            Number of processes to score random lists with
+        inplace : bool
+
+        Returns
+        -------
+        EnrichmentResult
+        """
+        if term_genes is None:
+            term_genes = perm.library_term_genes(self['db'].unique())
+        by_db = isinstance(next(iter(term_genes), None), tuple)
+        if by_db:
+            keys = pd.Series(list(zip(self['db'], self['term_name'])),
+                             index=self.index)
+        else:
+            keys = self['term_name']
+        terms = [i for i in pd.unique(keys) if i in term_genes]
+
+        if isinstance(gene_lists, dict):
+            samples = list(gene_lists)
+            rows = pd.Index(samples).get_indexer(self['sample_id'].values)
+            gene_lists = [gene_lists[i] for i in samples]
+        else:
+            rows = np.zeros(len(self), dtype=np.int64)
+            gene_lists = [gene_lists]
+
+        values = np.full(len(self), np.nan)
+        if terms:
+            p_values = perm.permutation_p_values(
+                gene_lists, [term_genes[i] for i in terms],
+                background, n_permutations=n_permutations, seed=seed,
+                processes=processes
+            )
+            cols = pd.Index(terms, tupleize_cols=False).get_indexer(
+                pd.Index(keys.values, tupleize_cols=False))
+            found = (rows != -1) & (cols != -1)
+            values[found] = p_values[rows[found], cols[found]]
+        new_data = self.copy()
+        new_data['empirical_p_value'] = values
+        if inplace:
+            self._update_inplace(new_data)
+        else:
+            return new_data
 
     def remove_redundant(self, threshold=0.75, verbose=False, level='sample',
-                         sort_by='combined_score', inplace=False):
+                         sort_by='combined_score', inplace=False,
+                         approximate=False, num_perm=128, recall_weight=0.5,
+                         seed=0):
         """
         Calculate similarity between all term sets and removes redundant terms.
 
@@ -211,12 +715,26 @@ class EnrichmentResult(Data):
             compares to all the lower terms. Options are
         inplace : bool
             Filter the dataframe in place or return filtered copy
+        approximate : bool, default False
+            Find similar terms with MinHash/LSH instead of scoring all pairs.
+            Candidate pairs are verified with the exact Jaccard index.
+            Recommended for very large (100k+ rows) dataframes.
+        num_perm : int, default 128
+            Number of MinHash permutations, if approximate
+        recall_weight : float, default 0.5
+            Weight of false negatives (0-1) used to choose LSH bands,
+            if approximate. Higher values find more pairs at the cost of
+            verifying more candidates.
+        seed : int, default 0
+            Seed of MinHash functions, if approximate
 
         Returns
         -------
         pandas.DataFrame
 
         """
+        lsh_kw = dict(approximate=approximate, num_perm=num_perm,
+                      recall_weight=recall_weight, seed=seed)
 
         if sort_by in ('rank', 'adj_p_value'):
             ascending = True
@@ -226,13 +744,15 @@ class EnrichmentResult(Data):
         self.sort_values(sort_by, inplace=True, ascending=ascending)
         data_copy = self.copy()
         if 'sample_id' not in data_copy.columns or level == 'dataframe':
-            to_keep = data_copy.unique_terms(threshold, verbose, level=level)
+            to_keep = data_copy.unique_terms(threshold, verbose, level=level,
+                                             **lsh_kw)
         else:
             to_keep = set()
             for i in sorted(data_copy['sample_id'].unique()):
                 tmp = data_copy[data_copy['sample_id'] == i]
                 to_keep.update(
-                    tmp.unique_terms(threshold, verbose, level=level)
+                    tmp.unique_terms(threshold, verbose, level=level,
+                                     **lsh_kw)
                 )
 
         data_copy = data_copy[(data_copy['term_name'].isin(to_keep))]
@@ -243,7 +763,9 @@ class EnrichmentResult(Data):
         else:
             return data_copy
 
-    def unique_terms(self, threshold=0.75, verbose=False, level='dataframe'):
+    def unique_terms(self, threshold=0.75, verbose=False, level='dataframe',
+                     approximate=False, num_perm=128, recall_weight=0.5,
+                     seed=0):
         """
 
         Parameters
@@ -251,11 +773,19 @@ class EnrichmentResult(Data):
         threshold : float
         verbose : bool
         level : str, {'dataframe', 'each'}
+        approximate : bool
+            Use MinHash/LSH to find similar terms
+        num_perm : int
+        recall_weight : float
+        seed : int
 
         Returns
         -------
 
         """
+        if approximate:
+            return self._unique_terms_lsh(threshold, verbose, level,
+                                          num_perm, recall_weight, seed)
         if level == 'dataframe':
             names = self['term_name'].unique()
             scores = self._get_distance_all()
@@ -291,7 +821,40 @@ class EnrichmentResult(Data):
 
         return to_keep
 
-    def dist_matrix(self, fig_size=(8, 8), level='dataframe'):
+    def _unique_terms_lsh(self, threshold, verbose, level, num_perm,
+                          recall_weight, seed):
+        if level == 'dataframe':
+            names = self.term_gene_index.terms
+            matrix = self.term_gene_index.matrix
+        else:
+            names = self['term_name'].values
+            matrix, _ = sim.genes_to_matrix(self['genes'].values)
+
+        rows, cols, scores = sim.similar_pairs(
+            matrix, threshold, num_perm=num_perm,
+            recall_weight=recall_weight, seed=seed
+        )
+        order = np.lexsort((cols, rows))
+        rows, cols, scores = rows[order], cols[order], scores[order]
+        starts = np.searchsorted(rows, np.arange(len(names) + 1))
+
+        to_remove, to_keep = set(), set()
+        for i, term_1 in enumerate(names):
+            if term_1 in to_remove:
+                continue
+            to_keep.add(term_1)
+            if verbose:
+                print("Finding matches for {}".format(term_1))
+            for j in range(starts[i], starts[i + 1]):
+                term_2 = names[cols[j]]
+                to_remove.add(term_2)
+                if verbose:
+                    print("\tScore for {} is {:.3f}".format(term_2, scores[j]))
+                    print("\t\tRemoving {}".format(term_2))
+        return to_keep
+
+    def dist_matrix(self, fig_size=(8, 8), level='dataframe', max_terms=1000,
+                    sort_by='combined_score', dtype=np.float64):
         """ Create a distance matrix of all term similarity
 
         Parameters
@@ -302,65 +865,56 @@ class EnrichmentResult(Data):
             How to treats term_name to genes. Dataframe compresses all genes
             from all sample_ids into same term. 'each' treats each term_name
             individually.
+        max_terms : int, optional
+            Maximum number of terms to plot. If there are more terms, a
+            warning is raised and only the top max_terms terms by sort_by
+            are used. None plots all terms.
+        sort_by : {'combined_score', 'rank', 'adj_p_value', 'n_genes'}
+            Score used to select the top terms when limited by max_terms
+        dtype : numpy.dtype
+            Type of the similarity matrix, np.float32 halves memory
 
         Returns
         -------
         matplotlib.Figure
 
         """
+        data = self
+        n_dim = len(self) if level == 'each' else self['term_name'].nunique()
+        if max_terms is not None and n_dim > max_terms:
+            warnings.warn(
+                "{} terms is more than max_terms={}. Using the top {} terms "
+                "by {}; pass max_terms=None to use all terms."
+                "".format(n_dim, max_terms, max_terms, sort_by),
+                stacklevel=2
+            )
+            data = self._top_terms(max_terms, sort_by, level)
+
         if level == 'each':
-            names = self['term_name'].values
-            scores = self._get_distance_each()
+            names = data['term_name'].values
+            matrix, _ = sim.genes_to_matrix(data['genes'].values)
         else:
-            names = self['term_name'].unique()
-            scores = self._get_distance_all()
-        n_dim = len(names)
-
-        mat = np.ones((n_dim, n_dim), dtype=float)
-        ind = 0
-        for i in range(n_dim):
-            for j in range(n_dim):
-                if i >= j:
-                    continue
-                mat[i, j] = scores[ind]
-                mat[j, i] = scores[ind]
-                ind += 1
-        return cluster_distance_mat(mat, names, fig_size)
+            names = data.term_gene_index.terms
+            matrix = data.term_gene_index.matrix
+        scores = sim.condensed_jaccard(matrix, dtype=dtype)
+        return cluster_distance_mat(scores, names, fig_size)
+
+    def _top_terms(self, n_terms, sort_by, level):
+        """ Rows of the n_terms best terms according to sort_by """
+        ascending = sort_by in ('rank', 'adj_p_value')
+        if level == 'each':
+            return self.sort_values(sort_by, ascending=ascending)[:n_terms]
+        grouped = self.groupby('term_name')[sort_by]
+        best = grouped.min() if ascending else grouped.max()
+        keep = best.sort_values(ascending=ascending).index[:n_terms]
+        return self[self['term_name'].isin(keep)]
 
     def _get_distance_each(self):
-        names = self['term_name'].values
-        array = self['genes'].values
-        n_dim = len(names)
-        total_size = int(((n_dim * (n_dim - 1)) / 2))
-        scores = np.zeros(total_size, dtype=float)
-        ind = 0
-        for i, ac in enumerate(array):
-            first_genes = set(ac.split(','))
-            for j, bc in enumerate(array):
-                if i >= j:
-                    continue
-                scores[ind] = self.jaccard_index(first_genes,
-                                                 set(bc.split(',')))
-                ind += 1
-        return scores
+        matrix, _ = sim.genes_to_matrix(self['genes'].values)
+        return sim.condensed_jaccard(matrix)
 
     def _get_distance_all(self):
-        names = self['term_name'].unique()
-        n_dim = len(names)
-        total_size = int(((n_dim * (n_dim - 1)) / 2))
-        scores = np.zeros(total_size, dtype=float)
-        ind = 0
-        for i, n1 in enumerate(names):
-            first_genes = self.term_to_genes(n1)
-            for j, n2 in enumerate(names):
-                if i >= j:
-                    continue
-                else:
-                    scores[ind] = self.jaccard_index(first_genes,
-                                                     self.term_to_genes(n2))
-                    ind += 1
-
-        return scores
+        return sim.condensed_jaccard(self.term_gene_index.matrix)
 
     @staticmethod
     def jaccard_index(first_set, second_set):
@@ -2,6 +2,7 @@ import json
 import os
 import re
 import time
+from multiprocessing.pool import ThreadPool
 # Will be OK in Python 2
 try:
     basestring
@@ -15,6 +16,9 @@ import requests
 
 from magine.plotting.species_plotting import write_table_to_html
 from magine.enrichment.enrichment_result import EnrichmentResult
+from magine.enrichment.gene_lists import GeneListArray
+from magine.enrichment.pivot_export import write_pivot_excel, \
+    write_pivot_parquet
 
 _path = os.path.dirname(__file__)
 
@@ -25,6 +29,9 @@ with open(os.path.join(_path, '_valid_enricher_libs.txt'), 'r') as f:
 
 gene = 'gene'
 
+_enrichr_url = 'http://amp.pharm.mssm.edu/Enrichr'
+_max_retry_wait = 4.
+
 db_types = {
     'histone': [
         'Epigenomics_Roadmap_HM_ChIP-seq',
@@ -129,10 +136,37 @@ db_types = {
 class Enrichr(object):
     query = '{url}/enrich?userListId={list_id}&backgroundType={lib}'
 
-    def __init__(self, verbose=False):
-        self._url = 'http://amp.pharm.mssm.edu/Enrichr'
+    def __init__(self, verbose=False, compact_genes=False, max_workers=8,
+                 url=_enrichr_url, max_retries=3, retry_wait=1.):
+        """
+
+        Parameters
+        ----------
+        verbose : bool
+        compact_genes : bool
+            Store the 'genes' column as integer ids into a gene vocabulary
+            (see magine.enrichment.gene_lists) instead of comma
+            separated strings. Reduces memory of large multi-sample results.
+        max_workers : int
+            Number of concurrent requests to Enrichr. Gene lists are added
+            and libraries are queried with a pool of this many threads.
+            Use 1 to run requests one after another.
+        url : str
+            Base url of the Enrichr API
+        max_retries : int
+            Number of times a failed request is retried before raising an
+            exception
+        retry_wait : float
+            Seconds to wait before the first retry, doubled after each
+            retry (up to 4 seconds)
+        """
+        self._url = url
+        self.max_retries = max_retries
+        self.retry_wait = retry_wait
         self._valid_libs = _valid_libs
         self.verbose = verbose
+        self.compact_genes = compact_genes
+        self.max_workers = max_workers
 
     def print_valid_libs(self):
         """
@@ -166,18 +200,13 @@ class Enrichr(object):
         if self.verbose:
             print("Running Enrichr with gene set {}".format(gene_set_lib))
 
-        user_list_id = self._add_gene_list(list_of_genes)
-        if isinstance(gene_set_lib, str):
-
-            df = self._run_id(user_list_id, gene_set_lib)
-        else:
-            df = self._run_list_of_dbs(user_list_id, gene_set_lib)
+        df = self._run_lists([list_of_genes], gene_set_lib)
 
         init_size = len(df)
         if init_size == 0:
             print("No terms returned")
             return df
-        df['term_name'] = df.apply(clean_term_names, axis=1)
+        df['term_name'] = clean_term_names_by_db(df)
         after_size = len(df)
         assert init_size == after_size, 'not the same shape {}'.format(
             gene_set_lib)
@@ -193,17 +222,7 @@ class Enrichr(object):
             return EnrichmentResult()
 
         q = self.query.format(url=self._url, list_id=list_id, lib=gene_set_lib)
-        while True:
-            try:
-                response = requests.get(q)
-                break
-            except:
-                time.sleep(1)
-
-        if not response.ok:
-            # quick way to wait for response
-            while not response.ok:
-                response = requests.get(q)
+        response = self._request(requests.get, q)
 
         data = json.loads(response.text)
         if len(data[gene_set_lib]) == 0:
@@ -220,14 +239,12 @@ class Enrichr(object):
                      'combined_score', 'gene_hits', 'adj_p_value', '_', '_']
         )
 
-        def compress_genes(row):
-            return ','.join(g for g in sorted(row['gene_hits']))
-
-        def get_length(row):
-            return len(row['gene_hits'])
-
-        df['genes'] = df.apply(compress_genes, axis=1)
-        df['n_genes'] = df.apply(get_length, axis=1)
+        hits = [sorted(g) for g in df['gene_hits'].values]
+        if self.compact_genes:
+            df['genes'] = GeneListArray.from_lists(hits)
+        else:
+            df['genes'] = [','.join(g) for g in hits]
+        df['n_genes'] = [len(g) for g in hits]
 
         cols = ['term_name', 'rank', 'p_value', 'z_score', 'combined_score',
                 'adj_p_value', 'genes', 'n_genes']
@@ -246,28 +263,100 @@ class Enrichr(object):
             'description': (None, 'MAGINE analysis')
         }
 
-        response = requests.post(self._url + '/addList', files=payload)
-        if not response.ok:
-            raise Exception('Error analyzing gene list')
+        response = self._request(requests.post, self._url + '/addList',
+                                 files=payload)
 
         data = json.loads(response.text)
         return data['userListId']
 
-    def _run_list_of_dbs(self, gene_list_id, databases):
-        for count, i in enumerate(databases):
-            if count == 0:
-                data = self._run_id(gene_list_id, i)
-            else:
-                data = data.append(self._run_id(gene_list_id, i),
-                                   ignore_index=True)
-            if self.verbose:
-                print('\t\t{}/{} databases'.format(count, len(databases)))
-        return data
+    def _request(self, method, url, **kwargs):
+        """ Call requests method, retrying with exponential backoff
+
+        Parameters
+        ----------
+        method : requests.get, requests.post
+        url : str
+        kwargs : dict
+            Passed to method
+
+        Returns
+        -------
+        requests.Response
+        """
+        wait = self.retry_wait
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = method(url, **kwargs)
+                if response.ok:
+                    return response
+                error = 'status code {}'.format(response.status_code)
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+            if attempt < self.max_retries:
+                time.sleep(wait)
+                wait = min(2 * wait, _max_retry_wait)
+        raise Exception('Error calling Enrichr {} after {} retries: '
+                        '{}'.format(url, self.max_retries, error))
+
+    def _map(self, func, items):
+        """ Apply func to each item using a pool of max_workers threads """
+        items = list(items)
+        n_workers = min(self.max_workers, len(items))
+        if n_workers <= 1:
+            return list(map(func, items))
+        pool = ThreadPool(n_workers)
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _run_lists(self, gene_lists, databases, sample_ids=None):
+        """ Run all gene lists against all databases concurrently
+
+        Each gene list is added once, then every (list, database) pair is
+        queried. Results are concatenated once at the end.
+
+        Parameters
+        ----------
+        gene_lists : list
+            List of lists of genes
+        databases : str, list
+        sample_ids : list, optional
+            Added as 'sample_id' column to results of each gene list
+
+        Returns
+        -------
+        EnrichmentResult
+        """
+        if isinstance(databases, basestring):
+            databases = [databases]
+        list_ids = self._map(self._add_gene_list, gene_lists)
+        if sample_ids is None:
+            sample_ids = [None] * len(list_ids)
+        tasks = [(list_id, db, sample_id)
+                 for list_id, sample_id in zip(list_ids, sample_ids)
+                 for db in databases]
+
+        def _query(task):
+            list_id, db, sample_id = task
+            data = self._run_id(list_id, db)
+            if sample_id is not None and len(data):
+                data['sample_id'] = sample_id
+            return data
+
+        frames = [df for df in self._map(_query, tasks) if len(df)]
+        if self.verbose:
+            print('\t\t{} gene lists, {} databases'.format(len(list_ids),
+                                                           len(databases)))
+        if not frames:
+            return EnrichmentResult()
+        return pd.concat(frames, ignore_index=True)
 
     def run_samples(self, sample_lists, sample_ids,
                     database='GO_Biological_Process_2017', save_name=None,
                     create_html=False, out_dir=None, run_parallel=False,
-                    exp_data=None, pivot=False):
+                    exp_data=None, pivot=False, pivot_format='xlsx'):
         """
 
         Parameters
@@ -290,6 +379,11 @@ class Enrichr(object):
         exp_data : magine.data.ExperimentalData
             Must be provided if create_html=True
         pivot : bool
+            If save_name is provided, also save the table pivoted by
+            sample_id (term_name and db vs values of each sample)
+        pivot_format : {'xlsx', 'parquet'}
+            File format of the pivoted table. Both are written in chunks,
+            so large results do not need to be pivoted in memory.
 
         Returns
         -------
@@ -298,32 +392,26 @@ class Enrichr(object):
         assert isinstance(sample_lists, list), "List required"
         assert isinstance(sample_lists[0],
                           (list, set)), "List of lists required"
-        df_final = None
-        for count, (i, j) in enumerate(zip(sample_lists, sample_ids)):
-            df = self.run(i, database)
-            df['sample_id'] = j
-            if df_final is None:
-                df_final = df
-            else:
-                df_final = df_final.append(df, ignore_index=True)
+        if pivot_format not in ('xlsx', 'parquet'):
+            raise ValueError("pivot_format must be 'xlsx' or 'parquet', got "
+                             "{!r}".format(pivot_format))
+        if self.verbose:
+            print("Running Enrichr with gene set {}".format(database))
+        df_final = self._run_lists(sample_lists, database, sample_ids)
+        if len(df_final) == 0:
+            print("No terms returned")
+            return df_final
+        df_final['term_name'] = clean_term_names_by_db(df_final)
 
         df_final = self._filter_sig_across_term(df_final)
 
         if save_name:
             s_name = '{}_enrichr'.format(save_name)
             if pivot:
-                # pivot output
-                index = ['term_name', 'db']
-
-                p_df = pd.pivot_table(
-                    df_final, index=index, columns='sample_id',
-                    aggfunc='first',
-                    fill_value=np.nan,
-                    values=['term_name', 'rank', 'p_value', 'z_score',
-                            'combined_score', 'adj_p_value', 'genes'],
-                )
-                # save files
-                p_df.to_excel('{}.xlsx'.format(s_name), merge_cells=True)
+                if pivot_format == 'parquet':
+                    write_pivot_parquet(df_final, '{}.parquet'.format(s_name))
+                else:
+                    write_pivot_excel(df_final, '{}.xlsx'.format(s_name))
             df_final.to_csv('{}.csv'.format(s_name), index=False)
 
         if create_html:
@@ -349,80 +437,168 @@ class Enrichr(object):
         -------
 
         """
-        non_sig = []
-        for i, g in data.groupby(['term_name', 'db']):
-            if len(g[g['adj_p_value'] <= p_value_thresh]) == 0:
-                non_sig.append(i[0])
-
+        groups = data.groupby(['term_name', 'db'])
+        min_p = groups['adj_p_value'].transform('min')
+        non_sig = data.loc[~(min_p <= p_value_thresh), 'term_name'].unique()
         return data[~data['term_name'].isin(non_sig)]
 
 
+_go_dbs = {'GO_Biological_Process_2017', 'GO_Biological_Process_2017b',
+           'GO_Molecular_Function_2017', 'GO_Molecular_Function_2017b',
+           'GO_Cellular_Component_2017', 'GO_Cellular_Component_2017b'}
+_drug_matrix_name = re.compile(r'^(.*)(-\d*.*\d_)')
+_drug_matrix_direction = re.compile(r'(-.{2})$')
+
+_tf_dbs = ['ARCHS4_TFs_Coexp',
+           'ChEA_2016',
+           'ENCODE_and_ChEA_Consensus_TFs_from_ChIP-X',
+           'ENCODE_TF_ChIP-seq_2015',
+           'Enrichr_Submissions_TF-Gene_Coocurrence',
+           'TRANSFAC_and_JASPAR_PWMs',
+           'TF-LOF_Expression_from_GEO',
+           'Transcription_Factor_PPIs']
+
+
+def _clean_db_terms(terms, db):
+    """ Clean a Series of unique raw term names from a single db
+
+    Raises ValueError for names without the parts expected for db.
+    """
+    malformed = None
+    if db in _go_dbs:
+        terms = terms.where(
+            ~terms.str.contains('GO:', regex=False),
+            terms.str.split('(GO:', n=1, regex=False).str[0]
+        ).where(
+            terms.str.contains('GO:', regex=False),
+            terms.str.split('(go:', n=1, regex=False).str[0]
+        )
+    elif db == 'Human_Phenotype_Ontology':
+        terms = terms.str.split('(HP:', n=1, regex=False).str[0]
+    elif db == 'MGI_Mammalian_Phenotype_2017':
+        malformed = terms.str.startswith('MP:') & \
+            ~terms.str.contains('_', regex=False)
+        terms = terms.where(~terms.str.startswith('MP:'),
+                            terms.str.split('_', n=1, regex=False).str[1])
+    elif db == 'DrugMatrix':
+        cleaned = terms.str.extract(_drug_matrix_name, expand=False)[0] + \
+            terms.str.extract(_drug_matrix_direction, expand=False)
+        malformed = cleaned.isnull()
+        terms = cleaned
+    elif db in ('LINCS_L1000_Chem_Pert_up', 'LINCS_L1000_Chem_Pert_down'):
+        # experiment id, drug name and a suffix
+        malformed = terms.str.count('-') < 2
+        terms = terms.str.split('-', n=1, regex=False).str[1]
+        terms = terms.str.rsplit('-', n=1).str[0]
+    elif db in ('Old_CMAP_down', 'Old_CMAP_up'):
+        terms = terms.str.rsplit('-', n=1).str[0]
+    elif db in ('Ligand_Perturbations_from_GEO_down',
+                'Ligand_Perturbations_from_GEO_up'):
+        terms = terms.str.split('_', n=1, regex=False).str[0]
+
+    if malformed is not None and malformed.any():
+        raise ValueError('Malformed {} term names: {}'.format(
+            db, list(malformed.index[malformed])))
+    terms = terms.str.strip().str.lower()
+    for i, j in replace_pairs:
+        terms = terms.str.replace(i, j, regex=False)
+    return terms
+
+
+def clean_term_names_by_db(data):
+    """ Clean 'term_name' of Enrichr output
+
+    Term names are cleaned per 'db' using vectorized string operations on
+    the unique names of each db, so terms that recur across samples are
+    only cleaned once. Rows without a db only get the generic cleaning.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Must contain 'term_name' and 'db' columns
+
+    Returns
+    -------
+    numpy.array
+        Cleaned term names, aligned with rows of data
+    """
+    terms = data['term_name'].values
+    out = np.array(terms, dtype=object)
+    groups = data.groupby('db', sort=False, dropna=False).indices
+    for db, rows in groups.items():
+        codes, uniques = pd.factorize(terms[rows])
+        is_name = np.array([isinstance(t, basestring) for t in uniques],
+                           dtype=bool)
+        mapped = np.array(uniques, dtype=object)
+        if is_name.any():
+            names = pd.Series(mapped[is_name], index=mapped[is_name],
+                              dtype=object)
+            mapped[is_name] = _clean_db_terms(names, db).values
+        has_name = codes >= 0
+        out[rows[has_name]] = mapped[codes[has_name]]
+    return out
+
+
 def clean_term_names(row):
+    """ Clean 'term_name' of a single row, see clean_term_names_by_db """
     term_name = row['term_name']
     if not isinstance(term_name, basestring):
         return term_name
-
     db = row['db']
 
-    if db in ['GO_Biological_Process_2017', 'GO_Biological_Process_2017b',
-              'GO_Molecular_Function_2017', 'GO_Molecular_Function_2017b',
-              'GO_Cellular_Component_2017', 'GO_Cellular_Component_2017b']:
-
+    malformed = False
+    if db in _go_dbs:
         if 'GO:' in term_name:
             term_name = term_name.split('(GO:', 1)[0]
-        elif 'go:' in term_name:
+        else:
             term_name = term_name.split('(go:', 1)[0]
-    if db == 'Human_Phenotype_Ontology':
-        if 'HP:' in term_name:
-            term_name = term_name.split('(HP:', 1)[0]
-
-    if db == 'MGI_Mammalian_Phenotype_2017':
+    elif db == 'Human_Phenotype_Ontology':
+        term_name = term_name.split('(HP:', 1)[0]
+    elif db == 'MGI_Mammalian_Phenotype_2017':
         if term_name.startswith('MP:'):
-            term_name = term_name.split('_', 1)[1]
-
-    if db == 'DrugMatrix':
-        drug_name = re.search(r'^(.*)(-\d*.*\d_)', term_name).group(1)
-        direction = re.search(r'-(.{2})$', term_name).group(0)
-        term_name = drug_name + direction
-    if db in ['LINCS_L1000_Chem_Pert_up', 'LINCS_L1000_Chem_Pert_down', ]:
-        exp_id, rest = term_name.split('-', 1)
-        drug_name, _ = rest.rsplit('-', 1)
-        term_name = drug_name
-    if db in ['Old_CMAP_down', 'Old_CMAP_up', ]:
+            malformed = '_' not in term_name
+            term_name = term_name.split('_', 1)[-1]
+    elif db == 'DrugMatrix':
+        drug_name = _drug_matrix_name.search(term_name)
+        direction = _drug_matrix_direction.search(term_name)
+        malformed = drug_name is None or direction is None
+        if not malformed:
+            term_name = drug_name.group(1) + direction.group(1)
+    elif db in ('LINCS_L1000_Chem_Pert_up', 'LINCS_L1000_Chem_Pert_down'):
+        malformed = term_name.count('-') < 2
+        if not malformed:
+            term_name = term_name.split('-', 1)[1].rsplit('-', 1)[0]
+    elif db in ('Old_CMAP_down', 'Old_CMAP_up'):
         term_name = term_name.rsplit('-', 1)[0]
-    if db in ['Ligand_Perturbations_from_GEO_down',
-              'Ligand_Perturbations_from_GEO_up']:
+    elif db in ('Ligand_Perturbations_from_GEO_down',
+                'Ligand_Perturbations_from_GEO_up'):
         term_name = term_name.split('_', 1)[0]
 
-    term_name = term_name.strip()
-    term_name = term_name.lower()
+    if malformed:
+        raise ValueError('Malformed {} term names: {}'.format(
+            db, [row['term_name']]))
+    term_name = term_name.strip().lower()
     for i, j in replace_pairs:
-        if i in term_name:
-            term_name = term_name.replace(i, j)
-
+        term_name = term_name.replace(i, j)
     return term_name
 
 
 def clean_tf_names(data):
-    def return_single_tf(row):
-        """
-        Gets TF name only
-        """
-        tf = row['term_name']
-        if '_' in tf:
-            tf = tf.split('_')[0]
-        return tf.upper()
-
-    tf_dbs = ['ARCHS4_TFs_Coexp',
-              'ChEA_2016',
-              'ENCODE_and_ChEA_Consensus_TFs_from_ChIP-X',
-              'ENCODE_TF_ChIP-seq_2015',
-              'Enrichr_Submissions_TF-Gene_Coocurrence',
-              'TRANSFAC_and_JASPAR_PWMs',
-              'TF-LOF_Expression_from_GEO',
-              'Transcription_Factor_PPIs']
-    tfs = data[data['db'].isin(tf_dbs)].copy()
-    tfs['term_name'] = tfs.apply(return_single_tf, axis=1)
+    """ Return rows from transcription factor dbs with TF names only
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    tfs = data[data['db'].isin(_tf_dbs)].copy()
+    codes, uniques = pd.factorize(tfs['term_name'].values)
+    names = pd.Series(uniques, dtype=object)
+    names = names.str.split('_', n=1, regex=False).str[0].str.upper()
+    tfs['term_name'] = names.values[codes]
     return tfs
 
 
@@ -459,8 +635,10 @@ for i in ['drug', 'disease', 'ontologies', 'pathways', 'transcription',
     standard_dbs += db_types[i]
 
 
-def run_enrichment_for_project(exp_data, project_name):
-    """
+def run_enrichment_for_project(exp_data, project_name, **kwargs):
+    """ Run Enrichr for each category and sample_id of a project
+
+    See magine.enrichment.project.run_enrichment_for_project
 
     Parameters
     ----------
@@ -469,68 +647,37 @@ def run_enrichment_for_project(exp_data, project_name):
 
     Returns
     -------
-
+    str
+        Path of the partitioned Parquet dataset
     """
-    e = Enrichr(verbose=True)
-    all_df = []
-    _dir = 'enrichment_output'
-    if not os.path.exists(_dir):
-        os.mkdir(_dir)
-
-    print("Running {} databases".format(len(standard_dbs)))
-
-    def _run_new(samples, timepoints, category):
-        print("Running {}".format(category))
-        for genes, sample_id in zip(samples, timepoints):
-            print('\t time point = {}'.format(sample_id))
-            current = "{}_{}_{}".format(str(category),
-                                        str(sample_id),
-                                        project_name)
-            name = os.path.join(_dir, current + '.csv.gz')
-            try:
-                df = pd.read_csv(name, index_col=None, encoding='utf-8')
-            except:
-                df = e.run(genes, standard_dbs)
-                df['sample_id'] = sample_id
-                df['category'] = category
-                df.to_csv(name, index=False, encoding='utf-8',
-                          compression='gzip')
-            df['sample_id'] = sample_id
-            df['category'] = category
-            all_df.append(df)
-
-    pt = exp_data.proteins.sample_ids
-    rt = exp_data.rna.sample_ids
-
-    if len(pt) != 0:
-        _run_new(exp_data.proteins.sig.by_sample, pt, 'proteomics_both')
-        _run_new(exp_data.proteins.sig.up_by_sample, pt, 'proteomics_up')
-        _run_new(exp_data.proteins.sig.down_by_sample, pt, 'proteomics_down')
-
-    if len(rt) != 0:
-        _run_new(exp_data.rna.by_sample, rt, 'rna_both')
-        _run_new(exp_data.rna.sig.down_by_sample, rt, 'rna_down')
-        _run_new(exp_data.rna.up.up_by_sample, rt, 'rna_up')
-
-    final_df = pd.concat(all_df, ignore_index=True)
-
-    final_df = final_df[
-        ['term_name', 'rank', 'combined_score', 'adj_p_value', 'genes',
-         'n_genes', 'sample_id', 'category', 'db']
-    ]
-    final_df = final_df[~final_df['term_name'].isnull()]
-    final_df.to_csv('{}.csv.gz'.format(project_name), encoding='utf-8',
-                    compression='gzip')
-    print("Done with enrichment")
+    from magine.enrichment.project import run_enrichment_for_project as run
+    return run(exp_data, project_name, **kwargs)
+
+
+def _get_library(lib_name, url=_enrichr_url):
+    """ Raw term names to genes dict of an Enrichr library """
+    enrichment_url = url + '/geneSetLibrary'
+    query_string = '?userListId&libraryName=%s'
+    response = requests.get(
+        enrichment_url + query_string % lib_name
+    )
+    if not response.ok:
+        raise Exception('Error fetching enrichment results')
+
+    results = json.loads(response.text)
+    assert lib_name in results
+    return results[lib_name]['terms']
 
 
-def get_background_list(lib_name):
+def get_background_list(lib_name, url=_enrichr_url):
     """
     Return reference list for given gene referecen set
 
     Parameters
     ----------
     lib_name : str
+    url : str
+        Base url of the Enrichr API
 
     Returns
     -------
@@ -539,20 +686,9 @@ def get_background_list(lib_name):
 
     # http://amp.pharm.mssm.edu/Enrichr/geneSetLibrary?mode=text&libraryName=Genes_Associated_with_NIH_Grants
 
-    enrichment_url = 'http://amp.pharm.mssm.edu/Enrichr/geneSetLibrary'
-    query_string = '?userListId&libraryName=%s'
-    response = requests.get(
-        enrichment_url + query_string % lib_name
-    )
-    if not response.ok:
-        raise Exception('Error fetching enrichment results')
-
-    results = json.loads(response.text)
-
+    terms = _get_library(lib_name, url)
     term_to_gene = []
-    assert lib_name in results
-
-    for term, genes_dict in results[lib_name]['terms'].items():
+    for term, genes_dict in terms.items():
         genes = sorted(set(i for i in genes_dict))
         term_to_gene.append(
             dict(term=term.lower(), gene_list=genes, n_genes=len(genes))
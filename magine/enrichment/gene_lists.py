@@ -0,0 +1,394 @@
+"""
+Compact storage of gene lists for enrichment results.
+
+Each row stores integer ids into the gene vocabulary of its array, laid
+out as offsets into a single int32 array. Arrays taken from an array share
+its vocabulary, which is released with the last array using it.
+GeneListArray is a pandas extension
+array, so the 'genes' column of an EnrichmentResult can hold it directly
+while filtering, concatenating and exporting to CSV/HTML as before (rows
+are converted back to comma separated strings).
+
+Examples
+--------
+>>> import pandas as pd
+>>> genes = pd.Series(['BAX,BCL2', 'CASP3'], dtype='gene_list')
+>>> genes[0]
+'BAX,BCL2'
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from pandas.api.extensions import ExtensionArray, ExtensionDtype, \
+    register_extension_dtype
+
+
+class GeneVocabulary(object):
+    """ Append only mapping of gene names to integer ids """
+
+    def __init__(self):
+        self._ids = dict()
+        self._names = []
+        self._array = np.array([], dtype=object)
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def names(self):
+        """ numpy.array of gene names, indexed by gene id """
+        if len(self._array) != len(self._names):
+            self._array = np.array(self._names, dtype=object)
+        return self._array
+
+    def encode(self, genes):
+        """ Convert gene names to ids, adding new names to the vocabulary
+
+        Parameters
+        ----------
+        genes : list_like
+
+        Returns
+        -------
+        numpy.array
+        """
+        codes, uniques = pd.factorize(np.asarray(genes, dtype=object))
+        ids = np.empty(len(uniques), dtype=np.int32)
+        for n, g in enumerate(uniques):
+            i = self._ids.get(g)
+            if i is None:
+                i = len(self._names)
+                self._ids[g] = i
+                self._names.append(g)
+            ids[n] = i
+        return ids[codes]
+
+    def decode(self, ids):
+        """ Convert gene ids to names
+
+        Parameters
+        ----------
+        ids : numpy.array
+
+        Returns
+        -------
+        numpy.array
+        """
+        return self.names[ids]
+
+
+@register_extension_dtype
+class GeneListDtype(ExtensionDtype):
+    """ pandas dtype of GeneListArray, available as 'gene_list' """
+    name = 'gene_list'
+    type = str
+    kind = 'O'
+    na_value = pd.NA
+
+    @classmethod
+    def construct_array_type(cls):
+        return GeneListArray
+
+
+class GeneListArray(ExtensionArray):
+    """ Array of gene lists stored as ids into a gene vocabulary
+
+    Parameters
+    ----------
+    offsets : numpy.array
+        Row i holds ids[offsets[i]:offsets[i + 1]]
+    ids : numpy.array
+        Gene ids of all rows
+    mask : numpy.array, optional
+        True for missing rows
+    vocabulary : GeneVocabulary, optional
+        Vocabulary of ids, default a new (empty) vocabulary
+    """
+    _dtype = GeneListDtype()
+    sep = ','
+
+    def __init__(self, offsets, ids, mask=None, vocabulary=None):
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+        self._ids = np.asarray(ids, dtype=np.int32)
+        if mask is None:
+            mask = np.zeros(len(self._offsets) - 1, dtype=bool)
+        self._mask = np.asarray(mask, dtype=bool)
+        if vocabulary is None:
+            vocabulary = GeneVocabulary()
+        self.vocabulary = vocabulary
+
+    @staticmethod
+    def _split(values, sep):
+        """ Lists of genes and missing mask of values, see from_lists """
+        lists, mask = [], np.zeros(len(values), dtype=bool)
+        for n, v in enumerate(values):
+            if isinstance(v, str):
+                lists.append(v.split(sep) if v else [])
+            elif pd.api.types.is_scalar(v) and pd.isna(v):
+                lists.append([])
+                mask[n] = True
+            else:
+                lists.append(list(v))
+        return lists, mask
+
+    @classmethod
+    def from_lists(cls, values, sep=',', vocabulary=None):
+        """ Create from lists of genes or delimited strings
+
+        Parameters
+        ----------
+        values : list_like
+            Each entry is a delimited string, a list_like of genes or
+            missing (NA/NaN/None)
+        sep : str
+            Delimiter of string entries
+        vocabulary : GeneVocabulary, optional
+            Vocabulary to add the genes to, default a new vocabulary
+
+        Returns
+        -------
+        GeneListArray
+        """
+        if isinstance(values, GeneListArray):
+            if vocabulary is None or vocabulary is values.vocabulary:
+                return values.copy()
+            return cls._concat_same_type([values], vocabulary)
+        if vocabulary is None:
+            vocabulary = GeneVocabulary()
+        lists, mask = cls._split(values, sep)
+        lengths = np.fromiter((len(i) for i in lists), dtype=np.int64,
+                              count=len(lists))
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        flat = [g for i in lists for g in i]
+        return cls(offsets, vocabulary.encode(flat), mask, vocabulary)
+
+    # pandas constructors
+    @classmethod
+    def _from_sequence(cls, scalars, dtype=None, copy=False):
+        return cls.from_lists(scalars)
+
+    @classmethod
+    def _from_sequence_of_strings(cls, strings, dtype=None, copy=False):
+        return cls.from_lists(strings)
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls.from_lists(values, vocabulary=original.vocabulary)
+
+    @classmethod
+    def _concat_same_type(cls, to_concat, vocabulary=None):
+        to_concat = list(to_concat)
+        vocabularies = set(id(i.vocabulary) for i in to_concat)
+        if vocabulary is None and len(vocabularies) == 1:
+            vocabulary = to_concat[0].vocabulary
+            ids = [i._ids for i in to_concat]
+        else:
+            # arrays of other vocabularies are re-encoded
+            if vocabulary is None:
+                vocabulary = GeneVocabulary()
+            ids = [vocabulary.encode(i.vocabulary.names)[i._ids]
+                   if i.vocabulary is not vocabulary else i._ids
+                   for i in to_concat]
+        sizes = np.cumsum([0] + [len(i) for i in ids[:-1]])
+        offsets = [np.zeros(1, dtype=np.int64)]
+        offsets += [i._offsets[1:] + s for i, s in zip(to_concat, sizes)]
+        return cls(np.concatenate(offsets),
+                   np.concatenate(ids) if ids else np.zeros(0, np.int32),
+                   np.concatenate([i._mask for i in to_concat]),
+                   vocabulary)
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def nbytes(self):
+        return self._offsets.nbytes + self._ids.nbytes + self._mask.nbytes
+
+    @property
+    def lengths(self):
+        """ numpy.array of number of genes in each row """
+        return np.diff(self._offsets)
+
+    def __len__(self):
+        return len(self._mask)
+
+    def __getitem__(self, item):
+        if pd.api.types.is_integer(item):
+            if item < 0:
+                item += len(self)
+            if self._mask[item]:
+                return self.dtype.na_value
+            ids = self._ids[self._offsets[item]:self._offsets[item + 1]]
+            return self.sep.join(self.vocabulary.decode(ids))
+        if isinstance(item, tuple) and len(item) == 1:
+            item = item[0]
+        if isinstance(item, slice):
+            return self._take_rows(np.arange(len(self))[item])
+        item = np.asarray(item)
+        if item.dtype == bool:
+            return self._take_rows(np.flatnonzero(item))
+        return self._take_rows(np.arange(len(self))[item.astype(np.int64)])
+
+    def __setitem__(self, key, value):
+        """ Set rows to delimited strings, lists of genes or NA
+
+        A single row (integer key) takes one value, other keys take one
+        value for all selected rows or one value per row.
+        """
+        if isinstance(key, tuple) and len(key) == 1:
+            key = key[0]
+        if pd.api.types.is_integer(key):
+            rows, values = np.array([key], dtype=np.int64), [value]
+        else:
+            key = pd.api.indexers.check_array_indexer(self, key)
+            rows = np.arange(len(self))[key]
+            if isinstance(value, str) or (pd.api.types.is_scalar(value) and
+                                          pd.isna(value)):
+                values = [value] * len(rows)
+            elif isinstance(value, GeneListArray):
+                values = [pd.NA if m else i for i, m in
+                          zip(value.to_lists(), value._mask)]
+            else:
+                values = list(value)
+            if len(values) != len(rows):
+                raise ValueError('Length of values ({}) does not match '
+                                 'number of rows ({})'.format(len(values),
+                                                              len(rows)))
+        rows[rows < 0] += len(self)
+        new = self.from_lists(values, self.sep, self.vocabulary)
+        order = np.arange(len(self))
+        order[rows] = len(self) + np.arange(len(rows))
+        result = self._concat_same_type([self, new])._take_rows(order)
+        self._offsets, self._ids, self._mask = \
+            result._offsets, result._ids, result._mask
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_strings()
+
+    def __eq__(self, other):
+        if isinstance(other, (pd.Series, pd.Index, pd.DataFrame)):
+            return NotImplemented
+        other = np.asarray(other, dtype=object)
+        valid = ~self._mask
+        result = np.zeros(len(self), dtype=bool)
+        result[valid] = self.to_strings()[valid] == \
+            (other if other.ndim == 0 else other[valid])
+        return result
+
+    def __getstate__(self):
+        # store names, vocabularies are not shared across processes
+        uniques, local = np.unique(self._ids, return_inverse=True)
+        return dict(offsets=self._offsets, mask=self._mask,
+                    genes=self.vocabulary.decode(uniques), local=local)
+
+    def __setstate__(self, state):
+        self._offsets = state['offsets']
+        self._mask = state['mask']
+        self.vocabulary = GeneVocabulary()
+        ids = self.vocabulary.encode(state['genes'])
+        self._ids = ids[state['local']].astype(np.int32)
+
+    def _take_rows(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = np.diff(self._offsets)[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(self._offsets[rows] - offsets[:-1], lengths) \
+            + np.arange(offsets[-1])
+        return GeneListArray(offsets, self._ids[positions], self._mask[rows],
+                             self.vocabulary)
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        indices = np.asarray(indices, dtype=np.int64)
+        if not allow_fill:
+            return self._take_rows(np.arange(len(self))[indices])
+        if (indices < -1).any():
+            raise ValueError("Invalid value in 'indices'.")
+        fill = indices == -1
+        if len(self) == 0:
+            if not fill.all():
+                raise IndexError("cannot do a non-empty take from empty "
+                                 "array.")
+            return GeneListArray(np.zeros(len(indices) + 1, dtype=np.int64),
+                                 np.zeros(0, dtype=np.int32), fill,
+                                 self.vocabulary)
+        result = self._take_rows(np.where(fill, 0, indices))
+        if fill.any():
+            lengths = np.where(fill, 0, result.lengths)
+            keep = np.repeat(~fill, result.lengths)
+            offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            result = GeneListArray(offsets, result._ids[keep],
+                                   result._mask | fill, self.vocabulary)
+        return result
+
+    def copy(self):
+        return GeneListArray(self._offsets.copy(), self._ids.copy(),
+                             self._mask.copy(), self.vocabulary)
+
+    def isna(self):
+        return self._mask.copy()
+
+    def astype(self, dtype, copy=True):
+        dtype = pd.api.types.pandas_dtype(dtype)
+        if isinstance(dtype, GeneListDtype):
+            return self.copy() if copy else self
+        if isinstance(dtype, ExtensionDtype):
+            return dtype.construct_array_type()._from_sequence(
+                self.to_strings(), dtype=dtype
+            )
+        return np.array(self.to_strings(), dtype=dtype)
+
+    def _values_for_factorize(self):
+        return self.to_strings(na_value=np.nan), np.nan
+
+    def to_strings(self, sep=None, na_value=None):
+        """ Convert to object array of delimited strings
+
+        Parameters
+        ----------
+        sep : str, optional
+            Delimiter, default ','
+        na_value : optional
+            Value of missing rows, default dtype.na_value
+
+        Returns
+        -------
+        numpy.array
+        """
+        sep = self.sep if sep is None else sep
+        na_value = self.dtype.na_value if na_value is None else na_value
+        names = self.vocabulary.decode(self._ids)
+        out = np.empty(len(self), dtype=object)
+        for n, (s, e) in enumerate(zip(self._offsets[:-1], self._offsets[1:])):
+            out[n] = na_value if self._mask[n] else sep.join(names[s:e])
+        return out
+
+    def to_lists(self):
+        """ Convert to list of lists of gene names """
+        names = self.vocabulary.decode(self._ids)
+        return [list(names[s:e])
+                for s, e in zip(self._offsets[:-1], self._offsets[1:])]
+
+    def to_matrix(self):
+        """ Binary sparse matrix of rows by gene ids
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+            Matrix of shape (len(self), len(self.vocabulary))
+        """
+        matrix = sp.csr_matrix(
+            (np.ones(len(self._ids), dtype=np.int32), self._ids,
+             self._offsets),
+            shape=(len(self), len(self.vocabulary))
+        )
+        matrix.sum_duplicates()
+        matrix.data = np.ones(len(matrix.data), dtype=np.int32)
+        return matrix
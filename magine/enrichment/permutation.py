@@ -0,0 +1,201 @@
+"""
+Empirical enrichment p-values from random gene lists.
+
+For each sample, random gene lists of the same size as the sample's gene
+list are drawn from a background (for example all measured species of an
+experiment). Draws are scored in batches with a single sparse product
+against a background by term matrix, giving the overlap of every random
+list with every term at once. The empirical p-value of a term is the
+fraction of random lists with at least the observed overlap.
+
+Batches are seeded from (seed, sample, batch), so results are identical
+regardless of the number of processes used.
+"""
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+_worker_matrix = None
+
+
+def background_genes(background):
+    """ Sorted array of background genes
+
+    Parameters
+    ----------
+    background : list_like or magine.data.experimental_data.ExperimentalData
+        Genes, or an ExperimentalData, in which case all measured genes are
+        used
+
+    Returns
+    -------
+    numpy.array
+    """
+    if hasattr(background, 'genes') and hasattr(background, 'exp_methods'):
+        background = background.genes.id_list
+    return np.array(sorted(set(background)), dtype=object)
+
+
+def term_matrix(term_genes, background):
+    """ Binary sparse matrix of background genes by terms
+
+    Parameters
+    ----------
+    term_genes : list
+        Gene sets of each term
+    background : numpy.array
+        Background genes, see background_genes. Genes of terms outside of
+        the background are dropped.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Matrix of shape (len(background), len(term_genes))
+    """
+    lookup = pd.Index(background)
+    rows, cols = [], []
+    for n, genes in enumerate(term_genes):
+        ids = lookup.get_indexer(list(set(genes)))
+        ids = ids[ids != -1]
+        rows.append(ids)
+        cols.append(np.full(len(ids), n, dtype=np.int64))
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+    return sp.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+        shape=(len(background), len(term_genes))
+    )
+
+
+def random_lists(n_lists, list_size, n_background, random_state):
+    """ Binary sparse matrix of random gene lists drawn without replacement
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Matrix of shape (n_lists, n_background) with list_size ones per row
+    """
+    # partial Fisher-Yates shuffle of all rows at once
+    draws = np.tile(np.arange(n_background, dtype=np.int32), (n_lists, 1))
+    rows = np.arange(n_lists)
+    for i in range(min(list_size, n_background - 1)):
+        j = random_state.randint(i, n_background, size=n_lists)
+        swap = draws[rows, j]
+        draws[rows, j] = draws[:, i]
+        draws[:, i] = swap
+    draws = draws[:, :list_size]
+    return sp.csr_matrix(
+        (np.ones(draws.size, dtype=np.int32), draws.ravel(),
+         np.arange(0, draws.size + 1, list_size)),
+        shape=(n_lists, n_background)
+    )
+
+
+def _init_worker(matrix):
+    global _worker_matrix
+    _worker_matrix = matrix
+
+
+def _count_batch(args):
+    """ Number of random lists with overlap >= observed, for each term """
+    matrix = _worker_matrix
+    seed, sample, batch, n_lists, list_size, observed = args
+    random_state = np.random.RandomState([seed, sample, batch])
+    lists = random_lists(n_lists, list_size, matrix.shape[0], random_state)
+    overlap = (lists * matrix).toarray()
+    return sample, (overlap >= observed).sum(axis=0)
+
+
+def permutation_p_values(gene_lists, term_genes, background,
+                         n_permutations=1000, seed=0, batch_size=200,
+                         processes=1):
+    """ Empirical p-values of terms for one or more gene lists
+
+    Parameters
+    ----------
+    gene_lists : list
+        List of gene lists (one per sample). Genes outside of the background
+        are ignored.
+    term_genes : list
+        Gene sets of each term
+    background : list_like or ExperimentalData
+        Genes random lists are drawn from, see background_genes
+    n_permutations : int
+        Number of random gene lists per sample
+    seed : int
+    batch_size : int
+        Number of random lists scored at once
+    processes : int
+        Number of worker processes, 1 runs in the current process
+
+    Returns
+    -------
+    numpy.array
+        Array of shape (len(gene_lists), len(term_genes)).
+        p = (1 + n_exceeding) / (1 + n_permutations)
+    """
+    background = background_genes(background)
+    matrix = term_matrix(term_genes, background)
+    queries = term_matrix(gene_lists, background).T.tocsr()
+    observed = (queries * matrix).toarray()
+    sizes = np.diff(queries.indptr)
+
+    tasks = []
+    for sample in range(len(gene_lists)):
+        if sizes[sample] == 0:
+            continue
+        for batch, start in enumerate(range(0, n_permutations, batch_size)):
+            tasks.append((seed, sample, batch,
+                          min(batch_size, n_permutations - start),
+                          sizes[sample], observed[sample]))
+
+    counts = np.zeros(observed.shape, dtype=np.int64)
+    if processes == 1:
+        _init_worker(matrix)
+        results = map(_count_batch, tasks)
+    else:
+        pool = mp.Pool(processes, initializer=_init_worker,
+                       initargs=(matrix,))
+        results = pool.imap_unordered(_count_batch, tasks)
+    try:
+        for sample, count in results:
+            counts[sample] += count
+    finally:
+        if processes != 1:
+            pool.close()
+            pool.join()
+        _init_worker(None)
+    # terms without observed genes are not enriched
+    p_values = (1. + counts) / (1. + n_permutations)
+    p_values[observed == 0] = 1.
+    return p_values
+
+
+def library_term_genes(databases, url=None):
+    """ Gene sets of Enrichr libraries keyed by (db, cleaned term_name)
+
+    Term names are cleaned the same way as Enrichr results, so the keys
+    match the 'db' and 'term_name' columns of an EnrichmentResult.
+
+    Parameters
+    ----------
+    databases : list
+    url : str, optional
+        Base url of the Enrichr API
+
+    Returns
+    -------
+    dict
+    """
+    from magine.enrichment.enrichr import _get_library, _enrichr_url, \
+        clean_term_names_by_db
+    term_genes = dict()
+    for db in databases:
+        terms = _get_library(db, _enrichr_url if url is None else url)
+        library = pd.DataFrame({'term_name': list(terms.keys()), 'db': db})
+        names = clean_term_names_by_db(library)
+        for term, genes in zip(names, terms.values()):
+            term_genes[(db, term)] = list(genes)
+    return term_genes
@@ -0,0 +1,146 @@
+"""
+Streaming export of enrichment results pivoted by sample_id.
+
+The pivot (one row per term_name and db, one column per value and sample)
+is built and written a chunk of terms at a time, so exporting only needs
+memory for one chunk on top of the (long format) results. Excel files are
+written with openpyxl's write-only mode, Parquet files one row group per
+chunk.
+"""
+import numpy as np
+import pandas as pd
+
+pivot_values = ['rank', 'p_value', 'z_score', 'combined_score', 'adj_p_value',
+                'genes']
+
+
+def pivot_chunks(data, index=('term_name', 'db'), columns='sample_id',
+                 values=None, chunk_size=5000):
+    """ Pivot data in chunks of index groups
+
+    Equivalent to pivot_table(index=index, columns=columns, values=values,
+    aggfunc='first'), split into consecutive chunks of rows.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+    index : list_like
+    columns : str
+    values : list, optional
+        Default pivot_values that are in data
+    chunk_size : int
+        Number of index groups (output rows) per chunk
+
+    Yields
+    ------
+    pandas.DataFrame
+        Chunk of the pivot, with (value, column) MultiIndex columns
+    """
+    index = list(index)
+    if values is None:
+        values = [i for i in pivot_values if i in data.columns]
+    samples = sorted(data[columns].unique())
+    out_columns = pd.MultiIndex.from_product([values, samples],
+                                             names=[None, columns])
+    codes = data.groupby(index, sort=True).ngroup().values
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order],
+                             np.arange(0, codes.max() + 1 if len(codes) else 0,
+                                       chunk_size))
+    bounds = np.append(bounds, len(order))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        chunk = data.iloc[order[start:end]]
+        chunk = chunk.groupby(index + [columns], sort=True)[values].first()
+        yield chunk.unstack(columns).reindex(columns=out_columns)
+
+
+def write_pivot_excel(data, file_name, index=('term_name', 'db'),
+                      columns='sample_id', values=None, chunk_size=5000):
+    """ Write the pivot of data to an Excel file in constant memory
+
+    Uses the same layout as DataFrame.to_excel of the pivot table: a header
+    row of value names, a header row of column values and a row of index
+    names, followed by one row per index group.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+    file_name : str
+    index : list_like
+    columns : str
+    values : list, optional
+        Default pivot_values that are in data
+    chunk_size : int
+        Number of rows pivoted at a time
+    """
+    from openpyxl import Workbook
+    index = list(index)
+    if values is None:
+        values = [i for i in pivot_values if i in data.columns]
+    samples = sorted(data[columns].unique())
+    padding = [None] * (len(index) - 1)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    value_row = padding + [None]
+    for v in values:
+        value_row += [v] + [None] * (len(samples) - 1)
+    ws.append(value_row)
+    ws.append(padding + [columns] + list(samples) * len(values))
+    ws.append(index)
+    for chunk in pivot_chunks(data, index, columns, values, chunk_size):
+        keys = chunk.index.tolist()
+        rows = chunk.astype(object).where(chunk.notnull(), None).values
+        for key, row in zip(keys, rows):
+            ws.append([_cell(i) for i in key] + [_cell(i) for i in row])
+    wb.save(file_name)
+
+
+def _cell(value):
+    # openpyxl only writes python and basic numpy scalars
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def write_pivot_parquet(data, file_name, index=('term_name', 'db'),
+                        columns='sample_id', values=None, chunk_size=5000):
+    """ Write the pivot of data to a Parquet file, one row group per chunk
+
+    Columns are flattened to '{value}_{column value}', index levels are
+    written as columns.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+    file_name : str
+    index : list_like
+    columns : str
+    values : list, optional
+        Default pivot_values that are in data
+    chunk_size : int
+        Number of rows pivoted at a time
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    index = list(index)
+    if values is None:
+        values = [i for i in pivot_values if i in data.columns]
+    samples = sorted(data[columns].unique())
+    # schema from data, so all missing columns of a chunk keep their types
+    types = pa.Schema.from_pandas(data[index + values], preserve_index=False)
+    fields = [types.field(i) for i in index]
+    for v in values:
+        fields += [pa.field('{}_{}'.format(v, s), types.field(v).type)
+                   for s in samples]
+    schema = pa.schema(fields)
+
+    writer = pq.ParquetWriter(file_name, schema)
+    try:
+        for chunk in pivot_chunks(data, index, columns, values, chunk_size):
+            chunk.columns = ['{}_{}'.format(v, s) for v, s in chunk.columns]
+            chunk = chunk.reset_index()
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema,
+                                                    preserve_index=False))
+    finally:
+        writer.close()
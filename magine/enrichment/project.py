@@ -0,0 +1,284 @@
+"""
+Resumable enrichment analysis of all categories and samples of a project.
+
+Each (category, sample_id) pair is a task. Tasks run concurrently, each
+result is written atomically as a partition of a Parquet dataset and
+recorded in a manifest, so an interrupted run picks up where it stopped.
+The dataset is read back with
+magine.enrichment.enrichment_result.load_enrichment_dataset.
+"""
+import hashlib
+import json
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import pandas as pd
+
+from magine.enrichment.enrichment_result import load_enrichment_dataset, \
+    manifest_name, partition_path
+from magine.enrichment.enrichr import Enrichr, standard_dbs
+
+_columns = ['term_name', 'rank', 'combined_score', 'adj_p_value', 'genes',
+            'n_genes', 'sample_id', 'category', 'db']
+
+
+def _replace(src, dst):
+    # os.replace is atomic and overwrites on all platforms (python 3.3+)
+    getattr(os, 'replace', os.rename)(src, dst)
+
+
+def _gene_hash(genes):
+    joined = '\n'.join(sorted(str(g) for g in genes))
+    return hashlib.md5(joined.encode('utf-8')).hexdigest()
+
+
+def project_tasks(exp_data):
+    """ Gene lists to run for each category and sample_id of a project
+
+    Parameters
+    ----------
+    exp_data : magine.data.experimental_data.ExperimentalData
+
+    Returns
+    -------
+    list
+        List of dicts with 'category', 'sample_id' and 'genes'
+    """
+    tasks = []
+
+    def _add(samples, sample_ids, category):
+        for genes, s_id in zip(samples, sample_ids):
+            tasks.append(dict(category=category, sample_id=s_id,
+                              genes=sorted(genes)))
+
+    pt = exp_data.proteins.sample_ids
+    rt = exp_data.rna.sample_ids
+
+    if len(pt) != 0:
+        _add(exp_data.proteins.sig.by_sample, pt, 'proteomics_both')
+        _add(exp_data.proteins.sig.up_by_sample, pt, 'proteomics_up')
+        _add(exp_data.proteins.sig.down_by_sample, pt, 'proteomics_down')
+
+    if len(rt) != 0:
+        _add(exp_data.rna.by_sample, rt, 'rna_both')
+        _add(exp_data.rna.sig.down_by_sample, rt, 'rna_down')
+        _add(exp_data.rna.up.up_by_sample, rt, 'rna_up')
+    return tasks
+
+
+class ProjectEnrichment(object):
+    """ Resumable, parallel Enrichr runner over (category, sample_id) tasks
+
+    Parameters
+    ----------
+    tasks : list
+        List of dicts with 'category', 'sample_id' and 'genes',
+        see project_tasks
+    project_name : str
+    out_dir : str
+        The dataset is written to out_dir/project_name
+    databases : list, optional
+        Enrichr libraries, default standard_dbs
+    max_workers : int
+        Number of tasks to run at once
+    enrichr : Enrichr, optional
+    """
+
+    def __init__(self, tasks, project_name, out_dir='enrichment_output',
+                 databases=None, max_workers=4, enrichr=None):
+        self.tasks = tasks
+        self.path = os.path.join(out_dir, project_name)
+        self.databases = standard_dbs if databases is None else databases
+        self.max_workers = max_workers
+        self.enrichr = Enrichr(verbose=False) if enrichr is None else enrichr
+        self.manifest_path = os.path.join(self.path, manifest_name)
+        self.manifest = self._load_manifest()
+
+    @staticmethod
+    def _key(task):
+        return '{}|{}'.format(task['category'], task['sample_id'])
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return dict()
+        with open(self.manifest_path, 'r') as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        tmp = '{}.tmp'.format(self.manifest_path)
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        _replace(tmp, self.manifest_path)
+
+    def is_done(self, task):
+        """ True if task has a checkpoint for the same gene list """
+        entry = self.manifest.get(self._key(task))
+        if entry is None or entry['status'] != 'done':
+            return False
+        if entry['gene_hash'] != _gene_hash(task['genes']):
+            return False
+        return entry['n_rows'] == 0 or \
+            os.path.exists(os.path.join(self.path, entry['file']))
+
+    @property
+    def pending(self):
+        """ Tasks without a valid checkpoint """
+        return [t for t in self.tasks if not self.is_done(t)]
+
+    def _run_task(self, task):
+        try:
+            if len(task['genes']) == 0:
+                df = pd.DataFrame(columns=_columns)
+            else:
+                df = self.enrichr.run(list(task['genes']), self.databases)
+            return task, self._write_partition(task, df), None
+        except Exception as e:
+            return task, None, '{}: {}'.format(type(e).__name__, e)
+
+    def _partition_file(self, category, sample_id):
+        return os.path.join(partition_path(self.path, category, sample_id),
+                            'part-0.parquet')
+
+    def _remove_partition(self, category, sample_id):
+        """ Delete the results of a previous run of a task """
+        file_name = self._partition_file(category, sample_id)
+        if os.path.exists(file_name):
+            os.remove(file_name)
+
+    def _write_partition(self, task, df):
+        """ Write task results atomically, returns the manifest entry
+
+        A task without results removes the file of a previous run.
+        """
+        entry = dict(category=task['category'],
+                     sample_id=str(task['sample_id']),
+                     gene_hash=_gene_hash(task['genes']),
+                     status='done', n_rows=0, file=None)
+        if len(df) != 0:
+            df = pd.DataFrame(df)
+            df['sample_id'] = task['sample_id']
+            df['category'] = task['category']
+            df = df[~df['term_name'].isnull()]
+        if len(df) == 0:
+            self._remove_partition(task['category'], task['sample_id'])
+            return entry
+        df = df[[c for c in _columns if c in df.columns]]
+        df['genes'] = np.asarray(df['genes'], dtype=object)
+
+        file_name = self._partition_file(task['category'], task['sample_id'])
+        out_dir = os.path.dirname(file_name)
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        tmp = '{}.{}.tmp'.format(file_name, os.getpid())
+        df.to_parquet(tmp, index=False)
+        _replace(tmp, file_name)
+        entry['n_rows'] = len(df)
+        entry['file'] = os.path.relpath(file_name, self.path)
+        return entry
+
+    def _remove_stale(self):
+        """ Delete results and manifest entries of tasks not in self.tasks
+        """
+        keys = set(self._key(t) for t in self.tasks)
+        stale = [k for k in self.manifest if k not in keys]
+        for key in stale:
+            entry = self.manifest.pop(key)
+            self._remove_partition(entry['category'], entry['sample_id'])
+        if stale:
+            self._save_manifest()
+
+    def run(self):
+        """ Run all pending tasks
+
+        Completed tasks are recorded in the manifest as soon as they finish.
+        Failed tasks are reported and retried on the next call. Results of
+        tasks that are no longer in self.tasks are deleted.
+
+        Returns
+        -------
+        list
+            Keys of failed tasks
+        """
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self._remove_stale()
+        pending = self.pending
+        print("Running {} of {} tasks ({} databases)".format(
+            len(pending), len(self.tasks), len(self.databases)))
+        failed = []
+        if not pending:
+            return failed
+        st = time.time()
+        pool = ThreadPool(max(1, min(self.max_workers, len(pending))))
+        try:
+            for n, (task, entry, error) in enumerate(
+                    pool.imap_unordered(self._run_task, pending)):
+                key = self._key(task)
+                if error is None:
+                    self.manifest[key] = entry
+                    print('\t{}/{} {}'.format(n + 1, len(pending), key))
+                else:
+                    self.manifest[key] = dict(
+                        category=task['category'],
+                        sample_id=str(task['sample_id']),
+                        gene_hash=_gene_hash(task['genes']),
+                        status='failed', error=error, n_rows=0, file=None
+                    )
+                    failed.append(key)
+                    print('\t{}/{} {} failed ({})'.format(
+                        n + 1, len(pending), key, error))
+                self._save_manifest()
+        finally:
+            pool.close()
+            pool.join()
+        print("Finished in {:.1f} seconds".format(time.time() - st))
+        return failed
+
+    def load(self, category=None, sample_id=None, columns=None):
+        """ Load results, see load_enrichment_dataset """
+        return load_enrichment_dataset(self.path, category=category,
+                                       sample_id=sample_id, columns=columns)
+
+
+def run_enrichment_for_project(exp_data, project_name,
+                               out_dir='enrichment_output', max_workers=4,
+                               databases=None):
+    """ Run Enrichr for each category and sample_id of a project
+
+    Results are written as a Parquet dataset to out_dir/project_name,
+    partitioned by category and sample_id. Rerunning after a crash or
+    interruption only runs tasks that are not finished. Once all tasks are
+    done, the combined results are also saved to {project_name}.csv.gz.
+
+    Parameters
+    ----------
+    exp_data : magine.data.experimental_data.ExperimentalData
+    project_name : str
+    out_dir : str
+    max_workers : int
+        Number of (category, sample_id) tasks to run at once
+    databases : list, optional
+        Enrichr libraries, default magine.enrichment.enrichr.standard_dbs
+
+    Returns
+    -------
+    str
+        Path of the dataset, load with
+        magine.enrichment.enrichment_result.load_enrichment_dataset
+    """
+    runner = ProjectEnrichment(project_tasks(exp_data), project_name,
+                               out_dir=out_dir, databases=databases,
+                               max_workers=max_workers)
+    failed = runner.run()
+    if failed:
+        print("{} tasks failed, rerun to retry: {}".format(len(failed),
+                                                           failed))
+    else:
+        final_df = runner.load()
+        final_df = final_df[[c for c in _columns if c in final_df.columns]]
+        final_df.to_csv('{}.csv.gz'.format(project_name), encoding='utf-8',
+                        compression='gzip')
+        print("Done with enrichment")
+    return runner.path
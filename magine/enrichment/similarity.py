@@ -0,0 +1,350 @@
+"""
+Approximate gene set similarity using MinHash signatures and LSH banding.
+
+Gene sets are stored as binary sparse matrices (rows are terms, columns are
+genes). MinHash signatures are used to find candidate pairs of rows through
+locality sensitive hashing. All candidates are verified with the exact
+Jaccard index, so the approximation only affects which pairs are found
+(recall), never the reported scores.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from magine.enrichment.gene_lists import GeneListArray
+
+_prime = np.int64((1 << 31) - 1)
+_empty = np.uint64(_prime)
+
+
+def genes_to_matrix(gene_strings, sep=','):
+    """ Convert delimited gene strings into a binary sparse matrix
+
+    Parameters
+    ----------
+    gene_strings : list_like, GeneListArray
+        Strings of genes, such as the 'genes' column of an EnrichmentResult.
+        A GeneListArray is converted without splitting strings.
+    sep : str
+        Delimiter between genes
+
+    Returns
+    -------
+    matrix : scipy.sparse.csr_matrix
+        Binary matrix of shape (n_strings, n_genes)
+    vocabulary : numpy.array
+        Gene names of each column in matrix
+    """
+    if isinstance(gene_strings, GeneListArray):
+        return gene_strings.to_matrix(), gene_strings.vocabulary.names
+    split = [g.split(sep) if isinstance(g, str) else [] for g in gene_strings]
+    lengths = np.fromiter((len(i) for i in split), dtype=np.int64,
+                          count=len(split))
+    flat = np.array(list(itertools.chain.from_iterable(split)), dtype=object)
+    codes, vocabulary = pd.factorize(flat)
+    indptr = np.zeros(len(split) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    matrix = sp.csr_matrix(
+        (np.ones(len(codes), dtype=np.int32), codes.astype(np.int32), indptr),
+        shape=(len(split), len(vocabulary))
+    )
+    return binarize(matrix), np.asarray(vocabulary)
+
+
+def binarize(matrix):
+    """ Sort indices, remove duplicate entries and set all values to 1 """
+    matrix = sp.csr_matrix(matrix)
+    matrix.sum_duplicates()
+    matrix.eliminate_zeros()
+    matrix.data = np.ones(len(matrix.data), dtype=np.int32)
+    return matrix
+
+
+def minhash_signatures(matrix, num_perm=128, seed=0):
+    """ Calculate MinHash signatures of each row of a binary matrix
+
+    Uses universal hashing of column ids, (a * x + b) mod p, with p the
+    Mersenne prime 2**31 - 1.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+    num_perm : int
+        Number of hash permutations
+    seed : int
+        Seed for the random hash functions
+
+    Returns
+    -------
+    numpy.array
+        Signatures of shape (n_rows, num_perm). Empty rows are filled with
+        a value larger than any hash.
+    """
+    matrix = sp.csr_matrix(matrix)
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, _prime, size=num_perm).astype(np.int64)
+    b = rng.randint(0, _prime, size=num_perm).astype(np.int64)
+    columns = np.arange(matrix.shape[1], dtype=np.int64)
+
+    n_rows = matrix.shape[0]
+    signatures = np.full((n_rows, num_perm), _empty, dtype=np.uint64)
+    non_empty = np.diff(matrix.indptr) > 0
+    if not non_empty.any():
+        return signatures
+    starts = matrix.indptr[:-1][non_empty]
+    indices = matrix.indices
+
+    # limit the temporary (chunk x nnz) array to ~16M entries
+    chunk = max(1, int(2 ** 24 // max(len(indices), 1)))
+    for first in range(0, num_perm, chunk):
+        last = min(first + chunk, num_perm)
+        hashed = (np.outer(a[first:last], columns) + b[first:last, None]) \
+            % _prime
+        values = hashed[:, indices]
+        signatures[non_empty, first:last] = np.minimum.reduceat(
+            values, starts, axis=1
+        ).T
+    return signatures
+
+
+def optimal_bands(threshold, num_perm=128, recall_weight=0.5):
+    """ Choose the number of LSH bands for a Jaccard threshold
+
+    The number of bands (b) and rows per band (r) determine the probability
+    a pair with similarity s becomes a candidate, 1 - (1 - s**r)**b. The
+    pair (b, r) that minimizes the weighted area of false positives (below
+    threshold) and false negatives (above threshold) is returned.
+
+    Parameters
+    ----------
+    threshold : float
+    num_perm : int
+    recall_weight : float
+        Weight of false negatives, between 0 and 1. Higher values favor
+        recall at the cost of more candidates to verify.
+
+    Returns
+    -------
+    n_bands : int
+    """
+    assert 0 <= recall_weight <= 1, 'recall_weight must be between 0 and 1'
+    s = np.linspace(0, 1, 1001)
+    below = s <= threshold
+    best, best_error = 1, np.inf
+    for n_bands in range(1, num_perm + 1):
+        rows = num_perm // n_bands
+        prob = 1 - (1 - s ** rows) ** n_bands
+        false_pos = _area(prob[below], s[below])
+        false_neg = _area(1 - prob[~below], s[~below])
+        error = (1 - recall_weight) * false_pos + recall_weight * false_neg
+        if error < best_error:
+            best, best_error = n_bands, error
+    return best
+
+
+def _area(y, x):
+    """ Trapezoidal integration """
+    if len(x) < 2:
+        return 0.
+    return float(np.sum((y[1:] + y[:-1]) * np.diff(x)) / 2)
+
+
+def band_hashes(signatures, n_bands):
+    """ Hash each band of the signatures into a single integer
+
+    Parameters
+    ----------
+    signatures : numpy.array
+    n_bands : int
+
+    Returns
+    -------
+    numpy.array
+        Array of shape (n_rows, n_bands)
+    """
+    n_rows, num_perm = signatures.shape
+    rows = num_perm // n_bands
+    assert rows > 0, 'n_bands must be less than or equal to num_perm'
+    hashes = np.zeros((n_rows, n_bands), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for i in range(rows):
+            hashes = hashes * np.uint64(1000003) ^ \
+                     signatures[:, i:n_bands * rows:rows]
+    return hashes
+
+
+def lsh_candidate_pairs(signatures, n_bands):
+    """ Find all pairs of rows that share a bucket in at least one band
+
+    Parameters
+    ----------
+    signatures : numpy.array
+    n_bands : int
+
+    Returns
+    -------
+    rows, cols : numpy.array
+        Candidate pairs with rows < cols. Empty rows are never candidates.
+    """
+    n_rows = signatures.shape[0]
+    # empty rows share one signature, banding them would pair all of them
+    members = np.flatnonzero((signatures != _empty).any(axis=1))
+    hashes = band_hashes(signatures[members], n_bands)
+    keys = []
+    for band in range(n_bands):
+        order = np.argsort(hashes[:, band], kind='stable')
+        bucket = hashes[order, band]
+        order = members[order]
+        # pair every member of a bucket with the following members
+        for offset in range(1, len(members)):
+            same = bucket[offset:] == bucket[:-offset]
+            if not same.any():
+                break
+            first = order[:-offset][same]
+            second = order[offset:][same]
+            keys.append(np.minimum(first, second).astype(np.int64) * n_rows
+                        + np.maximum(first, second))
+    if not keys:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    keys = np.unique(np.concatenate(keys))
+    return keys // n_rows, keys % n_rows
+
+
+def jaccard_pairs(matrix, rows, cols, chunk_size=1000000):
+    """ Exact Jaccard index between pairs of rows of a binary matrix
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+    rows, cols : numpy.array
+        Row indices of each pair
+    chunk_size : int
+        Number of pairs to process at once
+
+    Returns
+    -------
+    numpy.array
+    """
+    matrix = sp.csr_matrix(matrix)
+    sizes = np.diff(matrix.indptr)
+    scores = np.zeros(len(rows), dtype=float)
+    for start in range(0, len(rows), chunk_size):
+        r = rows[start:start + chunk_size]
+        c = cols[start:start + chunk_size]
+        inter = np.asarray(
+            matrix[r].multiply(matrix[c]).sum(axis=1)
+        ).ravel()
+        union = sizes[r] + sizes[c] - inter
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scores[start:start + chunk_size] = np.where(
+                union > 0, inter / union, 0.
+            )
+    return scores
+
+
+def condensed_jaccard(matrix, dtype=np.float64, chunk_size=1 << 20):
+    """ Exact Jaccard index between all pairs of rows of a binary matrix
+
+    Scores are computed from the sparse product a block of rows at a time,
+    so memory is the condensed result plus one block.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+    dtype : numpy.dtype
+        Type of returned scores, np.float32 halves memory
+    chunk_size : int
+        Number of pairs compared at a time
+
+    Returns
+    -------
+    numpy.array
+        Condensed scores, ordered as scipy.spatial.distance.pdist
+    """
+    matrix = sp.csr_matrix(matrix)
+    n = matrix.shape[0]
+    sizes = np.diff(matrix.indptr).astype(np.float64)
+    scores = np.zeros(n * (n - 1) // 2, dtype=dtype)
+    transposed = matrix.T.tocsc()
+    block = max(1, chunk_size // max(n, 1))
+    position = 0
+    for start in range(0, n, block):
+        end = min(n, start + block)
+        shared = matrix[start:end].dot(transposed).toarray()
+        union = sizes[start:end, None] + sizes[None, :] - shared
+        with np.errstate(invalid='ignore', divide='ignore'):
+            block_scores = np.divide(shared, union, dtype=np.float64)
+        block_scores[union == 0] = 0
+        # pairs (i, j) with j > i, in row major (pdist) order
+        upper = np.arange(n)[None, :] > np.arange(start, end)[:, None]
+        block_scores = block_scores[upper]
+        scores[position:position + len(block_scores)] = block_scores
+        position += len(block_scores)
+    return scores
+
+
+def similar_pairs(matrix, threshold, num_perm=128, recall_weight=0.5,
+                  seed=0, n_bands=None):
+    """ Approximate all pairs of rows with a Jaccard index above threshold
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        Binary matrix, rows are gene sets
+    threshold : float
+        Jaccard index that pairs must exceed
+    num_perm : int
+        Number of MinHash permutations. More permutations increase precision
+        and recall at the cost of run time.
+    recall_weight : float
+        Passed to optimal_bands to pick the number of bands
+    seed : int
+        Seed of the MinHash functions, makes results reproducible
+    n_bands : int, optional
+        Number of bands, overrides recall_weight
+
+    Returns
+    -------
+    rows, cols, scores : numpy.array
+        Pairs (rows < cols) and their exact Jaccard index
+    """
+    if n_bands is None:
+        n_bands = optimal_bands(threshold, num_perm, recall_weight)
+    signatures = minhash_signatures(matrix, num_perm=num_perm, seed=seed)
+    rows, cols = lsh_candidate_pairs(signatures, n_bands)
+    scores = jaccard_pairs(matrix, rows, cols)
+    keep = scores > threshold
+    return rows[keep], cols[keep], scores[keep]
+
+
+def query_candidates(matrix, query, threshold, num_perm=128,
+                     recall_weight=0.5, seed=0, n_bands=None):
+    """ Approximate rows of matrix similar to the query row
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+    query : int
+        Row index of the query gene set
+    threshold : float
+        Only used to select the number of bands
+    num_perm : int
+    recall_weight : float
+    seed : int
+    n_bands : int, optional
+
+    Returns
+    -------
+    rows, scores : numpy.array
+        Candidate rows (excluding query) and their exact Jaccard index
+    """
+    if n_bands is None:
+        n_bands = optimal_bands(threshold, num_perm, recall_weight)
+    signatures = minhash_signatures(matrix, num_perm=num_perm, seed=seed)
+    hashes = band_hashes(signatures, n_bands)
+    rows = np.flatnonzero((hashes == hashes[query]).any(axis=1))
+    rows = rows[(rows != query) & (signatures[rows] != _empty).any(axis=1)]
+    scores = jaccard_pairs(matrix, np.full(len(rows), query), rows)
+    return rows, scores
@@ -1,10 +1,14 @@
 import os
 
+import numpy as np
 import pandas as pd
 from bioservices import UniChem
-from sortedcontainers import SortedSet, SortedDict
+from sortedcontainers import SortedSet
 
 from magine.data.storage import id_mapping_dir
+from magine.mappings.frozen_dict import FrozenSetDict, cached_set_dict, \
+    match_input
+from magine.mappings.synonym_index import SynonymIndex
 
 try:
     import cPickle as pickle
@@ -17,6 +21,81 @@ except:
     basestring = str
 
 
+hmdb_file = os.path.join(id_mapping_dir, 'hmdb_dataframe.csv.gz')
+hmdb_cache = os.path.join(id_mapping_dir, 'hmdb_dataframe.parquet')
+_cache_version = 1
+
+
+def _explode_secondary_accessions(data):
+    """ Add a row per secondary accession
+
+    The accession of added rows is the secondary accession, main_accession
+    is the accession of the entry.
+    """
+    data = data.copy()
+    data['main_accession'] = data['accession']
+    sub_db = data[data['secondary_accessions'].notnull()]
+    split = sub_db['secondary_accessions'].astype(str).str.split('|')
+    new_df = sub_db.loc[sub_db.index.repeat(split.str.len())].copy()
+    new_df['secondary_accessions'] = [j for i in split for j in i]
+    new_df['accession'] = new_df['secondary_accessions']
+    return pd.concat([data, new_df], ignore_index=True)
+
+
+def _source_key(file_name):
+    stat = os.stat(file_name)
+    return '{} {} {}'.format(_cache_version, stat.st_size, stat.st_mtime)
+
+
+def _hmdb_cache(source, cache):
+    """ Columnar (parquet) copy of source with exploded secondary accessions
+
+    The cache is (re)written if it is missing or source has changed.
+
+    Returns
+    -------
+    str
+        cache, None if pyarrow is not installed
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None
+    key = _source_key(source)
+    if os.path.exists(cache):
+        metadata = pq.read_schema(cache).metadata or dict()
+        if metadata.get(b'magine_source', b'').decode('utf-8') == key:
+            return cache
+    print("Creating HMDB cache {}".format(cache))
+    data = pd.read_csv(source, low_memory=False, encoding='utf-8')
+    table = pa.Table.from_pandas(_explode_secondary_accessions(data),
+                                 preserve_index=False)
+    table = table.replace_schema_metadata(dict(
+        table.schema.metadata or dict(), magine_source=key))
+    tmp = '{}.tmp'.format(cache)
+    pq.write_table(table, tmp)
+    getattr(os, 'replace', os.rename)(tmp, cache)
+    return cache
+
+
+def _hmdb_columns(cache):
+    if cache is None:
+        columns = pd.read_csv(hmdb_file, nrows=0).columns
+        return list(columns) + ['main_accession']
+    import pyarrow.parquet as pq
+    return pq.read_schema(cache).names
+
+
+def _read_hmdb_csv(source, columns):
+    """ Columns of HMDB, from the csv (when pyarrow is not installed) """
+    needed = set(columns).union({'accession', 'secondary_accessions'})
+    needed.discard('main_accession')
+    data = pd.read_csv(source, low_memory=False, encoding='utf-8',
+                       usecols=sorted(needed))
+    return _explode_secondary_accessions(data)[list(columns)]
+
+
 class ChemicalMapper(object):
     """ Convert chemical species across various ids.
 
@@ -42,7 +121,7 @@ class ChemicalMapper(object):
 
         """
 
-        self.database = None
+        self._columns = dict()
         self._hmdb_to_chem_name = None
         self._chem_name_to_hmdb = None
         self._hmdb_to_kegg = None
@@ -52,18 +131,35 @@ class ChemicalMapper(object):
         self._hmdb_to_protein = None
         self._hmdb_main_to_protein = None
         self._hmdb_accession_to_main = None
-        _file = os.path.join(id_mapping_dir, 'hmdb_dataframe.csv.gz')
-        if not os.path.exists(_file) or fresh_download:
+        self._mappings = dict()
+        self._synonym_index = None
+        if not os.path.exists(hmdb_file) or fresh_download:
             from magine.mappings.databases.download_libraries import HMDB
             HMDB()
-        hmdb_database = pd.read_csv(_file, low_memory=False, encoding='utf-8')
-        self.database = hmdb_database.where((pd.notnull(hmdb_database)), None)
-        self.database['main_accession'] = self.database['accession']
-        sub_db = self.database[
-            self.database['secondary_accessions'].str.contains('|', na=False)]
-        new_df = tidy_split(sub_db, 'secondary_accessions', '|')
-        new_df['accession'] = new_df['secondary_accessions']
-        self.database = pd.concat([self.database, new_df])
+        self._cache = _hmdb_cache(hmdb_file, hmdb_cache)
+
+    @property
+    def database(self):
+        """ pandas.DataFrame of HMDB, with a row per secondary accession
+
+        Loads all columns, mappings only load the columns they use.
+        """
+        return self._load(_hmdb_columns(self._cache))
+
+    def _load(self, columns):
+        """ DataFrame of columns of HMDB, each column is loaded once """
+        missing = [i for i in columns if i not in self._columns]
+        if missing:
+            if self._cache is not None:
+                import pyarrow.parquet as pq
+                table = pq.read_table(self._cache, columns=missing)
+                loaded = table.to_pandas()
+            else:
+                loaded = _read_hmdb_csv(hmdb_file, missing)
+            for i in missing:
+                self._columns[i] = loaded[i]
+        return pd.DataFrame({i: self._columns[i] for i in columns},
+                            columns=list(columns))
 
     @property
     def kegg_to_hmdb(self):
@@ -115,14 +211,16 @@ class ChemicalMapper(object):
     @property
     def hmdb_accession_to_main(self):
         if self._hmdb_accession_to_main is None:
-            self._hmdb_accession_to_main = self._from_list_dict(
-                "accession", "main_accession"
-            )
+            self._hmdb_accession_to_main = self._to_dict("accession",
+                                                         "main_accession")
         return self._hmdb_accession_to_main
 
     def _to_dict(self, key, value):
         """ creates a dictionary with a list of values for each key
 
+        Cached in magine.mappings.frozen_dict.cache_dir, so the HMDB columns
+        are only read once per version of the HMDB table.
+
         Parameters
         ----------
         key : str
@@ -130,29 +228,69 @@ class ChemicalMapper(object):
 
         Returns
         -------
-        dict
+        magine.mappings.frozen_dict.FrozenSetDict
 
         """
-        d = self.database[[key, value]].copy()
-        d.dropna(how='any', inplace=True)
-        return_dict = SortedDict()
-        for i, j in d.values:
-            i = i.strip()
-            if i not in return_dict:
-                return_dict[i] = set()
-            return_dict[i].add(j)
-        return return_dict
+        name = 'hmdb_{}_to_{}'.format(key, value)
+        if name not in self._mappings:
+            self._mappings[name] = cached_set_dict(
+                name, [hmdb_file],
+                lambda: FrozenSetDict.from_frame(self._load([key, value]),
+                                                 key, value, strip_keys=True)
+            )
+        return self._mappings[name]
 
     def _from_list_dict(self, key, value):
-        d = self.database[[key, value]].copy()
-        d.dropna(how='any', inplace=True)
-        return_dict = SortedDict()
-        for i, j in d.values:
-            if i in return_dict:
-                return_dict[i].update(j.split('|'))
-            else:
-                return_dict[i] = SortedSet(j.split('|'))
-        return return_dict
+        """ Same as _to_dict, with '|' separated values split """
+        name = 'hmdb_{}_to_{}_list'.format(key, value)
+        if name not in self._mappings:
+            self._mappings[name] = cached_set_dict(
+                name, [hmdb_file],
+                lambda: FrozenSetDict.from_frame(self._load([key, value]),
+                                                 key, value, sep='|')
+            )
+        return self._mappings[name]
+
+    def convert(self, ids, from_id, to_id, how='first'):
+        """ Convert many ids at once
+
+        Parameters
+        ----------
+        ids : pandas.Series or list_like
+            ids to convert, such as the identifier column of
+            ExperimentalData
+        from_id : str
+            id type of ids, one of valid_columns or 'main_accession'.
+            'accession' includes secondary accessions.
+        to_id : str
+            id type to convert to, one of valid_columns or 'main_accession'.
+            '|' separated protein_associations are split.
+        how : {'first', 'all'}
+            'first' returns one id (the smallest) per input id, 'all' a
+            list of all ids
+
+        Returns
+        -------
+        pandas.Series or list
+            Series with the index of ids if ids is a Series, else a list.
+            None for ids without mapping.
+
+        Examples
+        --------
+        >>> cm = ChemicalMapper()
+        >>> cm.convert(['HMDB15015', 'HMDB0000001'], 'accession',
+        ...            'main_accession')
+        ['HMDB0015015', 'HMDB0000001']
+        """
+        columns = self.valid_columns + ['main_accession']
+        for i in (from_id, to_id):
+            if i not in columns:
+                raise ValueError('{} must be one of {}'.format(i, columns))
+        if to_id == 'protein_associations':
+            mapping = self._from_list_dict(from_id, to_id)
+        else:
+            mapping = self._to_dict(from_id, to_id)
+        return match_input(ids, mapping.convert(ids, how), name=to_id)
 
     def check_synonym_dict(self, term, format_name):
         """ checks hmdb database for synonyms and returns formatted name
@@ -174,13 +312,57 @@ class ChemicalMapper(object):
         ['HMDB0000933', 'HMDB0059874']
 
         """
-        synonyms = self.database[['synonyms', format_name]].copy()
-        synonyms.dropna(how='any', inplace=True)
-        synonyms['synonyms'] = synonyms['synonyms'].str.lower()
+        rows = self.synonym_index.search(term.lower())
+        return self._synonym_matches(rows, format_name)
+
+    def check_synonyms(self, terms, format_name):
+        """ check_synonym_dict of many terms
+
+        Parameters
+        ----------
+        terms : list_like
+        format_name : str
+
+        Returns
+        -------
+        dict
+            term to matches
+        """
+        terms = list(terms)
+        lower = list(dict.fromkeys(i.lower() for i in terms))
+        found = self.synonym_index.search_many(lower)
+        if format_name not in self._columns:
+            self._load([format_name])
+        values = self._columns[format_name].values
+        # values of the rows of all terms in one take
+        lengths = [len(i) for i in found]
+        rows = np.concatenate(found) if found else np.zeros(0, dtype=int)
+        matched = pd.DataFrame({
+            'term': np.repeat(np.arange(len(lower)), lengths),
+            'value': values[rows]
+        }).dropna().drop_duplicates()
+        matches = [[] for _ in lower]
+        for n, value in matched.sort_values(['term', 'value']).values:
+            matches[n].append(value)
+        matches = dict(zip(lower, matches))
+        return {term: list(matches[term.lower()]) for term in terms}
 
-        hits = synonyms[synonyms['synonyms'].str.contains(term.lower())]
-        matches = sorted(set(hits[format_name].values))
-        return matches
+    @property
+    def synonym_index(self):
+        """ SynonymIndex of lower case HMDB synonyms to database rows """
+        if self._synonym_index is None:
+            self._synonym_index = SynonymIndex(cached_set_dict(
+                'hmdb_synonyms_index', [hmdb_file],
+                lambda: SynonymIndex.from_series(
+                    self._load(['synonyms'])['synonyms'].str.lower()).names
+            ))
+        return self._synonym_index
+
+    def _synonym_matches(self, rows, format_name):
+        if format_name not in self._columns:
+            self._load([format_name])
+        values = self._columns[format_name].values[rows]
+        return sorted(set(i for i in values if not pd.isnull(i)))
 
     def print_info(self):
         """ print information about the dataframe
@@ -190,7 +372,7 @@ class ChemicalMapper(object):
 
         """
         print('Number of HMDB accessions = {0}'.format(
-            len(self.database['accession'].unique())))
+            len(self._load(['accession'])['accession'].unique())))
         print('Number of unique KEGG ids = {0}'.format(
             len(self.hmdb_to_kegg.keys())))
         print('Number of HMDB to KEGG mappings = {0}'.format(
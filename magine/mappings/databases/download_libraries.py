@@ -1,5 +1,8 @@
 
+import gzip
+import multiprocessing as mp
 import os
+import threading
 import zipfile
 from xml.etree import cElementTree as ElementTree
 
@@ -10,6 +13,23 @@ import requests
 from magine.data.storage import id_mapping_dir
 
 
+valid_uniprot_cols = ['uniprot', 'Allergome', 'BioCyc', 'BioGrid', 'BioMuta',
+                      'CCDS', 'CRC64', 'ChEMBL', 'ChiTaRS', 'CleanEx', 'DIP',
+                      'DMDM', 'DNASU', 'DisProt', 'DrugBank', 'EMBL',
+                      'EMBL-CDS', 'ESTHER', 'Ensembl', 'Ensembl_PRO',
+                      'Ensembl_TRS', 'GI', 'GeneCards', 'GeneDB', 'GeneID',
+                      'GeneReviews', 'GeneTree', 'GeneWiki', 'Gene_Name',
+                      'Gene_ORFName', 'Gene_Synonym', 'GenomeRNAi',
+                      'GuidetoPHARMACOLOGY', 'H-InvDB', 'HGNC', 'HOGENOM',
+                      'HOVERGEN', 'HPA', 'KEGG', 'KO', 'MEROPS', 'MIM',
+                      'MINT', 'NCBI_TaxID', 'OMA', 'Orphanet', 'OrthoDB',
+                      'PATRIC', 'PDB', 'PeroxiBase', 'PharmGKB', 'REBASE',
+                      'Reactome', 'RefSeq', 'RefSeq_NT', 'STRING',
+                      'SwissLipids', 'TCDB', 'TreeFam', 'UCSC', 'UniGene',
+                      'UniParc', 'UniPathway', 'UniProtKB-ID', 'UniRef100',
+                      'UniRef50', 'UniRef90', 'eggNOG', 'neXtProt']
+
+
 def load_hgnc():
     hgnc_name = os.path.join(id_mapping_dir, 'hgnc.gz')
     if not os.path.exists(hgnc_name):
@@ -42,15 +62,20 @@ def load_ncbi():
     return ncbi
 
 
-def download_uniprot(species='hsa'):
+def download_uniprot(species='hsa', chunk_size=1000000):
     """
     `<https://www.uniprot.org/>`_
 
+    The id mapping file is read in chunks of chunk_size lines, keeping only
+    the mapping types of valid_uniprot_cols.
+
     Parameters
     ----------
     species : str
         Species name. Currently only human is supported.
         Please let us know if you need other species
+    chunk_size : int
+        Lines of the id mapping file read at a time
 
 
     """
@@ -67,30 +92,9 @@ def download_uniprot(species='hsa'):
 
     columns = ['uniprot', 'mapping_type', 'mapping']
 
-    df = _download(url, columns, name='uniprot', save=False, names=columns,
-                   compression='gzip')
-
-    uniprot = pd.pivot_table(df, columns='mapping_type', index='uniprot',
-                             aggfunc='first')
-
-    uniprot.columns = uniprot.columns.droplevel()
-    uniprot.reset_index(inplace=True)
-    valid_uniprot_cols = ['uniprot', 'Allergome', 'BioCyc', 'BioGrid',
-                          'BioMuta', 'CCDS', 'CRC64', 'ChEMBL', 'ChiTaRS',
-                          'CleanEx', 'DIP', 'DMDM', 'DNASU', 'DisProt',
-                          'DrugBank', 'EMBL', 'EMBL-CDS', 'ESTHER', 'Ensembl',
-                          'Ensembl_PRO', 'Ensembl_TRS', 'GI', 'GeneCards',
-                          'GeneDB', 'GeneID', 'GeneReviews', 'GeneTree',
-                          'GeneWiki', 'Gene_Name', 'Gene_ORFName',
-                          'Gene_Synonym', 'GenomeRNAi', 'GuidetoPHARMACOLOGY',
-                          'H-InvDB', 'HGNC', 'HOGENOM', 'HOVERGEN', 'HPA',
-                          'KEGG', 'KO', 'MEROPS', 'MIM', 'MINT', 'NCBI_TaxID',
-                          'OMA', 'Orphanet', 'OrthoDB', 'PATRIC', 'PDB',
-                          'PeroxiBase', 'PharmGKB', 'REBASE', 'Reactome',
-                          'RefSeq', 'RefSeq_NT', 'STRING', 'SwissLipids',
-                          'TCDB', 'TreeFam', 'UCSC', 'UniGene', 'UniParc',
-                          'UniPathway', 'UniProtKB-ID', 'UniRef100', 'UniRef50',
-                          'UniRef90', 'eggNOG', 'neXtProt']
+    chunks = pd.read_csv(url, delimiter='\t', names=columns, dtype=str,
+                         compression='gzip', chunksize=chunk_size)
+    uniprot = fold_id_mapping(chunks, valid_uniprot_cols[1:])
 
     outfile = os.path.join(id_mapping_dir, 'human_uniprot.csv.gz')
     uniprot.to_csv(outfile, compression='gzip', columns=valid_uniprot_cols,
@@ -99,6 +103,38 @@ def download_uniprot(species='hsa'):
     return uniprot
 
 
+def fold_id_mapping(chunks, mapping_types):
+    """ Wide table of the first mapping of each uniprot id and mapping type
+
+    Parameters
+    ----------
+    chunks : iterable of pandas.DataFrame
+        Parts of the long id mapping table, with columns uniprot,
+        mapping_type and mapping
+    mapping_types : list
+        Mapping types to keep, the columns of the wide table
+
+    Returns
+    -------
+    pandas.DataFrame
+        uniprot column and a column per mapping type, sorted by uniprot
+    """
+    uniprot = None
+    for chunk in chunks:
+        chunk = chunk[chunk['mapping_type'].isin(mapping_types)]
+        chunk = chunk.drop_duplicates(['uniprot', 'mapping_type'])
+        wide = chunk.pivot(index='uniprot', columns='mapping_type',
+                           values='mapping')
+        # ids split across chunks are merged, keeping the first mapping
+        uniprot = wide if uniprot is None else uniprot.combine_first(wide)
+    if uniprot is None:
+        uniprot = pd.DataFrame(index=pd.Index([], name='uniprot'))
+    uniprot = uniprot.reindex(columns=mapping_types)
+    uniprot.columns.name = None
+    uniprot.index.name = 'uniprot'
+    return uniprot.reset_index()
+
+
 def download_hgnc():
     """
     Downloads HGNC and stores it as a pandas.DataFrame
@@ -148,6 +184,111 @@ def _download(url, columns, name, save=True, names=None, compression=None):
     return df
 
 
+# columns of the parsed metabolites, ontology is stored as biofunction and
+# cellular_locations
+_hmdb_columns = ['kegg_id', 'name', 'accession', 'chebi_id', 'chemspider_id',
+                 'biocyc_id', 'synonyms', 'pubchem_compound_id',
+                 'protein_associations', 'inchikey', 'iupac_name',
+                 'biofunction', 'cellular_locations', 'drugbank_id',
+                 'chemical_formula', 'smiles', 'metlin_id',
+                 'average_molecular_weight', 'secondary_accessions']
+
+_start_tag = b'<metabolite>'
+_end_tag = b'</metabolite>'
+
+
+def metabolite_chunks(file_name, chunk_size=1 << 23):
+    """ Split a HMDB xml file into chunks of whole <metabolite> records
+
+    Parameters
+    ----------
+    file_name : str
+    chunk_size : int
+        Bytes read at a time, a chunk holds the records ending in them
+
+    Yields
+    ------
+    bytes
+        <metabolite>...</metabolite> records, without the enclosing root
+    """
+    buffer = b''
+    with open(file_name, 'rb') as f:
+        while True:
+            block = f.read(chunk_size)
+            buffer += block
+            end = buffer.rfind(_end_tag)
+            if end != -1:
+                end += len(_end_tag)
+                yield buffer[buffer.find(_start_tag):end]
+                buffer = buffer[end:]
+            if not block:
+                break
+
+
+def parse_metabolites(chunk):
+    """ DataFrame of a chunk of metabolite records (see metabolite_chunks) """
+    root = ElementTree.fromstring(b'<hmdb>' + chunk + b'</hmdb>')
+    columns = {i: [] for i in _hmdb_columns}
+    for elem in root.findall('metabolite'):
+        for key, value in HMDB._create_dict(elem).items():
+            columns[key].append(value)
+        elem.clear()
+    return pd.DataFrame(columns, columns=_hmdb_columns)
+
+
+def _throttle(iterable, semaphore):
+    for i in iterable:
+        semaphore.acquire()
+        yield i
+
+
+def write_batches(handle, files, processes=1, chunk_size=1 << 23):
+    """ Parse HMDB xml files and write the metabolites as csv to handle
+
+    Parameters
+    ----------
+    handle : file
+        Open text file
+    files : list
+        HMDB xml files
+    processes : int
+        Number of worker processes, 1 parses in the current process
+    chunk_size : int
+        Bytes of xml per task
+
+    Returns
+    -------
+    int
+        Number of metabolites
+    """
+    chunks = (c for i in files for c in metabolite_chunks(i, chunk_size))
+    if processes == 1:
+        semaphore = None
+        batches = (parse_metabolites(i) for i in chunks)
+    else:
+        # bounds the chunks read ahead of the writer
+        semaphore = threading.Semaphore(2 * processes)
+        pool = mp.Pool(processes)
+        batches = pool.imap(parse_metabolites, _throttle(chunks, semaphore))
+    count = 0
+    try:
+        for batch in batches:
+            batch.to_csv(handle, header=count == 0, index=False)
+            count += len(batch)
+            if semaphore is not None:
+                semaphore.release()
+    finally:
+        if processes != 1:
+            # unblocks the reader if writing stopped early
+            for _ in range(2 * processes):
+                semaphore.release()
+            pool.terminate()
+            pool.join()
+    if count == 0:
+        pd.DataFrame(columns=_hmdb_columns).to_csv(handle, index=False)
+    return count
+
+
 class HMDB(object):
     """
     Downloads and processes HMDB metabolites database
@@ -156,10 +297,11 @@ class HMDB(object):
 
     """
 
-    def __init__(self):
+    def __init__(self, processes=None):
         self.tmp_dir = id_mapping_dir
         self.target_file = 'hmdb_metabolites.zip'
         self.out_name = os.path.join(id_mapping_dir, 'hmdb_dataframe.csv.gz')
+        self.processes = processes
         self._setup()
 
     def load_db(self):
@@ -169,6 +311,10 @@ class HMDB(object):
     def _setup(self):
         """ parse HMDB to Pandas.DataFrame
 
+        Files are split into chunks of whole <metabolite> records, parsed
+        in self.processes worker processes (default all cores) and written
+        to the csv batch by batch, in order. At most two chunks per process
+        are in memory at a time.
         """
         out_dir = os.path.join(self.tmp_dir, 'HMDB')
         if not os.path.exists(out_dir):
@@ -176,40 +322,13 @@ class HMDB(object):
         if len(os.listdir(out_dir)) == 0:
             self._unzip_hmdb(out_dir)
 
-        count = 0
-
         print("Parsing metabolites information from files")
-        tmp_all = [None] * 1000000
-        for i in os.listdir(out_dir):
-            filename = os.path.join(out_dir, i)
-
-            # get an iterable
-            context = ElementTree.iterparse(filename, events=("start", "end"))
-
-            # turn it into an iterator
-            context = iter(context)
-
-            # get the root element
-            event, root = next(context)
-            for event, elem in context:
-
-                if '}' in elem.tag:
-                    elem.tag = elem.tag.split('}', 1)[1]
-                if elem.tag == 'metabolite' and event == 'end':
-                    # """
-
-                    # if count > 10000:
-                    #     break
-                    # """
-                    template = self._create_dict(elem)
-                    tmp_all[count] = template
-                    count += 1
-                    elem.clear()
-                    root.clear()
-
-        df = pd.DataFrame(tmp_all[:count], columns=template.keys())
-        df.to_csv(self.out_name, index=False, encoding='utf-8',
-                  compression='gzip', tupleize_cols=True)
+        files = [os.path.join(out_dir, i) for i in sorted(os.listdir(out_dir))]
+        processes = self.processes or mp.cpu_count()
+        tmp = '{}.tmp'.format(self.out_name)
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            write_batches(f, files, processes)
+        getattr(os, 'replace', os.rename)(tmp, self.out_name)
         print("Done processing HMDB")
 
     def _unzip_hmdb(self, out_directory):
@@ -0,0 +1,284 @@
+"""
+Read only mapping dictionaries stored as sorted arrays.
+
+A FrozenSetDict maps each key to a sorted set of values, like the
+SortedDict of SortedSet the mappers used to build row by row. Keys are a
+sorted array, the values of key i are values[indptr[i]:indptr[i + 1]].
+They are built from a DataFrame with vectorized split/explode and a sort,
+and saved to a .npz file with strings stored as a single NUL separated
+utf-8 buffer, so loading needs no per entry Python work.
+"""
+import json
+import os
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # python 2
+    from collections import Mapping
+
+import numpy as np
+import pandas as pd
+from sortedcontainers import SortedSet
+
+from magine.data.storage import id_mapping_dir
+
+CACHE_VERSION = 1
+cache_dir = os.path.join(id_mapping_dir, 'mapping_cache')
+_sep = u'\x00'
+
+
+def _encode(array):
+    """ Numeric arrays as is, everything else as a utf-8 buffer """
+    if array.dtype.kind in 'biuf':
+        return dict(kind='number', data=array)
+    text = _sep.join(str(i) for i in array).encode('utf-8')
+    return dict(kind='str', data=np.frombuffer(text, dtype=np.uint8))
+
+
+def _decode(kind, data, size):
+    if kind == 'number':
+        return data
+    if size == 0:
+        return np.zeros(0, dtype=object)
+    return np.array(data.tobytes().decode('utf-8').split(_sep), dtype=object)
+
+
+def _as_array(values):
+    values = np.asarray(values)
+    if values.dtype.kind not in 'biuf':
+        values = values.astype(object)
+    return values
+
+
+class FrozenSetDict(Mapping):
+    """ Read only dict of keys to sorted sets of values
+
+    Parameters
+    ----------
+    keys : numpy.array
+        Sorted unique keys
+    indptr : numpy.array
+        Offsets of the values of each key, len(keys) + 1
+    values : numpy.array
+        Values, sorted within each key
+    """
+
+    def __init__(self, keys, indptr, values):
+        self.keys_array = keys
+        self.indptr = indptr
+        self.values_array = values
+        self._index = None
+
+    @classmethod
+    def from_frame(cls, data, key, value, sep=None, strip_keys=False,
+                   overrides=None):
+        """ Build from two columns of a DataFrame
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+        key : str
+        value : str
+        sep : str, optional
+            Split values on sep, each part is a value
+        strip_keys : bool
+            Strip whitespace around string keys
+        overrides : dict, optional
+            key to value, replacing all values of key
+
+        Returns
+        -------
+        FrozenSetDict
+        """
+        d = data[[key, value]].dropna(how='any')
+        keys = d[key]
+        values = d[value]
+        if strip_keys:
+            keys = keys.str.strip()
+        if sep is not None:
+            values = values.astype(str).str.split(sep)
+            keys = keys.repeat(values.str.len())
+            values = values.explode()
+        d = pd.DataFrame({'key': _as_array(keys),
+                          'value': _as_array(values)})
+        if overrides:
+            d = d[~d['key'].isin(list(overrides))]
+            d = pd.concat([d, pd.DataFrame({
+                'key': _as_array(list(overrides.keys())),
+                'value': _as_array(list(overrides.values()))})])
+        d = d.drop_duplicates().sort_values(['key', 'value'])
+        keys = _as_array(d['key'])
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) \
+            if len(keys) else np.zeros(0, dtype=np.int64)
+        indptr = np.append(starts, len(keys)).astype(np.int64)
+        return cls(keys[starts], indptr, _as_array(d['value']))
+
+    def save(self, file_name, source=''):
+        """ Save to a .npz file
+
+        Parameters
+        ----------
+        file_name : str
+        source : str
+            Description of the data it was built from, checked by load
+        """
+        keys = _encode(self.keys_array)
+        values = _encode(self.values_array)
+        header = dict(version=CACHE_VERSION, source=source,
+                      keys=keys['kind'], values=values['kind'],
+                      n_keys=len(self.keys_array),
+                      n_values=len(self.values_array))
+        tmp = '{}.tmp.npz'.format(file_name)
+        np.savez(tmp, header=np.array(json.dumps(header)), keys=keys['data'],
+                 indptr=self.indptr, values=values['data'])
+        getattr(os, 'replace', os.rename)(tmp, file_name)
+
+    @classmethod
+    def load(cls, file_name, source=None):
+        """ Load a saved FrozenSetDict
+
+        Returns
+        -------
+        FrozenSetDict
+            None if the file does not exist, is of another version or
+            (if given) was built from another source
+        """
+        if not os.path.exists(file_name):
+            return None
+        with np.load(file_name) as f:
+            header = json.loads(str(f['header']))
+            if header['version'] != CACHE_VERSION or \
+                    (source is not None and header['source'] != source):
+                return None
+            return cls(_decode(header['keys'], f['keys'], header['n_keys']),
+                       f['indptr'],
+                       _decode(header['values'], f['values'],
+                               header['n_values']))
+
+    def position(self, key):
+        """ Position of key in keys_array, None if missing """
+        try:
+            i = int(np.searchsorted(self.keys_array, key))
+        except TypeError:  # key not comparable with keys
+            return None
+        if i < len(self.keys_array) and self.keys_array[i] == key:
+            return i
+        return None
+
+    def positions(self, keys):
+        """ Positions of keys in keys_array, -1 for missing keys
+
+        Parameters
+        ----------
+        keys : list_like
+
+        Returns
+        -------
+        numpy.array
+        """
+        if self._index is None:
+            self._index = pd.Index(self.keys_array)
+        return self._index.get_indexer(_as_array(list(keys)))
+
+    def convert(self, keys, how='first'):
+        """ Values of many keys at once
+
+        Parameters
+        ----------
+        keys : list_like
+        how : {'first', 'all'}
+            'first' returns the first (smallest) value of each key, 'all' a
+            list of all values
+
+        Returns
+        -------
+        numpy.array
+            object array aligned with keys, None for missing keys
+        """
+        if how not in ('first', 'all'):
+            raise ValueError("how must be 'first' or 'all'")
+        positions = self.positions(keys)
+        found = np.flatnonzero(positions != -1)
+        converted = np.full(len(positions), None, dtype=object)
+        starts = self.indptr[positions[found]]
+        if how == 'first':
+            converted[found] = self.values_array[starts].tolist()
+        else:
+            ends = self.indptr[positions[found] + 1]
+            for i, start, end in zip(found, starts, ends):
+                converted[i] = self.values_array[start:end].tolist()
+        return converted
+
+    def __getitem__(self, key):
+        i = self.position(key)
+        if i is None:
+            raise KeyError(key)
+        return SortedSet(
+            self.values_array[self.indptr[i]:self.indptr[i + 1]].tolist())
+
+    def __contains__(self, key):
+        return self.position(key) is not None
+
+    def __iter__(self):
+        return iter(self.keys_array.tolist())
+
+    def __len__(self):
+        return len(self.keys_array)
+
+
+def match_input(ids, converted, name=None):
+    """ Converted values as a Series aligned with ids, or as a list
+
+    Parameters
+    ----------
+    ids : pandas.Series or list_like
+    converted : numpy.array
+    name : str, optional
+        Name of the returned Series
+
+    Returns
+    -------
+    pandas.Series or list
+        Series with the index of ids if ids is a Series, otherwise a list
+    """
+    if isinstance(ids, pd.Series):
+        return pd.Series(converted, index=ids.index, name=name, dtype=object)
+    return converted.tolist()
+
+
+def source_key(file_names):
+    """ Size and mtime of files, to detect changes of the source data """
+    source = dict()
+    for i in file_names:
+        if os.path.exists(i):
+            stat = os.stat(i)
+            source[os.path.basename(i)] = [stat.st_size, stat.st_mtime]
+    return json.dumps(source, sort_keys=True)
+
+
+def cached_set_dict(name, source_files, build):
+    """ FrozenSetDict saved in cache_dir, rebuilt if the source changed
+
+    Parameters
+    ----------
+    name : str
+        Name of the mapping, the file name in cache_dir
+    source_files : list
+        Files the mapping is built from
+    build : callable
+        Returns the FrozenSetDict, called if there is no current cache
+
+    Returns
+    -------
+    FrozenSetDict
+    """
+    file_name = os.path.join(cache_dir, '{}.npz'.format(name))
+    source = source_key(source_files)
+    mapping = FrozenSetDict.load(file_name, source)
+    if mapping is None:
+        mapping = build()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        # source files may have been created (downloaded) by build
+        mapping.save(file_name, source_key(source_files))
+    return mapping
@@ -1,4 +1,6 @@
 
+import os
+
 try:
     import cPickle as pickle
 except ImportError:  # python3 doesnt have cPickle
@@ -6,12 +8,19 @@ except ImportError:  # python3 doesnt have cPickle
 
 import pandas as pd
 from bioservices import HGNC, UniProt
-from sortedcontainers import SortedSet, SortedDict
 
+from magine.data.storage import id_mapping_dir
 from magine.mappings.databases import load_hgnc, load_uniprot, load_ncbi
+from magine.mappings.frozen_dict import FrozenSetDict, cached_set_dict, \
+    match_input
+from magine.mappings.synonym_index import SynonymIndex
 
 pd.set_option('display.width', 20000)
 
+# files of magine.mappings.databases the tables are loaded from
+_source_files = {'hgnc': 'hgnc.gz', 'ncbi': 'ncbi.gz',
+                 'uniprot': 'human_uniprot.csv.gz'}
+
 
 class GeneMapper(object):
     """
@@ -52,9 +61,9 @@ class GeneMapper(object):
 
     def __init__(self, species='hsa'):
         self.species = species
-        self.hgnc = load_hgnc()
-        self.ncbi = load_ncbi()
-        self.uniprot = load_uniprot()
+        self._hgnc = None
+        self._ncbi = None
+        self._uniprot = None
         self._gene_name_to_uniprot = None
         self._gene_name_to_alias_name = None
         self._gene_name_to_ensembl = None
@@ -64,66 +73,169 @@ class GeneMapper(object):
         self._kegg_to_gene_name = None
         self._kegg_to_uniprot = None
         self._ncbi_to_symbol = None
+        self._mappings = dict()
+        self._alias_index = None
+
+    @property
+    def hgnc(self):
+        if self._hgnc is None:
+            self._hgnc = load_hgnc()
+        return self._hgnc
+
+    @property
+    def ncbi(self):
+        if self._ncbi is None:
+            self._ncbi = load_ncbi()
+        return self._ncbi
+
+    @property
+    def uniprot(self):
+        if self._uniprot is None:
+            self._uniprot = load_uniprot()
+        return self._uniprot
+
+    def _mapping(self, table, key, value):
+        """ Cached FrozenSetDict of key to values in table
+
+        Only reads table if the mapping is not cached or table has changed.
+        """
+        name = '{}_{}_to_{}'.format(table, key, value)
+        if name not in self._mappings:
+            overrides = None
+            if (table, key, value) == ('uniprot', 'KEGG', 'Gene_Name'):
+                overrides = manual_dict
+            self._mappings[name] = cached_set_dict(
+                name, [os.path.join(id_mapping_dir, _source_files[table])],
+                lambda: FrozenSetDict.from_frame(getattr(self, table), key,
+                                                 value, overrides=overrides)
+            )
+        return self._mappings[name]
+
+    def convert(self, ids, from_id, to_id, how='first'):
+        """ Convert many ids at once
+
+        Parameters
+        ----------
+        ids : pandas.Series or list_like
+            ids to convert, such as the identifier column of
+            ExperimentalData
+        from_id : str
+            id type of ids, a column of the HGNC (hgnc_valid_categories),
+            UniProt (valid_uniprot_cols) or NCBI (ncbi_valid_categories)
+            table
+        to_id : str
+            id type to convert to, a column of the same table
+        how : {'first', 'all'}
+            'first' returns one id (the smallest) per input id, 'all' a
+            list of all ids
+
+        Returns
+        -------
+        pandas.Series or list
+            Series with the index of ids if ids is a Series, else a list.
+            None for ids without mapping.
+
+        Examples
+        --------
+        >>> gm = GeneMapper()
+        >>> gm.convert(['Q07812', 'P10415'], 'uniprot_ids', 'symbol')
+        ['BAX', 'BCL2']
+        """
+        for table, columns in [('hgnc', self.hgnc_valid_categories),
+                               ('uniprot', self.valid_uniprot_cols),
+                               ('ncbi', self.ncbi_valid_categories)]:
+            if from_id in columns and to_id in columns:
+                mapping = self._mapping(table, from_id, to_id)
+                break
+        else:
+            raise ValueError(
+                'No table has both {} and {}'.format(from_id, to_id))
+        return match_input(ids, mapping.convert(ids, how), name=to_id)
 
     @property
     def gene_name_to_uniprot(self):
         if self._gene_name_to_uniprot is None:
-            self._gene_name_to_uniprot = _dict(self.hgnc, 'symbol',
-                                               'uniprot_ids')
+            self._gene_name_to_uniprot = self._mapping('hgnc', 'symbol',
+                                                       'uniprot_ids')
         return self._gene_name_to_uniprot
 
     @property
     def gene_name_to_alias_name(self):
         if self._gene_name_to_alias_name is None:
-            self._gene_name_to_alias_name = _dict(self.hgnc, 'symbol',
-                                                  'alias_name')
+            self._gene_name_to_alias_name = self._mapping('hgnc', 'symbol',
+                                                          'alias_name')
         return self._gene_name_to_alias_name
 
     @property
     def gene_name_to_ensembl(self):
         if self._gene_name_to_ensembl is None:
-            self._gene_name_to_ensembl = _dict(self.hgnc, 'symbol',
-                                               'ensembl_gene_id')
+            self._gene_name_to_ensembl = self._mapping('hgnc', 'symbol',
+                                                       'ensembl_gene_id')
         return self._gene_name_to_ensembl
 
     @property
     def uniprot_to_gene_name(self):
         if self._uniprot_to_gene_name is None:
-            self._uniprot_to_gene_name = _dict(self.hgnc, 'uniprot_ids',
-                                               'symbol')
+            self._uniprot_to_gene_name = self._mapping('hgnc', 'uniprot_ids',
+                                                       'symbol')
         return self._uniprot_to_gene_name
 
     @property
     def gene_name_to_kegg(self):
         if self._gene_name_to_kegg is None:
-            self._gene_name_to_kegg = _dict(self.uniprot, 'Gene_Name', 'KEGG')
+            self._gene_name_to_kegg = self._mapping('uniprot', 'Gene_Name',
+                                                    'KEGG')
         return self._gene_name_to_kegg
 
     @property
     def uniprot_to_kegg(self):
         if self._uniprot_to_kegg is None:
-            self._uniprot_to_kegg = _dict(self.uniprot, 'uniprot', 'KEGG')
+            self._uniprot_to_kegg = self._mapping('uniprot', 'uniprot',
+                                                  'KEGG')
         return self._uniprot_to_kegg
 
     @property
     def kegg_to_gene_name(self):
         if self._kegg_to_gene_name is None:
-            self._kegg_to_gene_name = _dict(self.uniprot, 'KEGG', 'Gene_Name')
-            self._kegg_to_gene_name.update(manual_dict)
+            self._kegg_to_gene_name = self._mapping('uniprot', 'KEGG',
+                                                    'Gene_Name')
         return self._kegg_to_gene_name
 
     @property
     def kegg_to_uniprot(self):
         if self._kegg_to_uniprot is None:
-            self._kegg_to_uniprot = _dict(self.uniprot, 'KEGG', 'uniprot')
+            self._kegg_to_uniprot = self._mapping('uniprot', 'KEGG',
+                                                  'uniprot')
         return self._kegg_to_uniprot
 
     @property
     def ncbi_to_symbol(self):
         if self._ncbi_to_symbol is None:
-            self._ncbi_to_symbol = _dict(self.ncbi, 'GeneID', 'Symbol')
+            self._ncbi_to_symbol = self._mapping('ncbi', 'GeneID', 'Symbol')
         return self._ncbi_to_symbol
-        
+
+    @property
+    def alias_index(self):
+        """ SynonymIndex of upper case HGNC alias symbols to hgnc rows """
+        if self._alias_index is None:
+            self._alias_index = SynonymIndex(cached_set_dict(
+                'hgnc_alias_symbol_index',
+                [os.path.join(id_mapping_dir, _source_files['hgnc'])],
+                lambda: SynonymIndex.from_series(
+                    self.hgnc['alias_symbol'].str.upper()).names
+            ))
+        return self._alias_index
+
+    def _synonym_matches(self, term, rows, format_name):
+        """ formatted names of an exact or else substring alias match """
+        values = self.hgnc[format_name].values
+        if rows is None:
+            rows = self.alias_index.exact(term)
+        if len(rows):
+            return [values[rows[0]]]
+        rows = self.alias_index.search(term.upper())
+        return sorted(set(i for i in values[rows] if not pd.isnull(i)))
+
     def check_synonym_dict(self, term, format_name):
         """ checks hmdb database for synonyms and returns formatted name
 
@@ -137,18 +249,25 @@ class GeneMapper(object):
         dict
 
         """
-        synonyms = self.hgnc.copy()
-        synonyms = synonyms[~synonyms['alias_symbol'].isna()]
-        synonyms['alias_symbol'] = synonyms['alias_symbol'].str.upper()
+        return self._synonym_matches(term, None, format_name)
+
+    def check_synonyms(self, terms, format_name):
+        """ check_synonym_dict of many terms
 
-        hits = synonyms[synonyms['alias_symbol'].str.contains(term.upper())].copy()
-        hits['alias_symbol'] = hits['alias_symbol'].str.split('|')
+        Parameters
+        ----------
+        terms : list_like
+        format_name : str
 
-        for i, row in hits.iterrows():
-            if term in row['alias_symbol']:
-                return [row[format_name]]
-        matches = sorted(set(hits[format_name].values))
-        return matches
+        Returns
+        -------
+        dict
+            term to matches
+        """
+        terms = list(terms)
+        exact = self.alias_index.exact_many(terms)
+        return {term: self._synonym_matches(term, rows, format_name)
+                for term, rows in zip(terms, exact)}
 
     def convert_kegg_nodes(self, network, species='hsa'):
         """ Convert kegg ids to HGNC gene symbol.
@@ -289,19 +408,10 @@ def _dict(data, key, value):
 
     Returns
     -------
+    magine.mappings.frozen_dict.FrozenSetDict
 
     """
-    return_dict = SortedDict()
-
-    d = data[[key, value]].copy()
-    d.dropna(how='any', inplace=True)
-
-    for i, j in d.values:
-        if i in return_dict:
-            return_dict[i].add(j)
-        else:
-            return_dict[i] = SortedSet([j])
-    return return_dict
+    return FrozenSetDict.from_frame(data, key, value)
 
 
 manual_dict = {'hsa:857': 'CAV1',
@@ -5,17 +5,51 @@ Mapping between data identifiers
 
 import networkx as nx
 
-from magine.mappings.chemical_mapper import ChemicalMapper
-from magine.mappings.gene_mapper import GeneMapper
-
 try:
     import cPickle as pickle
 except ImportError:
     import pickle as pickle
 
+_gene_mapper = None
+_chemical_mapper = None
+
+
+def gene_mapper():
+    """ Process wide GeneMapper, created on first use
+
+    Returns
+    -------
+    magine.mappings.gene_mapper.GeneMapper
+    """
+    global _gene_mapper
+    if _gene_mapper is None:
+        from magine.mappings.gene_mapper import GeneMapper
+        _gene_mapper = GeneMapper()
+    return _gene_mapper
+
+
+def chemical_mapper():
+    """ Process wide ChemicalMapper, created on first use
+
+    Returns
+    -------
+    magine.mappings.chemical_mapper.ChemicalMapper
+    """
+    global _chemical_mapper
+    if _chemical_mapper is None:
+        from magine.mappings.chemical_mapper import ChemicalMapper
+        _chemical_mapper = ChemicalMapper()
+    return _chemical_mapper
+
 
-gm = GeneMapper()
-cm = ChemicalMapper()
+def __getattr__(name):
+    # gm and cm used to be created at import (python 3.7+)
+    if name == 'gm':
+        return gene_mapper()
+    if name == 'cm':
+        return chemical_mapper()
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
 
 
 def convert_all(network, species='hsa', verbose=False):
@@ -44,7 +78,8 @@ def convert_all(network, species='hsa', verbose=False):
 
     if verbose:
         print('Started converting kegg compounds to HMDB')
-    hmdb, kegg_short, chem_names = cm.convert_kegg_nodes(renamed_network)
+    hmdb, kegg_short, chem_names = chemical_mapper().convert_kegg_nodes(
+        renamed_network)
     nx.set_node_attributes(renamed_network, kegg_short, 'keggName')
     nx.set_node_attributes(renamed_network, chem_names, 'chemName')
     nx.set_node_attributes(renamed_network, hmdb, 'hmdbNames')
@@ -52,7 +87,8 @@ def convert_all(network, species='hsa', verbose=False):
 
     if verbose:
         print('Started converting kegg genes to HGNC')
-    dict2, kegg_short = gm.convert_kegg_nodes(renamed_network, species=species)
+    dict2, kegg_short = gene_mapper().convert_kegg_nodes(renamed_network,
+                                                         species=species)
     nx.set_node_attributes(renamed_network, kegg_short, 'keggName')
     change_dict.update(dict2)
     renamed_network = nx.relabel_nodes(renamed_network, change_dict)
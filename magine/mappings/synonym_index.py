@@ -0,0 +1,180 @@
+"""
+Exact, prefix and substring search of synonym columns.
+
+The '|' separated synonyms of a table are split into one name per synonym
+and stored as a FrozenSetDict of name to the rows of the table using it.
+Exact and prefix searches are binary searches of the sorted names.
+Substring searches use an index of the 3 byte grams (of the utf-8 encoded
+names) to the names containing them: only names containing every gram of
+the term are compared with the term. Terms shorter than a gram are found
+by comparing the NUL separated utf-8 names with the term byte by byte.
+"""
+import numpy as np
+import pandas as pd
+
+from magine.mappings.frozen_dict import FrozenSetDict
+
+_gram = 3
+_last_char = u'\U0010ffff'
+
+
+def _grams(text):
+    """ 3 byte grams of a uint8 array, as int32 """
+    text = text.astype(np.int32)
+    return (text[:-2] << 16) | (text[1:-1] << 8) | text[2:]
+
+
+class SynonymIndex(object):
+    """ Search of names mapped to rows of a table
+
+    Parameters
+    ----------
+    names : FrozenSetDict
+        name to rows
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self._gram_keys = None
+        self._gram_indptr = None
+        self._gram_names = None
+        self._text = None
+        self._separators = None
+
+    @classmethod
+    def from_series(cls, synonyms, sep='|'):
+        """ Index of a column of synonyms
+
+        Parameters
+        ----------
+        synonyms : pandas.Series
+            sep separated synonyms of each row, already normalized (such
+            as upper or lower case)
+        sep : str
+
+        Returns
+        -------
+        SynonymIndex
+        """
+        rows = pd.Series(np.arange(len(synonyms)), index=synonyms.index)
+        split = synonyms.dropna().astype(str).str.split(sep)
+        data = pd.DataFrame({
+            'name': np.array([j for i in split for j in i], dtype=object),
+            'row': rows[split.index].repeat(split.str.len()).values
+        })
+        return cls(FrozenSetDict.from_frame(data, 'name', 'row'))
+
+    def _build_grams(self):
+        """ Sparse (csr) index of grams to positions of names """
+        keys = self.names.keys_array
+        text = u'\x00'.join(keys).encode('utf-8')
+        text = np.frombuffer(text, dtype=np.uint8)
+        self._text = text
+        self._separators = np.flatnonzero(text == 0)
+        name_of_byte = np.cumsum(text == 0, dtype=np.int64)
+        grams = _grams(text)
+        # grams spanning a separator are not part of a name
+        valid = name_of_byte[:-2] == name_of_byte[2:]
+        pairs = np.unique((grams[valid].astype(np.int64) << 32) |
+                          name_of_byte[:-2][valid])
+        grams = (pairs >> 32).astype(np.int32)
+        starts = np.flatnonzero(np.r_[True, grams[1:] != grams[:-1]]) \
+            if len(grams) else np.zeros(0, dtype=np.int64)
+        self._gram_keys = grams[starts]
+        self._gram_indptr = np.append(starts, len(grams)).astype(np.int64)
+        self._gram_names = (pairs & 0xffffffff).astype(np.int32)
+
+    def _scan(self, encoded):
+        """ Positions of names containing the bytes of encoded """
+        if self._text is None:
+            self._build_grams()
+        text = self._text
+        n = len(text) - len(encoded) + 1
+        if n <= 0:
+            return np.zeros(0, dtype=np.int64)
+        found = text[:n] == encoded[0]
+        for i in range(1, len(encoded)):
+            found &= text[i:i + n] == encoded[i]
+        # terms have no NUL, so matches never span two names
+        return np.unique(np.searchsorted(self._separators,
+                                         np.flatnonzero(found)))
+
+    def _rows(self, positions):
+        """ Sorted unique rows of names at positions """
+        indptr = self.names.indptr
+        values = self.names.values_array
+        positions = np.asarray(positions, dtype=np.int64)
+        starts = indptr[positions]
+        lengths = indptr[positions + 1] - starts
+        offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return np.unique(values[np.repeat(starts - offsets[:-1], lengths) +
+                                np.arange(offsets[-1])])
+
+    def exact(self, term):
+        """ Rows with a synonym equal to term
+
+        Returns
+        -------
+        numpy.array
+            sorted rows
+        """
+        position = self.names.position(term)
+        return self._rows([] if position is None else [position])
+
+    def exact_many(self, terms):
+        """ exact for many terms at once
+
+        Returns
+        -------
+        list
+            sorted rows of each term
+        """
+        positions = self.names.positions(terms)
+        return [self._rows([] if i == -1 else [i]) for i in positions]
+
+    def prefix(self, term):
+        """ Rows with a synonym starting with term """
+        keys = self.names.keys_array
+        start = np.searchsorted(keys, term, side='left')
+        end = np.searchsorted(keys, term + _last_char, side='left')
+        return self._rows(np.arange(start, end))
+
+    def search(self, term):
+        """ Rows with a synonym containing term """
+        keys = self.names.keys_array
+        encoded = np.frombuffer(term.encode('utf-8'), dtype=np.uint8)
+        if len(encoded) == 0:
+            return self._rows(np.arange(len(keys)))
+        if len(encoded) < _gram:
+            return self._rows(self._scan(encoded))
+        if self._gram_keys is None:
+            self._build_grams()
+        grams = np.unique(_grams(encoded))
+        found = np.searchsorted(self._gram_keys, grams)
+        if np.any(found == len(self._gram_keys)) or \
+                np.any(self._gram_keys[np.minimum(
+                    found, len(self._gram_keys) - 1)] != grams):
+            return self._rows([])
+        postings = sorted(
+            (self._gram_names[self._gram_indptr[i]:
+                              self._gram_indptr[i + 1]] for i in found),
+            key=len)
+        candidates = postings[0]
+        for i in postings[1:]:
+            candidates = np.intersect1d(candidates, i, assume_unique=True)
+        return self._rows([i for i in candidates if term in keys[i]])
+
+    def search_many(self, terms):
+        """ search for many terms at once
+
+        Each distinct term is searched once.
+
+        Returns
+        -------
+        list
+            sorted rows of each term
+        """
+        terms = list(terms)
+        found = {i: self.search(i) for i in dict.fromkeys(terms)}
+        return [found[i] for i in terms]
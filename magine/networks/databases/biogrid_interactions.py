@@ -7,7 +7,7 @@ import pandas as pd
 
 import magine.networks.utils as utils
 from magine.data.storage import network_data_dir
-from magine.mappings import ChemicalMapper
+from magine.mappings.maps import chemical_mapper
 
 if sys.version_info[0] == 3:
     from urllib.request import urlopen
@@ -22,7 +22,7 @@ class BioGridDownload(object):
         self.url = 'https://thebiogrid.org/downloads/archives/Latest%20Release/BIOGRID-ALL-LATEST.tab2.zip'
         self.url2 = 'https://thebiogrid.org/downloads/archives/Latest%20Release/BIOGRID-CHEMICALS-LATEST.chemtab.zip'
         self._db_name = 'BioGrid'
-        self._cm = ChemicalMapper()
+        self._cm = chemical_mapper()
 
     def _create_chemical_network(self):
         df = pd.read_csv(io.BytesIO(urlopen(self.url2).read()),
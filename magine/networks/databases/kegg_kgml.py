@@ -3,7 +3,6 @@ import os
 import xml.etree.cElementTree as element_tree
 
 import networkx as nx
-from bioservices import KEGG
 
 import magine.networks.utils as utils
 from magine.data.storage import network_data_dir
@@ -13,8 +12,25 @@ try:
 except:
     import pickle
 
-kegg = KEGG()
-kegg.TIMEOUT = 100
+_kegg = None
+
+
+def kegg_client():
+    """ Process wide bioservices KEGG client, created on first use """
+    global _kegg
+    if _kegg is None:
+        from bioservices import KEGG
+        _kegg = KEGG()
+        _kegg.TIMEOUT = 100
+    return _kegg
+
+
+def __getattr__(name):
+    # kegg used to be created at import (python 3.7+)
+    if name == 'kegg':
+        return kegg_client()
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
 
 
 def pathway_id_to_network(pathway_id, species='hsa'):
@@ -32,6 +48,7 @@ def pathway_id_to_network(pathway_id, species='hsa'):
     nx.DiGraph
 
     """
+    kegg = kegg_client()
     kegg.organism = species
     list_of_kegg_pathways = [i[5:] for i in kegg.pathwayIds]
 
@@ -150,6 +167,7 @@ def download_kegg(species='hsa', verbose=False):
     """
     if species == 'hsa':
         from magine.mappings.maps import convert_all
+    kegg = kegg_client()
     kegg.organism = species
     list_of_kegg_pathways = [i[5:] for i in kegg.pathwayIds]
     if verbose:
@@ -109,8 +109,8 @@ def download_reactome_fi():
     table = table[~table['Annotation'].str.contains('compound')]
     genes = set(table['Gene1'])
     genes.update(set(table['Gene2']))
-    from magine.mappings.gene_mapper import GeneMapper
-    gm = GeneMapper()
+    from magine.mappings.maps import gene_mapper
+    gm = gene_mapper()
     missing_uniprot = set(i for i in genes if i not in gm.gene_name_to_uniprot)
     table = table[~table['Gene1'].isin(missing_uniprot)]
     table = table[~table['Gene2'].isin(missing_uniprot)]
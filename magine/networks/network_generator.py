@@ -1,17 +1,36 @@
 import os
 import networkx as nx
+import pandas as pd
 import magine.networks.utils as nt
 from magine.networks.databases import load_hmdb_network, load_biogrid_network, \
     load_signor, load_reactome_fi, load_kegg_mappings, load_all_of_kegg
-from magine.mappings.chemical_mapper import ChemicalMapper
-from magine.mappings.gene_mapper import GeneMapper
+from magine.mappings.maps import chemical_mapper
 
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
-cm = ChemicalMapper()
+
+def _main_accessions(species):
+    """ Replace HMDB secondary accessions with main accessions
+
+    Parameters
+    ----------
+    species : set
+
+    Returns
+    -------
+    set
+    """
+    species = pd.Series(sorted(species), dtype=object)
+    is_hmdb = species.str.startswith('HMDB')
+    if not is_hmdb.any():
+        return set(species)
+    main = chemical_mapper().convert(species[is_hmdb], 'accession',
+                                     'main_accession')
+    species[is_hmdb] = main.fillna(species[is_hmdb])
+    return set(species)
 
 
 def build_network(seed_species, species='hsa', save_name=None,
@@ -53,17 +72,7 @@ def build_network(seed_species, species='hsa', save_name=None,
 
     path_to_graph, node_to_path = load_kegg_mappings(species, verbose=False)
 
-    seed_species = set(x.upper() for x in seed_species)
-    updated_accession = set()
-    old_accession = set()
-    for i in seed_species:
-        if i.startswith('HMDB'):
-            if i in cm.hmdb_accession_to_main:
-                old_accession.add(i)
-                updated_accession.add(cm.hmdb_accession_to_main[i][0])
-
-    seed_species.difference_update(old_accession)
-    seed_species.update(updated_accession)
+    seed_species = _main_accessions(set(x.upper() for x in seed_species))
 
     seeds_in_kegg = seed_species.intersection(node_to_path)
 
@@ -85,13 +94,7 @@ def build_network(seed_species, species='hsa', save_name=None,
         all_measured_set = set(str(x).upper() for x in all_measured_list)
 
     all_measured_set.update(seed_species)
-    hmdb_ids = set(i for i in all_measured_set if i.startswith('HMDB'))
-    updated_accession = set()
-    old_accession = set()
-    for i in hmdb_ids:
-        if i in cm.hmdb_accession_to_main:
-            all_measured_set.remove(i)
-            all_measured_set.add(cm.hmdb_accession_to_main[i][0])
+    all_measured_set = _main_accessions(all_measured_set)
     networks_to_expand = []
 
     if use_hmdb:
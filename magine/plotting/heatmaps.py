@@ -1,5 +1,7 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import scipy.cluster.hierarchy as sch
+from scipy.spatial.distance import squareform
 import seaborn as sns
 
 
@@ -176,14 +178,40 @@ def heatmap_by_terms(data, terms, color_labels, colors=None,
     return fig
 
 
-def cluster_distance_mat(dist_mat, names, fig_size=(8, 8)):
-    # Compute and plot first dendrogram.
+def cluster_distance_mat(dist_mat, names, fig_size=(8, 8), max_labels=300):
+    """ Plot a clustered similarity matrix with a dendrogram
+
+    Parameters
+    ----------
+    dist_mat : np.array
+        Similarity scores between 0 and 1. Either condensed (as returned by
+        scipy.spatial.distance.pdist) or a square matrix.
+    names : list_like
+        Labels of each row
+    fig_size : tuple
+    max_labels : int
+        Tick labels are left out if there are more names than this, they
+        would overlap and drawing thousands of ticks is slow.
+
+    Returns
+    -------
+    matplotlib.Figure
+    """
+    dist_mat = np.asarray(dist_mat)
+    names = np.asarray(names)
+    if dist_mat.ndim == 1:
+        condensed = dist_mat
+        dist_mat = squareform(condensed)
+        np.fill_diagonal(dist_mat, 1)
+    else:
+        condensed = squareform(dist_mat, checks=False)
+
     fig = plt.figure(figsize=fig_size)
 
-    # Compute and plot second dendrogram.
+    # Compute and plot dendrogram, linkage uses 1 - similarity as distance
     ax2 = fig.add_axes([0.3, 0.71, 0.6, 0.2])
-    Y = sch.linkage(dist_mat, method='average')
-    Z2 = sch.dendrogram(Y)
+    Y = sch.linkage(1 - condensed.astype(np.float64), method='average')
+    Z2 = sch.dendrogram(Y, no_labels=True)
     ax2.set_xticks([])
     ax2.set_yticks([])
 
@@ -192,27 +220,30 @@ def cluster_distance_mat(dist_mat, names, fig_size=(8, 8)):
 
     # reorder matrix
     idx1 = Z2['leaves']
-    dist_mat = dist_mat[idx1, :]
-    dist_mat = dist_mat[:, idx1]
+    dist_mat = dist_mat[np.ix_(idx1, idx1)]
     names = names[idx1]
 
     # create figure
     im = axmatrix.matshow(dist_mat, aspect='auto', origin='lower',
                           cmap=plt.cm.Reds, vmin=0, vmax=1)
 
-    # add xtick labels
-    axmatrix.set_xticks(range(len(names)))
-    axmatrix.set_xticklabels(names, minor=False)
-    axmatrix.xaxis.set_label_position('bottom')
-    axmatrix.xaxis.tick_bottom()
-    plt.xticks(rotation=90, fontsize=8)
-
-    # add ytick labels
-    axmatrix.set_yticks(range(len(names)))
-    axmatrix.set_yticklabels(names, minor=False)
-    axmatrix.yaxis.set_label_position('left')
-    axmatrix.yaxis.tick_left()
-    plt.yticks(rotation=0, fontsize=8)
+    if len(names) > max_labels:
+        axmatrix.set_xticks([])
+        axmatrix.set_yticks([])
+    else:
+        # add xtick labels
+        axmatrix.set_xticks(range(len(names)))
+        axmatrix.set_xticklabels(names, minor=False)
+        axmatrix.xaxis.set_label_position('bottom')
+        axmatrix.xaxis.tick_bottom()
+        plt.xticks(rotation=90, fontsize=8)
+
+        # add ytick labels
+        axmatrix.set_yticks(range(len(names)))
+        axmatrix.set_yticklabels(names, minor=False)
+        axmatrix.yaxis.set_label_position('left')
+        axmatrix.yaxis.tick_left()
+        plt.yticks(rotation=0, fontsize=8)
 
     # add colorbar
     axcolor = fig.add_axes([0.94, 0.1, 0.02, 0.6])
@@ -0,0 +1,88 @@
+"""
+Benchmark import time of magine modules.
+
+Each module is imported in a fresh interpreter with ``python -X importtime``
+so previously imported modules do not hide its cost. Reports the wall time
+of the import and the modules with the largest cumulative import time, and
+checks that no mapper or KEGG client is created at import.
+
+Usage
+-----
+python -m magine.tests.benchmark_import --repeat 5 \
+    magine.mappings.maps magine.networks.network_generator
+"""
+import argparse
+import subprocess
+import sys
+
+import numpy as np
+
+default_modules = ['magine.mappings.maps',
+                   'magine.networks.databases.kegg_kgml',
+                   'magine.networks.network_generator']
+
+_check_lazy = """
+import sys, time
+st = time.time()
+import {module}
+total = time.time() - st
+import magine.mappings.maps as maps
+import magine.networks.databases.kegg_kgml as kegg_kgml
+print(total)
+print(maps._gene_mapper is None and maps._chemical_mapper is None
+      and kegg_kgml._kegg is None)
+print('bioservices' in sys.modules)
+"""
+
+
+def import_profile(module):
+    """ Import module in a new interpreter
+
+    Returns
+    -------
+    dict
+        time: wall time of the import (s), lazy: True if no mapper or KEGG
+        client was created, bioservices: True if bioservices was imported,
+        modules: list of (cumulative time (s), module name) of all imported
+        modules
+    """
+    out = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         _check_lazy.format(module=module)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True
+    )
+    modules = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((int(cumulative) / 1e6, name.strip()))
+    total, lazy, bioservices = out.stdout.split()[-3:]
+    return dict(time=float(total), lazy=lazy == 'True',
+                bioservices=bioservices == 'True', modules=modules)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('modules', nargs='*', default=default_modules)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of slowest imports to show')
+    args = parser.parse_args(args)
+
+    for module in args.modules:
+        runs = [import_profile(module) for _ in range(args.repeat)]
+        times = [i['time'] for i in runs]
+        print('{}: median {:.3f}s min {:.3f}s lazy mappers {} '
+              'bioservices imported {}'.format(
+                  module, np.median(times), np.min(times),
+                  all(i['lazy'] for i in runs),
+                  any(i['bioservices'] for i in runs)))
+        for cumulative, name in sorted(runs[-1]['modules'],
+                                       reverse=True)[:args.top]:
+            print('    {:8.3f}s  {}'.format(cumulative, name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""
+Local stand-in for the Enrichr web API.
+
+Serves the endpoints used by magine.enrichment.enrichr (/addList, /enrich
+and /geneSetLibrary) with enrichment computed locally from canned or
+synthetic gene set libraries. Latency and error rates are configurable, so
+client concurrency and retry behavior can be tested and tuned offline.
+
+Examples
+--------
+>>> from magine.enrichment.enrichr import Enrichr
+>>> server = EnrichrServer(latency=0.01).start()
+>>> e = Enrichr(url=server.url)
+>>> df = e.run(server.random_gene_list(50), 'KEGG_2016')
+>>> server.stop()
+"""
+import email
+import json
+import random
+import threading
+import time
+import zlib
+
+import numpy as np
+from scipy.stats import hypergeom
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:  # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+
+class _ThreadedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _fdr(p_values):
+    """ Benjamini/Hochberg adjusted p-values """
+    p_values = np.asarray(p_values, dtype=float)
+    n = len(p_values)
+    if n == 0:
+        return p_values
+    order = np.argsort(p_values)
+    ranked = p_values[order] * n / np.arange(1, n + 1)
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    adjusted = np.empty(n)
+    adjusted[order] = np.minimum(ranked, 1)
+    return adjusted
+
+
+class EnrichrServer(object):
+    """ Local HTTP server that mimics the Enrichr API
+
+    Parameters
+    ----------
+    libraries : dict, optional
+        Mapping of library name to dict of term name to list of genes.
+        Libraries that are not provided are generated on request, seeded by
+        library name, from a universe of genes named 'GENE0', 'GENE1', ...
+    latency : float
+        Seconds added to every request
+    jitter : float
+        Mean of exponentially distributed extra latency, in seconds
+    error_rate : float
+        Probability that a request fails with status 500
+    n_terms : int
+        Number of terms of generated libraries
+    n_genes : int
+        Size of the gene universe of generated libraries
+    seed : int
+    port : int
+        Port to listen on, default picks a free port
+    """
+
+    def __init__(self, libraries=None, latency=0., jitter=0., error_rate=0.,
+                 n_terms=300, n_genes=5000, seed=0, port=0):
+        self.libraries = dict()
+        for name, terms in (libraries or dict()).items():
+            self.libraries[name] = {t: frozenset(g) for t, g in terms.items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.n_terms = n_terms
+        self.n_genes = n_genes
+        self.seed = seed
+        self.port = port
+        self.requests = dict(addList=0, enrich=0, geneSetLibrary=0, errors=0)
+        self._lists = dict()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """ Base url to pass to Enrichr(url=...) """
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    def start(self):
+        """ Start serving in a background thread """
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stand_in._handle(self, 'GET')
+
+            def do_POST(self):
+                stand_in._handle(self, 'POST')
+
+        self._server = _ThreadedServer(('127.0.0.1', self.port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Shut down the server """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def random_gene_list(self, size):
+        """ Random genes from the universe of generated libraries """
+        ids = self._random.sample(range(self.n_genes), size)
+        return ['GENE{}'.format(i) for i in ids]
+
+    def library(self, name):
+        """ Terms of library name, generated on first use if needed """
+        with self._lock:
+            if name not in self.libraries:
+                rng = np.random.RandomState(
+                    (zlib.crc32(name.encode('utf-8')) + self.seed) % 2 ** 32
+                )
+                sizes = rng.randint(5, 300, size=self.n_terms)
+                self.libraries[name] = {
+                    '{} term {}'.format(name, n): frozenset(
+                        'GENE{}'.format(g) for g in
+                        rng.choice(self.n_genes, s, replace=False)
+                    )
+                    for n, s in enumerate(sizes)
+                }
+            return self.libraries[name]
+
+    def enrich(self, genes, lib_name):
+        """ Enrichr style rows for a gene list and library
+
+        Rows are [rank, term, p-value, z-score, combined score, overlapping
+        genes, adjusted p-value, old p-value, old adjusted p-value].
+        """
+        terms = self.library(lib_name)
+        genes = frozenset(genes)
+        universe = max(self.n_genes, len(frozenset().union(*terms.values())))
+        names, overlaps, sizes = [], [], []
+        for term, term_genes in terms.items():
+            hits = genes & term_genes
+            if hits:
+                names.append(term)
+                overlaps.append(sorted(hits))
+                sizes.append(len(term_genes))
+        if not names:
+            return []
+        n_hits = np.array([len(i) for i in overlaps])
+        sizes = np.array(sizes)
+        p_values = hypergeom.sf(n_hits - 1, universe, sizes, len(genes))
+        p_values = np.maximum(p_values, 1e-300)
+        expected = sizes * len(genes) / float(universe)
+        z_scores = -(n_hits - expected) / np.sqrt(expected + 1)
+        combined = np.log(p_values) * z_scores
+        adjusted = _fdr(p_values)
+        rows = []
+        for rank, i in enumerate(np.argsort(p_values, kind='stable')):
+            rows.append([rank + 1, names[i], float(p_values[i]),
+                         float(z_scores[i]), float(combined[i]), overlaps[i],
+                         float(adjusted[i]), 0, 0])
+        return rows
+
+    def _handle(self, handler, method):
+        with self._lock:
+            fail = self._random.random() < self.error_rate
+            delay = self.latency
+            if self.jitter:
+                delay += self._random.expovariate(1. / self.jitter)
+        if delay:
+            time.sleep(delay)
+        url = urlparse(handler.path)
+        endpoint = url.path.rstrip('/').rsplit('/', 1)[-1]
+        query = parse_qs(url.query, keep_blank_values=True)
+        if endpoint not in self.requests:
+            return self._respond(handler, 404, {})
+        with self._lock:
+            self.requests[endpoint] += 1
+            if fail:
+                self.requests['errors'] += 1
+        if fail:
+            return self._respond(handler, 500, {})
+
+        if endpoint == 'addList' and method == 'POST':
+            length = int(handler.headers.get('Content-Length', 0))
+            genes = self._parse_list(handler.headers.get('Content-Type'),
+                                     handler.rfile.read(length))
+            with self._lock:
+                list_id = len(self._lists) + 1
+                self._lists[list_id] = genes
+            return self._respond(handler, 200, dict(userListId=list_id,
+                                                    shortId=str(list_id)))
+        if endpoint == 'enrich':
+            lib_name = query['backgroundType'][0]
+            genes = self._lists.get(int(query['userListId'][0]))
+            if genes is None:
+                return self._respond(handler, 404, {})
+            return self._respond(handler, 200,
+                                 {lib_name: self.enrich(genes, lib_name)})
+        if endpoint == 'geneSetLibrary':
+            lib_name = query['libraryName'][0]
+            terms = {t: {g: 1.0 for g in genes}
+                     for t, genes in self.library(lib_name).items()}
+            return self._respond(handler, 200, {lib_name: dict(terms=terms)})
+        return self._respond(handler, 405, {})
+
+    @staticmethod
+    def _parse_list(content_type, body):
+        """ Gene list from the multipart form posted by Enrichr._add_gene_list
+        """
+        message = email.message_from_bytes(
+            'Content-Type: {}\r\n\r\n'.format(content_type).encode() + body
+        )
+        for part in message.get_payload():
+            if part.get_param('name', header='content-disposition') == 'list':
+                text = part.get_payload(decode=True).decode('utf-8')
+                return [g for g in text.splitlines() if g]
+        return []
+
+    @staticmethod
+    def _respond(handler, status, data):
+        body = json.dumps(data).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
@@ -1,7 +1,9 @@
 import os
+import warnings
 
 import matplotlib.figure
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 
 import magine.enrichment.enrichment_result as et
@@ -32,10 +34,43 @@ class TestEnrichmentResult(object):
         slimmed = self.data.filter_multi(p_value=0.05, combined_score=20)
         assert slimmed.shape == (20, 11)
 
+        step_by_step = self.data[self.data['adj_p_value'] <= 0.05]
+        step_by_step = step_by_step[step_by_step['rank'] <= 5]
+        step_by_step = step_by_step.filter_rows('sample_id', [1, 3])
+        slimmed = self.data.filter_multi(p_value=0.05, rank=5,
+                                         sample_id=[1, 3])
+        assert list(slimmed.index) == list(step_by_step.index)
+
+        # invalid single option does not filter
+        levels = self.data.levels('sample_id')
+        assert levels == set(self.data['sample_id'])
+        assert self.data.levels('sample_id') is levels
+        slimmed = self.data.filter_multi(sample_id='not a sample')
+        assert slimmed.shape == self.data.shape
+
     def test_term_to_gene(self):
         genes = self.data.term_to_genes('apoptotic process')
         assert genes == {'CASP8', 'CASP10', 'BCL2', 'BAX', 'CASP3'}
 
+    def test_term_gene_index(self):
+        index = self.data.term_gene_index
+        assert self.data.term_gene_index is index
+        assert index.genes('apoptotic process') == \
+            {'CASP8', 'CASP10', 'BCL2', 'BAX', 'CASP3'}
+        assert self.data.term_to_genes('not a term') == set()
+
+        copy_data = self.data.copy()
+        index = copy_data.term_gene_index
+        copy_data['genes'] = 'BAX'
+        assert copy_data.term_gene_index is not index
+        assert copy_data.term_to_genes('apoptotic process') == {'BAX'}
+
+        # values edited in place need an explicit reset
+        row = copy_data.index[copy_data['term_name'] == 'apoptotic process']
+        copy_data.loc[row, 'genes'] = 'CASP8'
+        copy_data.reset_term_gene_index()
+        assert copy_data.term_to_genes('apoptotic process') == {'CASP8'}
+
     def test_filter_based_on_word(self):
         slimmed = self.data.filter_based_on_words('apoptotic')
         assert slimmed.shape == (40, 11)
@@ -43,6 +78,35 @@ class TestEnrichmentResult(object):
         slimmed = self.data.filter_based_on_words('mitochondrial')
         assert slimmed.shape == (9, 11)
 
+        index = self.data.keyword_index
+        assert self.data.keyword_index is index
+        either = self.data.filter_based_on_words(['Apoptotic', 'regulation'])
+        both = self.data.filter_based_on_words(['apoptotic', 'regulation'],
+                                               how='all')
+        names = self.data['term_name'].str.lower()
+        has_both = names.str.contains('apoptotic') & \
+            names.str.contains('regulation')
+        assert both.shape[0] == has_both.sum()
+        assert either.shape[0] == (names.str.contains('apoptotic') |
+                                   names.str.contains('regulation')).sum()
+
+        # phrases spanning several words
+        phrase = self.data.filter_based_on_words('mitochondrial membrane')
+        assert phrase.shape[0] == \
+            names.str.contains('mitochondrial membrane').sum()
+
+    def test_keyword_index_missing_names(self):
+        names = ['apoptotic process', np.nan, 'cell cycle',
+                 'regulation of apoptotic process', np.nan, 'cell death']
+        index = et.TermKeywordIndex(names)
+        assert list(index.rows('apoptotic')) == [0, 3]
+        assert list(index.rows('cell')) == [2, 5]
+        assert list(index.rows('cycle')) == [2]
+        assert list(index.rows(['death', 'regulation'])) == [3, 5]
+        assert list(index.rows('nan')) == []
+        assert list(index.mask('pop')) == [True, False, False, True, False,
+                                           False]
+
     def test_all_genes(self):
         all_g = self.data.all_genes_from_df()
         assert all_g == {'CASP8', 'CASP10', 'BCL2', 'BAX', 'CASP3'}
@@ -74,6 +138,14 @@ class TestEnrichmentResult(object):
         assert isinstance(dist, matplotlib.figure.Figure)
         plt.close()
 
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            dist = self.data.dist_matrix(max_terms=10, dtype=np.float32)
+        assert len(w) == 1
+        assert 'max_terms=None' in str(w[0].message)
+        assert len(dist.axes[1].get_xticklabels()) == 10
+        plt.close()
+
     def test_find_similar_terms(self):
         sim = self.data.find_similar_terms('apoptotic process')
         print(sim)
@@ -84,3 +156,129 @@ class TestEnrichmentResult(object):
         score = self.data.jaccard_index(term1, term2)
 
         assert score == 0.6
+
+    def test_filter_sim_terms_approximate(self):
+        for level in ('sample', 'dataframe'):
+            exact = self.data.remove_redundant(level=level)
+            approx = self.data.remove_redundant(level=level, approximate=True,
+                                                seed=1)
+            assert approx.shape == exact.shape
+            assert set(approx['term_name']) == set(exact['term_name'])
+
+    def test_find_similar_terms_approximate(self):
+        sim = self.data.find_similar_terms('apoptotic process',
+                                           approximate=True, threshold=0.3,
+                                           recall_weight=0.95)
+        exact = self.data.find_similar_terms('apoptotic process')
+        exact = exact[exact['similarity_score'] > 0.3]
+        assert set(sim['term_name']) >= set(exact['term_name'])
+
+    def test_lsh_skips_empty_rows(self):
+        from magine.enrichment import similarity
+        genes = list(self.data['genes'].values)
+        matrix, _ = similarity.genes_to_matrix(genes + [np.nan] * 2000)
+        signatures = similarity.minhash_signatures(matrix, seed=1)
+        rows, cols = similarity.lsh_candidate_pairs(signatures, 16)
+        expected = similarity.lsh_candidate_pairs(signatures[:len(genes)], 16)
+        np.testing.assert_array_equal(rows, expected[0])
+        np.testing.assert_array_equal(cols, expected[1])
+        assert len(rows)
+        found, _ = similarity.query_candidates(matrix, len(genes), 0.5)
+        assert len(found) == 0
+
+    def test_compact_genes(self):
+        compact = self.data.compact_genes()
+        assert str(compact['genes'].dtype) == 'gene_list'
+        assert compact['genes'].iloc[0] == self.data['genes'].iloc[0]
+        assert compact.term_to_genes('apoptotic process') == \
+            self.data.term_to_genes('apoptotic process')
+
+        # round trip to comma separated strings
+        out = os.path.join(data_dir, 'Data', 'compact_genes_test.csv')
+        compact.to_csv(out, index=False)
+        loaded = et.load_enrichment_csv(out, dtype={'genes': 'gene_list'})
+        os.remove(out)
+        assert str(loaded['genes'].dtype) == 'gene_list'
+        assert list(loaded['genes'].astype(str)) == \
+            list(self.data['genes'].values)
+
+        assert compact.remove_redundant(level='sample').shape == (18, 11)
+
+        # values can be set, compact arrays do not share a vocabulary
+        compact.loc[compact.index[0], 'genes'] = 'NEW1,NEW2'
+        compact.iloc[1, list(compact.columns).index('genes')] = None
+        assert compact['genes'].iloc[0] == 'NEW1,NEW2'
+        assert compact['genes'].isnull().iloc[1]
+        assert str(compact['genes'].dtype) == 'gene_list'
+        other = self.data.compact_genes()
+        assert 'NEW1' not in other['genes'].values.vocabulary.names
+        both = pd.concat([compact, other])
+        assert list(both['genes'].astype(str).iloc[len(compact):]) == \
+            list(self.data['genes'].values)
+
+    def test_empirical_p_values(self):
+        background = ['G{}'.format(i) for i in range(200)]
+        term_genes = {'enriched': background[:20],
+                      'random': background[::10],
+                      'missing': ['X']}
+        genes = background[:10] + ['G150', 'NOT_MEASURED']
+        data = et.EnrichmentResult(
+            [['enriched', 'a', ','.join(background[:10])],
+             ['random', 'a', 'G0,G150'],
+             ['other', 'a', 'G1']],
+            columns=['term_name', 'sample_id', 'genes']
+        )
+        out = data.empirical_p_values({'a': genes}, background,
+                                      term_genes=term_genes,
+                                      n_permutations=500, seed=1)
+        p = out.set_index('term_name')['empirical_p_value']
+        assert p['enriched'] == 1. / 501
+        assert p['random'] > 0.05
+        assert np.isnan(p['other'])
+
+        # same results with multiple processes
+        out_2 = data.empirical_p_values(genes, background,
+                                        term_genes=term_genes,
+                                        n_permutations=500, seed=1,
+                                        processes=2)
+        np.testing.assert_array_equal(out['empirical_p_value'],
+                                      out_2['empirical_p_value'])
+
+        # no matching terms
+        for no_terms in ({}, {'missing': ['X']}):
+            out_3 = data.empirical_p_values(genes, background,
+                                            term_genes=no_terms)
+            assert out_3['empirical_p_value'].isnull().all()
+
+
+def test_pivot_export():
+    from magine.enrichment.pivot_export import pivot_chunks, \
+        write_pivot_excel, write_pivot_parquet
+    data = et.load_enrichment_csv(
+        os.path.join(data_dir, 'Data', 'enrichr_test_enrichr.csv')
+    )
+    data['db'] = 'KEGG_2016'
+    values = ['rank', 'adj_p_value', 'genes']
+    expected = pd.pivot_table(data, index=['term_name', 'db'],
+                              columns='sample_id', aggfunc='first',
+                              values=values)
+    chunked = pd.concat(list(pivot_chunks(data, values=values,
+                                          chunk_size=7)))
+    pd.testing.assert_frame_equal(chunked[expected.columns], expected,
+                                  check_names=False, check_dtype=False)
+
+    xlsx = os.path.join(data_dir, 'Data', 'pivot_test.xlsx')
+    parquet = os.path.join(data_dir, 'Data', 'pivot_test.parquet')
+    try:
+        write_pivot_excel(data, xlsx, values=values, chunk_size=7)
+        excel = pd.read_excel(xlsx, header=[0, 1], index_col=[0, 1])
+        assert excel.shape == expected.shape
+        write_pivot_parquet(data, parquet, values=values, chunk_size=7)
+        columnar = pd.read_parquet(parquet)
+        assert columnar.shape == (expected.shape[0], expected.shape[1] + 2)
+        assert list(columnar['genes_1'].fillna('')) == \
+            list(chunked['genes'][1].fillna(''))
+    finally:
+        for f in (xlsx, parquet):
+            if os.path.exists(f):
+                os.remove(f)
@@ -1,7 +1,59 @@
-from magine.enrichment.enrichr import Enrichr, clean_tf_names
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from magine.enrichment.enrichment_result import load_enrichment_csv, \
+    load_enrichment_dataset
+from magine.enrichment.enrichr import Enrichr, clean_term_names, \
+    clean_term_names_by_db, clean_tf_names, get_background_list
+from magine.enrichment.project import ProjectEnrichment
+from magine.tests.enrichr_server import EnrichrServer
 from magine.tests.sample_experimental_data import exp_data
 
-e = Enrichr()
+_test_csv = os.path.join(os.path.dirname(__file__), 'Data',
+                         'enrichr_test_enrichr.csv')
+
+
+def _go_library():
+    """ GO terms and genes of the Enrichr results saved in the test data """
+    data = load_enrichment_csv(_test_csv)
+    library = dict()
+    for term, term_id, genes in data[['term_name', 'term_id', 'genes']].values:
+        name = '{} ({})'.format(term, term_id)
+        library.setdefault(name, set()).update(genes.split(','))
+    return library
+
+
+_libraries = {
+    'GO_Biological_Process_2017': _go_library(),
+    'KEGG_2016': {
+        'Apoptosis_Homo sapiens_hsa04210': [
+            'BAX', 'BCL2', 'CASP3', 'CASP8', 'CASP10', 'BAK1', 'BID', 'FAS'
+        ],
+        'p53 signaling pathway_Homo sapiens_hsa04115': [
+            'BAX', 'CASP3', 'CASP8', 'BID', 'PMAIP1', 'CYCS', 'APAF1'
+        ],
+    },
+    'NCI-Nature_2016': {
+        'Caspase cascade in apoptosis_Homo sapiens_caspase': [
+            'CASP3', 'CASP6', 'CASP8', 'CASP10', 'XIAP', 'PARP1'
+        ],
+    },
+    'ARCHS4_TFs_Coexp': {
+        'TP53_human_tf_ARCHS4_coexpression': ['BAX', 'MCL1', 'BCL2'],
+    },
+    'ChEA_2016': {
+        'E2F1_18555785_ChIP-Seq_MESC_Mouse': ['BAX', 'BCL2', 'CASP3'],
+    },
+}
+
+# all tests run against a local stand-in of the Enrichr API
+server = EnrichrServer(libraries=_libraries).start()
+e = Enrichr(url=server.url)
 
 
 def test_single_run():
@@ -10,8 +62,12 @@ def test_single_run():
               'BID', 'PMAIP1', 'MCL1', 'BCL2', 'BCL2L1', 'BAX', 'BAK1',
               'DIABLO', 'CYCS', 'PARP1', 'APAF1', 'XIAP']
     df = e.run(list_2, 'GO_Biological_Process_2017')
-    terms = df['term_name']
-    assert len(terms) == 185
+    assert df.shape == (85, 9)
+    assert df['term_name'].nunique() == 85
+    top = df.iloc[0]
+    assert top['term_name'] == 'apoptotic process'
+    assert top['genes'] == 'BAX,BCL2,CASP3,CASP8'
+    assert top['n_genes'] == 4
 
 
 def test_multi_sample():
@@ -21,6 +77,10 @@ def test_multi_sample():
              ['BIM', 'CASP3']]
     df2 = e.run_samples(lists, ['1', '2', '3'], save_name='enrichr_test')
     assert df2.shape == (111, 10)
+    assert df2.groupby('sample_id').size().to_dict() == \
+        {'1': 65, '2': 29, '3': 17}
+    assert df2['term_name'].nunique() == 85
+    assert (df2.groupby('term_name')['adj_p_value'].min() <= 0.05).all()
 
 
 def test_multi_sample_plotting():
@@ -39,15 +99,162 @@ def test_set_of_dbs():
     df2 = e.run_samples(lists, ['1', '2', '3'],
                         database=['KEGG_2016', 'NCI-Nature_2016'],
                         save_name='t')
-    assert df2.shape == (128, 10)
+    assert df2.shape == (9, 10)
+    kegg = {'apoptosis_hsa_hsa04210', 'p53 signaling pathway_hsa_hsa04115'}
+    nci = {'caspase cascade in apoptosis_hsa_caspase'}
+    for sample in ['1', '2', '3']:
+        rows = df2[df2['sample_id'] == sample]
+        assert set(rows.loc[rows['db'] == 'KEGG_2016', 'term_name']) == kegg
+        assert set(rows.loc[rows['db'] == 'NCI-Nature_2016',
+                            'term_name']) == nci
+
+
+def test_pivot_format():
+    with pytest.raises(ValueError, match='pivot_format'):
+        e.run_samples([['BAX', 'BCL2']], ['1'], save_name='t', pivot=True,
+                      pivot_format='csv')
 
 
 def test_tf_names():
     df = e.run(['BAX', 'BCL2', 'MCL1'], ['ARCHS4_TFs_Coexp', 'ChEA_2016'])
     tfs = clean_tf_names(df)
+    assert set(tfs['term_name']) == {'TP53', 'E2F1'}
     for i in tfs['term_name']:
         assert '_' not in i
 
 
+def test_filter_sig_across_term():
+    data = load_enrichment_csv(_test_csv)
+    data['db'] = 'GO_Biological_Process_2017'
+    is_term = data['term_name'] == 'apoptotic process'
+    data.loc[is_term, 'adj_p_value'] = 0.5
+    filtered = Enrichr._filter_sig_across_term(data, p_value_thresh=0.05)
+    assert 'apoptotic process' not in set(filtered['term_name'])
+    assert filtered.shape[0] == data.shape[0] - is_term.sum()
+    assert (filtered.groupby('term_name')['adj_p_value'].min() <= 0.05).all()
+
+
+def test_clean_term_names():
+    df = pd.DataFrame(
+        [['apoptotic process (GO:0006915)', 'GO_Biological_Process_2017b'],
+         ['MP:0001_abnormal survival', 'MGI_Mammalian_Phenotype_2017'],
+         ['trichostatin A-6223', 'Old_CMAP_up'],
+         ['Apoptosis_Homo sapiens_hsa04210', 'KEGG_2016'],
+         ['apoptotic process (GO:0006915)', 'GO_Biological_Process_2017b']],
+        columns=['term_name', 'db']
+    )
+    expected = ['apoptotic process', 'abnormal survival', 'trichostatin a',
+                'apoptosis_hsa_hsa04210', 'apoptotic process']
+    assert list(clean_term_names_by_db(df)) == expected
+    assert [clean_term_names(row) for _, row in df.iterrows()] == expected
+
+    # rows without a db still get the generic cleaning
+    df.loc[3, 'db'] = np.nan
+    assert clean_term_names_by_db(df)[3] == 'apoptosis_hsa_hsa04210'
+    assert clean_term_names(df.loc[3]) == 'apoptosis_hsa_hsa04210'
+
+    for name, db in [('MP:0001', 'MGI_Mammalian_Phenotype_2017'),
+                     ('no direction', 'DrugMatrix'),
+                     ('BRD-A1', 'LINCS_L1000_Chem_Pert_up')]:
+        bad = pd.DataFrame({'term_name': [name], 'db': [db]})
+        with pytest.raises(ValueError, match=name):
+            clean_term_names_by_db(bad)
+        with pytest.raises(ValueError, match=name):
+            clean_term_names(bad.iloc[0])
+
+
+class _OfflineEnrichr(Enrichr):
+    """ Returns rows of the test csv that overlap with the gene list """
+    data = load_enrichment_csv(_test_csv)
+    fail_on = None
+
+    def run(self, list_of_genes, gene_set_lib='GO_Biological_Process_2017'):
+        if self.fail_on in list_of_genes:
+            raise ValueError('failed')
+        hits = self.data['genes'].apply(
+            lambda g: bool(set(g.split(',')) & set(list_of_genes))
+        )
+        df = self.data.loc[hits].drop_duplicates('term_name').copy()
+        df['db'] = gene_set_lib[0]
+        return df
+
+
+def test_project_runner():
+    out_dir = tempfile.mkdtemp()
+    tasks = [dict(category='up', sample_id=1, genes=['BAX', 'BCL2']),
+             dict(category='up', sample_id=2, genes=['CASP8']),
+             dict(category='down', sample_id=1, genes=['CASP3']),
+             dict(category='down', sample_id=2, genes=[])]
+    enrichr = _OfflineEnrichr()
+    enrichr.fail_on = 'CASP8'
+    try:
+        runner = ProjectEnrichment(tasks, 'test', out_dir=out_dir,
+                                   databases=['KEGG_2016'], enrichr=enrichr)
+        assert runner.run() == ['up|2']
+        assert len(runner.pending) == 1
+
+        # resume only runs the failed task
+        enrichr.fail_on = None
+        runner = ProjectEnrichment(tasks, 'test', out_dir=out_dir,
+                                   databases=['KEGG_2016'], enrichr=enrichr)
+        assert len(runner.pending) == 1
+        assert runner.run() == []
+        assert len(runner.pending) == 0
+
+        all_data = load_enrichment_dataset(runner.path)
+        assert set(all_data['category']) == {'up', 'down'}
+        up_2 = runner.load(category='up', sample_id=2)
+        assert set(up_2['sample_id']) == {2}
+        assert up_2.shape[0] == (all_data['sample_id'] == 2).sum()
+
+        # a task without results removes the results of the previous run,
+        # removed tasks are deleted and files not in the manifest ignored
+        stray = os.path.dirname(runner._partition_file('up', 9))
+        os.makedirs(stray)
+        all_data.to_parquet(os.path.join(stray, 'part-0.parquet'))
+        tasks = [dict(category='up', sample_id=1, genes=['NOT_A_GENE']),
+                 dict(category='down', sample_id=1, genes=['CASP3'])]
+        runner = ProjectEnrichment(tasks, 'test', out_dir=out_dir,
+                                   databases=['KEGG_2016'], enrichr=enrichr)
+        assert runner.run() == []
+        assert not os.path.exists(runner._partition_file('up', 1))
+        assert not os.path.exists(runner._partition_file('up', 2))
+        assert set(runner.manifest) == {'up|1', 'down|1'}
+        loaded = runner.load()
+        assert set(loaded['category']) == {'down'}
+        assert loaded.shape[0] == \
+            (all_data['category'] == 'down').sum()
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_local_server():
+    library = {'apoptosis': ['BAX', 'BCL2', 'CASP3', 'CASP8'],
+               'cell cycle': ['CDK1', 'CDK2', 'CCNB1'],
+               'caspases': ['CASP3', 'CASP8', 'CASP10']}
+    with EnrichrServer(libraries={'KEGG_2016': library},
+                       error_rate=0.3) as server:
+        local = Enrichr(url=server.url, max_retries=20, retry_wait=0.01)
+        lists = [['BAX', 'BCL2', 'CASP3'], ['CASP10', 'CASP8'], ['CDK1']]
+        df = local.run_samples(lists, ['1', '2', '3'], database='KEGG_2016')
+        assert set(df['sample_id']) == {'1', '2', '3'}
+        assert set(df.loc[df['sample_id'] == '3', 'term_name']) == \
+            {'cell cycle'}
+        apoptosis = df[(df['sample_id'] == '1') &
+                       (df['term_name'] == 'apoptosis')]
+        assert apoptosis['genes'].iloc[0] == 'BAX,BCL2,CASP3'
+        assert server.requests['errors'] > 0
+
+        server.error_rate = 0.
+        background = get_background_list('KEGG_2016', url=server.url)
+        assert {i['term'] for i in background} == set(library)
+
+        # gives up after max_retries
+        server.error_rate = 1.
+        local.max_retries = 1
+        with pytest.raises(Exception, match='after 1 retries'):
+            local.run(['BAX'], 'KEGG_2016')
+
+
 if __name__ == '__main__':
     test_single_run()
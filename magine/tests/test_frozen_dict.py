@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+import pandas as pd
+
+from magine.mappings.frozen_dict import FrozenSetDict, match_input
+
+data = pd.DataFrame({'accession': ['HMDB3', ' HMDB1 ', 'HMDB2', 'HMDB3', None],
+                     'proteins': ['P1|P2', 'P3', None, 'P2|P4', 'P5'],
+                     'gene_id': [3, 1, 2, 3, 5]})
+
+
+def test_frozen_set_dict():
+    d = FrozenSetDict.from_frame(data, 'accession', 'proteins', sep='|',
+                                 strip_keys=True)
+    assert list(d) == ['HMDB1', 'HMDB3']
+    assert d['HMDB3'] == {'P1', 'P2', 'P4'}
+    assert d['HMDB3'][0] == 'P1'
+    assert 'HMDB2' not in d
+    assert 3 not in d
+    assert list(d.positions(['HMDB3', 'HMDB9'])) == [1, -1]
+
+    by_id = FrozenSetDict.from_frame(data, 'gene_id', 'accession',
+                                     overrides={2: 'HMDB9'})
+    assert list(by_id) == [1, 2, 3]
+    assert by_id[2] == {'HMDB9'}
+    assert 'HMDB3' not in by_id
+
+    file_name = os.path.join(tempfile.mkdtemp(), 'mapping.npz')
+    for mapping in [d, by_id]:
+        mapping.save(file_name, source='test')
+        loaded = FrozenSetDict.load(file_name, source='test')
+        assert dict(loaded) == dict(mapping)
+        assert FrozenSetDict.load(file_name, source='other') is None
+    os.remove(file_name)
+
+
+def test_convert():
+    d = FrozenSetDict.from_frame(data, 'accession', 'proteins', sep='|',
+                                 strip_keys=True)
+    ids = pd.Series(['HMDB3', 'HMDB9', 'HMDB1'], index=[5, 6, 7])
+    assert list(d.convert(ids)) == ['P1', None, 'P3']
+    assert list(d.convert(ids, how='all')) == [['P1', 'P2', 'P4'], None,
+                                               ['P3']]
+    converted = match_input(ids, d.convert(ids), name='proteins')
+    assert list(converted.index) == [5, 6, 7]
+    assert converted.name == 'proteins'
+    assert match_input(list(ids), d.convert(list(ids))) == ['P1', None, 'P3']
+    try:
+        d.convert(ids, how='last')
+        assert False
+    except ValueError:
+        pass
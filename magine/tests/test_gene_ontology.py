@@ -0,0 +1,54 @@
+import pandas as pd
+
+import magine.mappings.maps as maps
+from magine.enrichment.deprecated.databases.gene_ontology import \
+    download_ncbi_gene_file
+
+
+class _Mapper(object):
+    ncbi_to_symbol = {1: ['BAX'], 2: ['BCL2'], 3: ['CASP3', 'CASP3P']}
+
+
+rows = [
+    # tax_id, GeneID, GO_ID, Evidence, Qualifier, GO_term
+    [9606, 1, 'GO:0006915', 'IDA', 'involved_in', 'apoptotic process'],
+    [9606, 1, 'GO:0006915', 'IEA', 'involved_in', 'apoptotic process'],
+    [9606, 2, 'GO:0006915', 'TAS', '-', 'apoptotic process'],
+    [9606, 2, 'GO:0005739', 'IDA', 'located_in', 'mitochondrion'],
+    [9606, 3, 'GO:0008283', 'IMP', 'involved_in', 'cell proliferation'],
+    # filtered: negated, no data, other species, unknown gene
+    [9606, 1, 'GO:0005739', 'IDA', 'NOT', 'mitochondrion'],
+    [9606, 2, 'GO:0008150', 'ND', 'involved_in', 'biological_process'],
+    [10090, 1, 'GO:0007049', 'IDA', 'involved_in', 'cell cycle'],
+    [9606, 99, 'GO:0007049', 'IDA', 'involved_in', 'cell cycle'],
+]
+
+
+def test_download_ncbi_gene_file(tmpdir, monkeypatch, capsys):
+    source = str(tmpdir.join('gene2go.gz'))
+    data = pd.DataFrame(rows, columns=['#tax_id', 'GeneID', 'GO_ID',
+                                       'Evidence', 'Qualifier', 'GO_term'])
+    data['PubMed'] = '-'
+    data['Category'] = 'Process'
+    data.to_csv(source, sep='\t', index=False, compression='gzip')
+    monkeypatch.setattr(maps, 'gene_mapper', _Mapper)
+
+    for chunk_size in (2, 100):
+        id2gos, go2genes, go2term = download_ncbi_gene_file(
+            source=source, chunk_size=chunk_size)
+        assert dict(go2genes) == {'GO:0006915': {'BAX', 'BCL2'},
+                                  'GO:0005739': {'BCL2'},
+                                  'GO:0008283': {'CASP3'}}
+        assert dict(id2gos) == {'BAX': {'GO:0006915'},
+                                'BCL2': {'GO:0006915', 'GO:0005739'},
+                                'CASP3': {'GO:0008283'}}
+        assert go2term == {'GO:0006915': 'apoptotic process',
+                           'GO:0005739': 'mitochondrion',
+                           'GO:0008283': 'cell proliferation'}
+        out = capsys.readouterr().out
+        assert '1 NCBI gene ids have more than one symbol' in out
+        assert 'CASP3P' not in out
+
+    id2gos, go2genes, go2term = download_ncbi_gene_file(
+        tax_ids=[10090], source=source)
+    assert dict(go2genes) == {'GO:0007049': {'BAX'}}
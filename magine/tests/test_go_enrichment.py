@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from scipy.stats import binom
+from statsmodels.stats.multitest import fdrcorrection
+
+import magine.enrichment.deprecated.ontology_analysis as oa
+from magine.enrichment.deprecated.go_store import write_go_store
+
+
+def _annotation(n_terms=40, n_genes=200, seed=0):
+    rng = np.random.RandomState(seed)
+    genes = ['GENE{}'.format(i) for i in range(n_genes)]
+    go_to_gene = dict()
+    for n in range(n_terms):
+        size = rng.randint(1, 30)
+        go_to_gene['GO:{:07d}'.format(n + 1)] = set(
+            rng.choice(genes, size, replace=False)
+        )
+    go_to_name = {i: 'term {}'.format(i) for i in go_to_gene}
+    go_depth = {i: 1 for i in go_to_gene}
+    go_aspect = {i: 'biological_process' for i in go_to_gene}
+    return go_to_gene, go_to_name, go_depth, go_aspect
+
+
+def _per_term(go_to_gene, genes, reference, use_fdr=True):
+    """ Enrichment of each term with a scalar binom.sf """
+    genes = set(genes)
+    terms, p_values, hits, n_refs = [], [], [], []
+    for term, term_genes in sorted(go_to_gene.items()):
+        mapped = genes & term_genes
+        if not mapped:
+            continue
+        n_ref = len(term_genes & set(reference))
+        terms.append(term)
+        hits.append(sorted(mapped))
+        n_refs.append(n_ref)
+        p_values.append(binom.sf(len(mapped) - 1, len(genes),
+                                 n_ref / float(len(reference))))
+    if use_fdr and p_values:
+        p_values = list(fdrcorrection(p_values)[1])
+    return {t: (h, p, r) for t, h, p, r in zip(terms, hits, p_values, n_refs)}
+
+
+def test_batch_matches_per_term(monkeypatch):
+    out_dir = tempfile.mkdtemp()
+    file_name = os.path.join(out_dir, 'test_go.store')
+    go_to_gene = _annotation()[0]
+    write_go_store(file_name, *_annotation())
+    monkeypatch.setattr(oa, 'go_store_path', lambda species: file_name)
+    try:
+        mg = oa.MagineGO('test')
+        all_genes = sorted(set.union(*go_to_gene.values()))
+        rng = np.random.RandomState(1)
+        gene_lists = [list(rng.choice(all_genes, size, replace=False))
+                      for size in (5, 20, 60)]
+        gene_lists.append(['GENE1', 'GENE2', 'NOT_A_GENE'])
+        reference = all_genes[::2]
+
+        for ref in (None, reference):
+            for use_fdr in (True, False):
+                batch = mg.calculate_enrichment_batch(gene_lists, ref,
+                                                      use_fdr=use_fdr)
+                for genes, res in zip(gene_lists, batch):
+                    expected = _per_term(go_to_gene, genes,
+                                         ref or all_genes, use_fdr)
+                    assert set(res) == set(expected)
+                    for term, (hits, p, n_ref) in expected.items():
+                        assert sorted(res[term][0]) == hits
+                        np.testing.assert_allclose(res[term][1], p)
+                        assert res[term][2] == n_ref
+
+        assert mg.calculate_enrichment(gene_lists[0]) == \
+            mg.calculate_enrichment_batch(gene_lists[:1])[0]
+        assert list(mg.term_ids) == sorted(go_to_gene)
+        assert mg.term_matrix.shape == (len(mg.term_ids), len(mg.gene_index))
+        del mg
+    finally:
+        shutil.rmtree(out_dir)
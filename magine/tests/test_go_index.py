@@ -0,0 +1,79 @@
+import numpy as np
+
+from magine.enrichment.deprecated.go_index import GOIndex
+
+
+class Term(object):
+    def __init__(self, go_id, parents):
+        self.id = go_id
+        self.parents = parents
+        self.depth = max([p.depth + 1 for p in parents] or [0])
+        self.level = min([p.level + 1 for p in parents] or [0])
+
+
+#      root      other_root
+#     /    \
+#    a      b
+#    | \  /
+#    c   d
+root = Term('GO:0000001', [])
+a = Term('GO:0000002', [root])
+b = Term('GO:0000003', [root])
+c = Term('GO:0000004', [a])
+d = Term('GO:0000005', [a, b])
+other_root = Term('GO:0000006', [])
+go = {t.id: t for t in (root, a, b, c, d, other_root)}
+# alternative id of d
+go['GO:0000007'] = d
+
+
+def test_go_index():
+    index = GOIndex(go)
+    assert len(index) == 6
+    assert 'GO:0000007' in index
+    assert set(index.ids[index.ancestor_positions(d.id)]) == \
+        {root.id, a.id, b.id, d.id}
+    assert index.common_ancestors([c.id, d.id]) == {root.id, a.id}
+    assert index.deepest_common_ancestor([c.id, d.id]) == a.id
+    assert index.deepest_common_ancestor([b.id, 'GO:0000007']) == b.id
+
+    terms = [c.id, d.id, b.id, other_root.id]
+    lengths = index.min_branch_lengths(terms)
+    assert lengths[0, 1] == 2
+    assert lengths[0, 2] == 3
+    assert lengths[1, 2] == 1
+    assert lengths[0, 3] == -1
+    np.testing.assert_array_equal(lengths, lengths.T)
+
+    is_ancestor = index.is_ancestor(terms)
+    assert is_ancestor[1, 2]
+    assert not is_ancestor[2, 1]
+    assert not is_ancestor[0, 1]
+
+    assert set(index.path_edges(d.id)) == {(root.id, a.id), (root.id, b.id),
+                                           (a.id, d.id), (b.id, d.id)}
+
+
+def test_pairwise_common():
+    # two chains longer than a byte of packed ancestors, joined at the root
+    terms = [root]
+    for branch in range(2):
+        parent = root
+        for n in range(12):
+            parent = Term('GO:1{}{:05d}'.format(branch, n), [parent])
+            terms.append(parent)
+    terms.append(Term('GO:2000000', [terms[5], terms[-1]]))
+    terms.append(other_root)
+    index = GOIndex({t.id: t for t in terms})
+    ids = [t.id for t in terms]
+
+    expected = np.full((len(ids), len(ids)), -1, dtype=np.int64)
+    for i, j in np.ndindex(*expected.shape):
+        if other_root.id not in (ids[i], ids[j]) or ids[i] == ids[j]:
+            expected[i, j] = index.positions(
+                [index.deepest_common_ancestor([ids[i], ids[j]])])[0]
+    for chunk_size in (None, 1, 5):
+        np.testing.assert_array_equal(
+            index.pairwise_common(ids, chunk_size=chunk_size), expected)
+    np.testing.assert_array_equal(
+        index.pairwise_common(ids[:4], others=ids), expected[:4])
@@ -0,0 +1,54 @@
+import os
+import tempfile
+
+from magine.enrichment.deprecated.go_store import GOStore, write_go_store
+
+go_to_gene = {'GO:0006915': {'BAX', 'BCL2', 'CASP3'},
+              'GO:0008283': {'CDK1', 'BAX'},
+              'GO:0005739': {'BCL2'}}
+go_to_name = {'GO:0006915': 'apoptotic process',
+              'GO:0008283': 'cell proliferation',
+              'GO:0005739': 'mitochondrion'}
+go_depth = {'GO:0006915': 4, 'GO:0008283': 2, 'GO:0005739': 5}
+go_aspect = {'GO:0006915': 'biological_process',
+             'GO:0008283': 'biological_process',
+             'GO:0005739': 'cellular_component'}
+
+
+def test_go_store():
+    file_name = os.path.join(tempfile.mkdtemp(), 'hsa_go.store')
+    write_go_store(file_name, go_to_gene, go_to_name, go_depth, go_aspect)
+    store = GOStore(file_name)
+    try:
+        assert dict(store.go_to_gene) == go_to_gene
+        assert dict(store.go_to_name) == go_to_name
+        assert dict(store.go_depth) == go_depth
+        assert dict(store.go_aspect) == go_aspect
+        assert store.gene_to_go['BAX'] == {'GO:0006915', 'GO:0008283'}
+        assert set(store.gene_to_go) == {'BAX', 'BCL2', 'CASP3', 'CDK1'}
+        assert 'GO:0000001' not in store.go_to_gene
+        assert 'not a gene' not in store.gene_to_go
+        assert list(store.term_ids) == sorted(go_to_gene)
+        for info in store.header['arrays'].values():
+            assert (store.header['data_offset'] + info['offset']) % 64 == 0
+    finally:
+        del store
+        os.remove(file_name)
+
+
+def test_go_store_names():
+    # names with newlines and a header long enough to span several blocks
+    names = {i: 'line one\nline two of {}'.format(i) for i in go_to_gene}
+    species = 'x' * 5000
+    file_name = os.path.join(tempfile.mkdtemp(), 'x_go.store')
+    write_go_store(file_name, go_to_gene, names, go_depth, go_aspect,
+                   species=species)
+    store = GOStore(file_name)
+    try:
+        assert store.header['species'] == species
+        assert dict(store.go_to_name) == names
+        assert dict(store.go_to_gene) == go_to_gene
+        assert dict(store.go_depth) == go_depth
+    finally:
+        del store
+        os.remove(file_name)
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+import magine.mappings.chemical_mapper as cm
+
+hmdb = pd.DataFrame({
+    'accession': ['HMDB0000001', 'HMDB0000002', 'HMDB0000003'],
+    'name': ['1-Methylhistidine', '1,3-Diaminopropane', 'Ethanol'],
+    'secondary_accessions': ['HMDB00001|HMDB0004935', None, 'HMDB00003'],
+    'kegg_id': ['C01152', 'C00986', None],
+})
+
+expected = {
+    'HMDB0000001': 'HMDB0000001', 'HMDB00001': 'HMDB0000001',
+    'HMDB0004935': 'HMDB0000001', 'HMDB0000002': 'HMDB0000002',
+    'HMDB0000003': 'HMDB0000003', 'HMDB00003': 'HMDB0000003',
+}
+
+
+def _main_accessions(data):
+    return dict(zip(data['accession'], data['main_accession']))
+
+
+def test_hmdb_cache(tmpdir):
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+    source = str(tmpdir.join('hmdb_dataframe.csv.gz'))
+    cache = str(tmpdir.join('hmdb_dataframe.parquet'))
+    hmdb.to_csv(source, index=False, compression='gzip')
+
+    assert cm._hmdb_cache(source, cache) == cache
+    data = pq.read_table(cache).to_pandas()
+    assert len(data) == 6
+    assert _main_accessions(data) == expected
+    assert set(data.loc[data['main_accession'] == 'HMDB0000001',
+                        'kegg_id']) == {'C01152'}
+
+    # unchanged source is not rewritten
+    mtime = os.stat(cache).st_mtime_ns
+    assert cm._hmdb_cache(source, cache) == cache
+    assert os.stat(cache).st_mtime_ns == mtime
+
+    # a changed source rebuilds the cache
+    changed = hmdb.copy()
+    changed.loc[1, 'secondary_accessions'] = 'HMDB00002'
+    changed.to_csv(source, index=False, compression='gzip')
+    assert cm._hmdb_cache(source, cache) == cache
+    data = pq.read_table(cache).to_pandas()
+    assert _main_accessions(data) == dict(expected,
+                                          HMDB00002='HMDB0000002')
+
+
+def test_read_hmdb_csv(tmpdir, monkeypatch):
+    source = str(tmpdir.join('hmdb_dataframe.csv.gz'))
+    hmdb.to_csv(source, index=False, compression='gzip')
+
+    # without pyarrow there is no cache, columns are read from the csv
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    monkeypatch.setitem(sys.modules, 'pyarrow.parquet', None)
+    assert cm._hmdb_cache(source, str(tmpdir.join('hmdb.parquet'))) is None
+    assert not tmpdir.join('hmdb.parquet').exists()
+
+    data = cm._read_hmdb_csv(source, ['accession', 'main_accession', 'name'])
+    assert list(data.columns) == ['accession', 'main_accession', 'name']
+    assert _main_accessions(data) == expected
+    assert list(data.loc[data['accession'] == 'HMDB0004935', 'name']) == \
+        ['1-Methylhistidine']
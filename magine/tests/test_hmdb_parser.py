@@ -0,0 +1,60 @@
+import io
+import os
+import tempfile
+
+import pandas as pd
+
+from magine.mappings.databases.download_libraries import metabolite_chunks, \
+    parse_metabolites, write_batches
+
+metabolite = u"""
+  <metabolite>
+    <accession>HMDB000000{0}</accession>
+    <secondary_accessions><accession>HMDB0{0}</accession></secondary_accessions>
+    <name>Metabolite {0}</name>
+    <taxonomy><name>not the name</name></taxonomy>
+    <synonyms><synonym>a &amp; b</synonym><synonym>c{0}</synonym></synonyms>
+    <chemical_formula>C{0}</chemical_formula>
+    <average_molecular_weight>1{0}.5</average_molecular_weight>
+    <iupac_name/><smiles/><inchikey/><kegg_id>C0000{0}</kegg_id>
+    <chebi_id/><chemspider_id/><biocyc_id/><pubchem_compound_id/>
+    <drugbank_id/><metlin_id/>
+    <ontology><biofunctions><biofunction>bf</biofunction></biofunctions>
+    </ontology>
+    <protein_associations><protein><gene_name>G{0}</gene_name></protein>
+    <protein><gene_name/></protein></protein_associations>
+  </metabolite>"""
+
+
+def test_parse_hmdb():
+    file_name = os.path.join(tempfile.mkdtemp(), 'hmdb.xml')
+    with io.open(file_name, 'w', encoding='utf-8') as f:
+        f.write(u'<?xml version="1.0" encoding="UTF-8"?>\n'
+                u'<hmdb xmlns="http://www.hmdb.ca">')
+        f.write(u''.join(metabolite.format(i) for i in range(5)))
+        f.write(u'\n</hmdb>\n')
+
+    chunks = list(metabolite_chunks(file_name, chunk_size=1000))
+    assert len(chunks) > 1
+    assert b''.join(chunks).count(b'<metabolite>') == 5
+
+    df = parse_metabolites(b''.join(chunks))
+    assert list(df['accession']) == ['HMDB000000{}'.format(i)
+                                     for i in range(5)]
+    row = df.iloc[1]
+    assert row['name'] == 'Metabolite 1'
+    assert row['synonyms'] == 'a & b|c1'
+    assert row['protein_associations'] == 'G1'
+    assert row['secondary_accessions'] == 'HMDB01'
+    assert row['biofunction'] == 'bf'
+    assert row['cellular_locations'] == ''
+
+    for processes in [1, 2]:
+        out = io.StringIO()
+        assert write_batches(out, [file_name], processes, chunk_size=1000) \
+            == 5
+        out.seek(0)
+        written = pd.read_csv(out)
+        assert list(written.columns) == list(df.columns)
+        assert list(written['name']) == list(df['name'])
+    os.remove(file_name)
@@ -0,0 +1,8 @@
+from magine.tests.benchmark_import import default_modules, import_profile
+
+
+def test_lazy_mappers():
+    for module in default_modules:
+        profile = import_profile(module)
+        assert profile['lazy'], module
+        assert not profile['bioservices'], module
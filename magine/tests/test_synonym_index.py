@@ -0,0 +1,33 @@
+import pandas as pd
+
+from magine.mappings.synonym_index import SynonymIndex
+
+synonyms = pd.Series(['dodecene|1-dodecene', None, 'cis-2-dodecene',
+                      'glucose|dextrose', 'glucose'], index=[4, 3, 2, 1, 0])
+
+
+def test_synonym_index():
+    index = SynonymIndex.from_series(synonyms)
+    assert list(index.exact('glucose')) == [3, 4]
+    assert list(index.exact('gluc')) == []
+    assert list(index.prefix('gluc')) == [3, 4]
+    assert list(index.prefix('dodecene')) == [0]
+    assert list(index.search('dodecene')) == [0, 2]
+    assert list(index.search('2-d')) == [2]
+    assert list(index.search('e')) == [0, 2, 3, 4]
+    assert list(index.search('xyz')) == []
+    assert [list(i) for i in index.exact_many(['dextrose', 'sugar'])] == \
+        [[3], []]
+    assert [list(i) for i in index.search_many(['dextro', 'ne|1'])] == \
+        [[3], []]
+
+
+def test_short_terms():
+    names = pd.Series([u'café|tea', u'naïve', 'ab|ba', None, 'a'])
+    index = SynonymIndex.from_series(names)
+    for term in ['a', u'é', 'ab', 'b', u'ï', 'z', '', 'e|', 'tea', 'af']:
+        expected = [n for n, i in enumerate(names) if isinstance(i, str)
+                    and any(term in j for j in i.split('|'))]
+        assert list(index.search(term)) == expected, term
+    assert [list(i) for i in index.search_many(['a', 'z', 'a'])] == \
+        [[0, 1, 2, 4], [], [0, 1, 2, 4]]
@@ -0,0 +1,148 @@
+import itertools
+import os
+
+import numpy as np
+import pytest
+
+import magine.enrichment.deprecated.ontology_tools as ot
+from magine.enrichment.deprecated.go_store import GOStore, write_go_store
+
+# two aspects under the real root ids (goatools counts per aspect root),
+# GO:0000005 has two parents
+_terms = [
+    ('GO:0008150', 'biological_process', []),
+    ('GO:0000002', 'biological_process', ['GO:0008150']),
+    ('GO:0000003', 'biological_process', ['GO:0008150']),
+    ('GO:0000004', 'biological_process', ['GO:0000002']),
+    ('GO:0000005', 'biological_process', ['GO:0000002', 'GO:0000003']),
+    ('GO:0000006', 'biological_process', ['GO:0000004']),
+    ('GO:0000007', 'biological_process', ['GO:0000005']),
+    ('GO:0003674', 'molecular_function', []),
+    ('GO:0000011', 'molecular_function', ['GO:0003674']),
+    ('GO:0000012', 'molecular_function', ['GO:0000011']),
+]
+
+go_to_gene = {
+    'GO:0000002': {'A', 'B'},
+    'GO:0000003': {'C'},
+    'GO:0000004': {'A', 'D', 'E'},
+    'GO:0000005': {'B', 'F'},
+    'GO:0000006': {'E'},
+    'GO:0000007': {'F', 'G', 'H'},
+    'GO:0000011': {'A', 'I'},
+    'GO:0000012': {'J'},
+}
+
+
+def _write_obo(file_name, terms):
+    lines = ['format-version: 1.2', '']
+    for go_id, namespace, parents in terms:
+        lines += ['[Term]', 'id: {}'.format(go_id),
+                  'name: term {}'.format(go_id),
+                  'namespace: {}'.format(namespace)]
+        lines += ['is_a: {} ! term {}'.format(p, p) for p in parents]
+        lines.append('')
+    with open(file_name, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def _write_store(file_name, annotations):
+    namespaces = {go_id: namespace for go_id, namespace, _ in _terms}
+    write_go_store(file_name, annotations,
+                   {i: 'term {}'.format(i) for i in annotations},
+                   {i: 1 for i in annotations},
+                   {i: namespaces[i] for i in annotations})
+
+
+@pytest.fixture
+def tiny_go(monkeypatch, tmpdir):
+    """ ontology_tools using a tiny go.obo and GO store """
+    pytest.importorskip('goatools')
+    obo = str(tmpdir.join('go.obo'))
+    store = str(tmpdir.join('hsa_go.store'))
+    _write_obo(obo, _terms)
+    _write_store(store, go_to_gene)
+    monkeypatch.setattr(ot, 'obo_file', obo)
+    monkeypatch.setattr(ot, 'ic_file', str(tmpdir.join('go_ic.npz')))
+    monkeypatch.setattr(ot, 'go_store_path', lambda species='hsa': store)
+    for name in ['_go', '_termcounts', '_go_index', '_information_content']:
+        monkeypatch.setattr(ot, name, None)
+    monkeypatch.setattr(ot, '_magine_go', GOStore(store))
+    return obo, store
+
+
+def test_matrices_match_goatools(tiny_go):
+    from goatools.semantic import resnik_sim, semantic_similarity
+    go = ot.go_dag()
+    termcounts = ot.term_counts()
+    terms = [t for t, _, _ in _terms]
+    aspects = [a for _, a, _ in _terms]
+    similarity = ot.TermSimilarity(terms[:4])
+    dca, resnik, semantic = similarity.matrices(terms)
+
+    # same aspect pairs, goatools fails on identical and cross aspect pairs
+    for i, j in itertools.combinations(range(len(terms)), 2):
+        if aspects[i] != aspects[j]:
+            continue
+        assert resnik[i, j] == pytest.approx(
+            resnik_sim(terms[i], terms[j], go, termcounts))
+        assert semantic[i, j] == pytest.approx(
+            semantic_similarity(terms[i], terms[j], go))
+        assert resnik[j, i] == resnik[i, j]
+        assert semantic[j, i] == semantic[i, j]
+
+    # identical terms: -log(annotated genes / genes of the aspect)
+    counts = [8, 7, 5, 3, 4, 1, 3, 3, 3, 1]
+    totals = [8] * 7 + [3] * 3
+    np.testing.assert_allclose(np.diag(resnik),
+                               -np.log(np.divide(counts, totals)), atol=1e-12)
+    np.testing.assert_allclose(np.diag(semantic), 1.)
+    assert list(np.diag(dca)) == \
+        list(ot.go_index().positions(terms))
+
+    cross = np.not_equal.outer(aspects, aspects)
+    assert (dca[cross] == -1).all()
+    assert np.isnan(resnik[cross]).all()
+    assert np.isnan(semantic[cross]).all()
+    assert not np.isnan(resnik[~cross]).any()
+
+
+def test_cross_aspect_pairs_kept(tiny_go):
+    terms = ['GO:0000006', 'GO:0000007', 'GO:0000012']
+    for verbose in (False, True):
+        assert ot.check_term_list(terms, verbose=verbose) == set(terms)
+
+
+def test_information_content_cache(tiny_go, monkeypatch):
+    ic = ot.goatools_ic()
+    store = tiny_go[1]
+    calls = []
+    term_counts = ot.term_counts
+
+    def counted():
+        calls.append(1)
+        return term_counts()
+
+    monkeypatch.setattr(ot, 'term_counts', counted)
+    index = ot.go_index()
+    values = ot.information_content()
+    assert len(calls) == 1
+    assert os.path.exists(ot.ic_file)
+    np.testing.assert_allclose(values,
+                               [ic(i, term_counts()) for i in index.ids])
+
+    # reloaded from disk without counting terms
+    monkeypatch.setattr(ot, '_information_content', None)
+    np.testing.assert_allclose(ot.information_content(), values)
+    assert len(calls) == 1
+
+    # a changed GO store invalidates the table
+    _write_store(store, dict(go_to_gene, **{'GO:0000003': {'C', 'K', 'L'}}))
+    for name in ['_termcounts', '_information_content']:
+        monkeypatch.setattr(ot, name, None)
+    monkeypatch.setattr(ot, '_magine_go', GOStore(store))
+    updated = ot.information_content()
+    assert len(calls) == 2
+    assert not np.allclose(updated, values)
+    np.testing.assert_allclose(updated,
+                               [ic(i, term_counts()) for i in index.ids])
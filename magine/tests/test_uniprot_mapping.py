@@ -0,0 +1,34 @@
+import pandas as pd
+
+from magine.mappings.databases.download_libraries import fold_id_mapping
+
+columns = ['uniprot', 'mapping_type', 'mapping']
+long_table = pd.DataFrame([
+    ['P2', 'Gene_Name', 'BAX'],
+    ['P2', 'KEGG', 'hsa:581'],
+    ['P2', 'KEGG', 'hsa:582'],
+    ['P2', 'UniRef90', 'UniRef90_P2'],
+    ['P1', 'Gene_Name', 'BCL2'],
+    ['P1', 'Gene_Name', 'BCL-2'],
+    ['P1', 'HGNC', 'HGNC:990'],
+], columns=columns)
+
+
+def test_fold_id_mapping():
+    # chunks of 1 split the mappings of an id across chunks
+    for size in (1, 3):
+        chunks = [long_table[i:i + size]
+                  for i in range(0, len(long_table), size)]
+        wide = fold_id_mapping(chunks,
+                               ['Gene_Name', 'KEGG', 'HGNC', 'UniPathway'])
+        assert list(wide.columns) == ['uniprot', 'Gene_Name', 'KEGG', 'HGNC',
+                                      'UniPathway']
+        assert list(wide['uniprot']) == ['P1', 'P2']
+        assert list(wide['Gene_Name']) == ['BCL2', 'BAX']
+        assert list(wide['KEGG'].fillna('')) == ['', 'hsa:581']
+        assert list(wide['HGNC'].fillna('')) == ['HGNC:990', '']
+        assert wide['UniPathway'].isnull().all()
+
+    empty = fold_id_mapping([], ['Gene_Name'])
+    assert list(empty.columns) == ['uniprot', 'Gene_Name']
+    assert len(empty) == 0
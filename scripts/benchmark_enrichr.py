@@ -0,0 +1,92 @@
+"""
+Benchmark Enrichr client throughput and latency against a local stand-in.
+
+Runs Enrichr.run_samples and Enrichr.run against
+magine.tests.enrichr_server.EnrichrServer for a range of max_workers, so
+concurrency and retry settings can be tuned without hitting the public
+Enrichr service.
+
+Usage
+-----
+python scripts/benchmark_enrichr.py --latency 0.05 --error-rate 0.02 \
+    --workers 1 4 8 16
+"""
+import argparse
+import time
+
+import numpy as np
+
+from magine.enrichment.enrichr import Enrichr
+from magine.tests.enrichr_server import EnrichrServer
+
+
+def benchmark(server, max_workers, n_samples=10, list_size=100,
+              databases=('KEGG_2016', 'Reactome_2016'), n_single=20,
+              max_retries=3, retry_wait=0.05):
+    """ Time run_samples and single gene list runs
+
+    Returns
+    -------
+    dict
+        max_workers, run_samples time and requests/s and run() latency
+        percentiles (seconds)
+    """
+    e = Enrichr(url=server.url, max_workers=max_workers,
+                max_retries=max_retries, retry_wait=retry_wait)
+    databases = list(databases)
+    lists = [server.random_gene_list(list_size) for _ in range(n_samples)]
+    ids = [str(i) for i in range(n_samples)]
+
+    st = time.time()
+    e.run_samples(lists, ids, database=databases)
+    total = time.time() - st
+    n_requests = n_samples * (1 + len(databases))
+
+    latency = []
+    for _ in range(n_single):
+        genes = server.random_gene_list(list_size)
+        st = time.time()
+        e.run(genes, databases)
+        latency.append(time.time() - st)
+    p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+    return dict(max_workers=max_workers, run_samples=total,
+                requests_per_s=n_requests / total, p50=p50, p95=p95, p99=p99)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16])
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.)
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--list-size', type=int, default=100)
+    parser.add_argument('--databases', nargs='+',
+                        default=['KEGG_2016', 'Reactome_2016'])
+    parser.add_argument('--single-runs', type=int, default=20)
+    parser.add_argument('--max-retries', type=int, default=3)
+    parser.add_argument('--retry-wait', type=float, default=0.05)
+    args = parser.parse_args(args)
+
+    server = EnrichrServer(latency=args.latency, jitter=args.jitter,
+                           error_rate=args.error_rate).start()
+    header = '{:>8} {:>12} {:>10} {:>8} {:>8} {:>8}'
+    row = '{max_workers:>8} {run_samples:>12.2f} {requests_per_s:>10.1f} ' \
+          '{p50:>8.3f} {p95:>8.3f} {p99:>8.3f}'
+    print(header.format('workers', 'samples (s)', 'req/s', 'p50', 'p95',
+                        'p99'))
+    try:
+        for n in args.workers:
+            print(row.format(**benchmark(
+                server, n, n_samples=args.samples, list_size=args.list_size,
+                databases=args.databases, n_single=args.single_runs,
+                max_retries=args.max_retries, retry_wait=args.retry_wait
+            )))
+    finally:
+        server.stop()
+    print('Server requests: {}'.format(server.requests))
+
+
+if __name__ == '__main__':
+    main()
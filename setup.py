@@ -43,7 +43,7 @@ setup(
     install_requires=['jinja2',
                           'networkx',
                           'requests',
-                          'pandas',
+                          'pandas>=1.1',
                           'xlrd',
                       'matplotlib',
                           'matplotlib-venn',